@@ -0,0 +1,7 @@
+"""
+Benchmarks of bvm and cloud. Run them with
+
+    python -m benchmarks [--suite vm|storage|api] [--output results.json]
+        [--compare baseline.json]
+"""
+from .common import Result, compare, measure
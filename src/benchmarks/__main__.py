@@ -0,0 +1,98 @@
+import argparse
+import dataclasses
+import datetime
+import json
+import pathlib
+import platform
+import sys
+
+from .common import Result, compare
+
+SUITES = ("vm", "storage", "api")
+
+
+def run_suite(suite: str, args: argparse.Namespace) -> list[Result]:
+    # suites are imported lazily, so that only selected ones are loaded
+    if suite == "vm":
+        from .vm import bench_vm
+
+        return bench_vm(args.repeat, args.program)
+    if suite == "storage":
+        from .storage import bench_storage
+
+        return bench_storage(args.repeat)
+    from .api import bench_api
+
+    return bench_api(args.seconds)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmark bvm and cloud, print results as JSON",
+    )
+    parser.add_argument(
+        "--suite",
+        action="append",
+        choices=SUITES,
+        help="suite to run, all by default; may be repeated",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--seconds",
+        type=float,
+        default=2.0,
+        help="duration of each api throughput measurement",
+    )
+    parser.add_argument(
+        "--program",
+        type=pathlib.Path,
+        action="append",
+        help="extra Brainfuck program for vm suite, e.g. mandelbrot.b",
+    )
+    parser.add_argument("--output", type=pathlib.Path)
+    parser.add_argument(
+        "--compare",
+        type=pathlib.Path,
+        help="results file to compare with; exit code is 1 on regression",
+    )
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    results = []
+    for suite in args.suite or SUITES:
+        print(f"Running {suite} benchmarks", file=sys.stderr)
+        results += run_suite(suite, args)
+
+    report = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": [dataclasses.asdict(result) for result in results],
+    }
+    dumped = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(dumped)
+    else:
+        print(dumped)
+
+    if args.compare:
+        baseline = [
+            Result(**result)
+            for result in json.loads(args.compare.read_text())["results"]
+        ]
+        regressed = False
+        for result, change, worse in compare(
+            results, baseline, args.threshold
+        ):
+            regressed |= worse
+            print(
+                f"{'REGRESSION ' if worse else ''}{result.suite} "
+                f"{result.name} {result.metric}: {change:+.1%}",
+                file=sys.stderr,
+            )
+        return int(regressed)
+    return 0
+
+
+sys.exit(main())
@@ -0,0 +1,127 @@
+import pathlib
+import tempfile
+import time
+from unittest import mock
+
+import anyio
+import sqlalchemy
+from fastapi.testclient import TestClient
+from sqlalchemy import orm
+from sqlalchemy.ext import asyncio as sqlalchemy_asyncio
+
+from cloud import constants, database, tables
+from cloud.app import app
+from cloud.services import alloc
+
+from .common import Result
+
+BATCH_SIZE = 100
+
+
+def throughput(request, seconds: float) -> tuple[float, int]:
+    """
+    Call request for at least seconds
+
+    Returns
+    -------
+    Requests per second and number of requests
+    """
+    requests = 0
+    started = time.perf_counter()
+    while (elapsed := time.perf_counter() - started) < seconds:
+        response = request()
+        response.raise_for_status()
+        requests += 1
+    return requests / elapsed, requests
+
+
+def bench_api(seconds: float = 2.0) -> list[Result]:
+    """
+    Request throughput of /cloud/alloc endpoints through the ASGI app in
+    process, with temporary database and storage
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = pathlib.Path(tmp)
+        url = sqlalchemy.engine.make_url(f"sqlite:///{root / 'db.sqlite3'}")
+        engine = sqlalchemy.create_engine(url, **database.engine_options(url))
+        tables.Base.metadata.create_all(engine)
+        sessions = orm.sessionmaker(engine, autocommit=False, autoflush=False)
+        async_url = database.async_url(str(url))
+        async_engine = sqlalchemy_asyncio.create_async_engine(
+            async_url, **database.engine_options(async_url, is_async=True)
+        )
+        async_sessions = orm.sessionmaker(
+            async_engine,
+            class_=sqlalchemy_asyncio.AsyncSession,
+            autoflush=False,
+            expire_on_commit=False,
+        )
+
+        def session():
+            s = sessions()
+            try:
+                yield s
+            finally:
+                s.close()
+
+        async def async_session():
+            async with async_sessions() as s:
+                yield s
+
+        app.dependency_overrides[database.session] = session
+        app.dependency_overrides[database.async_session] = async_session
+        alloc.vm_cache.clear()
+        # without context manager, so app startup does not touch real
+        #  database
+        client = TestClient(app)
+        try:
+            with mock.patch.object(constants, "BVM_STORAGE_ROOT", root / "vm"):
+                instance_id = client.post("/cloud/alloc/new").json()["id"]
+                ids = [
+                    instance["id"]
+                    for instance in client.post(
+                        "/cloud/alloc/batch",
+                        json={"memory_sizes": [128] * BATCH_SIZE},
+                    ).json()
+                ]
+                requests = {
+                    "POST /cloud/alloc/new": lambda: client.post(
+                        "/cloud/alloc/new"
+                    ),
+                    "GET /cloud/alloc/{id}": lambda: client.get(
+                        f"/cloud/alloc/{instance_id}"
+                    ),
+                    "GET /cloud/alloc?ids=<batch>": lambda: client.get(
+                        "/cloud/alloc", params={"ids": ids}
+                    ),
+                    "POST /cloud/alloc/batch": lambda: client.post(
+                        "/cloud/alloc/batch",
+                        json={"memory_sizes": [128] * BATCH_SIZE},
+                    ),
+                    "GET /cloud/alloc/cache/stats": lambda: client.get(
+                        "/cloud/alloc/cache/stats"
+                    ),
+                }
+                for name, request in requests.items():
+                    rps, count = throughput(request, seconds)
+                    results.append(
+                        Result(
+                            "api",
+                            name,
+                            "requests_per_second",
+                            rps,
+                            "req/s",
+                            params={
+                                "requests": count,
+                                "batch_size": BATCH_SIZE,
+                            },
+                        )
+                    )
+        finally:
+            app.dependency_overrides.pop(database.session, None)
+            app.dependency_overrides.pop(database.async_session, None)
+            alloc.vm_cache.clear()
+            engine.dispose()
+            anyio.run(async_engine.dispose)
+    return results
@@ -0,0 +1,68 @@
+import dataclasses
+import statistics
+import time
+from typing import Callable
+
+
+@dataclasses.dataclass
+class Result:
+    suite: str
+    name: str
+    metric: str
+    value: float
+    unit: str
+    # whether greater value is better, e.g. for throughput
+    higher_is_better: bool = True
+    params: dict = dataclasses.field(default_factory=dict)
+
+    @property
+    def key(self) -> tuple[str, str, str]:
+        return self.suite, self.name, self.metric
+
+
+def measure(
+    function: Callable[[], object], repeat: int = 5, number: int = 1
+) -> float:
+    """
+    Median of repeat timings of calling function number times
+
+    Returns
+    -------
+    Seconds per call
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - started) / number)
+    return statistics.median(timings)
+
+
+def compare(
+    results: list[Result], baseline: list[Result], threshold: float = 0.1
+) -> list[tuple[Result, float, bool]]:
+    """
+    Compare results with baseline results of the same suite, name and
+    metric
+
+    Parameters
+    ----------
+    results : current results
+    baseline : results to compare with
+    threshold : relative change, which is considered a regression
+
+    Returns
+    -------
+    Result, its relative change to baseline, and whether it regressed
+    """
+    baseline_by_key = {result.key: result for result in baseline}
+    compared = []
+    for result in results:
+        base = baseline_by_key.get(result.key)
+        if base is None or base.value == 0:
+            continue
+        change = (result.value - base.value) / base.value
+        worse = -change if result.higher_is_better else change
+        compared.append((result, change, worse > threshold))
+    return compared
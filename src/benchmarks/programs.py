@@ -0,0 +1,22 @@
+"""
+Programs of vm benchmarks: name -> (code, stdin)
+"""
+import random
+
+import bvm
+
+# deterministic input, so runs are comparable across versions
+_rng = random.Random(0)
+LONG_SORT_INPUT = "".join(chr(_rng.randrange(32, 127)) for _ in range(60))
+
+PROGRAMS = {
+    "hello_world_simple": (bvm.code_samples.hello_world_simple, ""),
+    "hello_world_optimized": (bvm.code_samples.hello_world_optimized, ""),
+    "bubble_sort": (bvm.code_samples.bubble_sort, "3985"),
+    "one_to_ten_squares": (bvm.code_samples.one_to_ten_squares, ""),
+    "long_bubble_sort": (bvm.code_samples.bubble_sort, LONG_SORT_INPUT),
+    # nested loops, which cannot be fused into single instructions
+    "nested_loops": ("-[>-[>-[-]+++[>+<-]<-]<-]", ""),
+    # output bound
+    "output_loop": ("-[>-[.-]<-]", ""),
+}
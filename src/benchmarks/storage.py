@@ -0,0 +1,73 @@
+import pathlib
+import tempfile
+
+import numpy as np
+import sqlalchemy
+
+import bvm
+from cloud import storage, tables
+
+from .common import Result, measure
+
+MEMORY_SIZES = (128, 64 * 1024, 1024 * 1024)
+
+
+def bench_storage(
+    repeat: int = 5, memory_sizes: tuple[int, ...] = MEMORY_SIZES
+) -> list[Result]:
+    """
+    Store and load latency of VMs of memory_sizes in each storage backend
+    and of snapshot serialization
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = pathlib.Path(tmp)
+        engine = sqlalchemy.create_engine(f"sqlite:///{root / 'db.sqlite3'}")
+        tables.Base.metadata.create_all(engine)
+        storages = {
+            "filesystem": storage.FilesystemStorage(),
+            "database": storage.DatabaseStorage(engine),
+            "cas": storage.ContentAddressedStorage(root / "cas"),
+        }
+        for memory_size in memory_sizes:
+            vm = bvm.BrainfuckVM(memory_size)
+            vm.upload_code(bvm.code_samples.hello_world_optimized)
+            vm.memory[:] = np.arange(memory_size, dtype=np.uint64) % 256
+            snapshot = bvm.snapshot.dumps(vm)
+            timings = {
+                "snapshot.dumps": measure(
+                    lambda: bvm.snapshot.dumps(vm), repeat
+                ),
+                "snapshot.loads": measure(
+                    lambda: bvm.snapshot.loads(bytearray(snapshot)), repeat
+                ),
+            }
+            for name, vm_storage in storages.items():
+                if name == "filesystem":
+                    location = str(root / f"vm_{memory_size}.bvm")
+                    pathlib.Path(location).touch()
+                else:
+                    location = vm_storage.new_location()
+                timings[f"{name}.store"] = measure(
+                    lambda: vm_storage.store(vm, location), repeat
+                )
+                timings[f"{name}.load"] = measure(
+                    lambda: vm_storage.load(location), repeat
+                )
+            for name, seconds in timings.items():
+                results.append(
+                    Result(
+                        "storage",
+                        f"{name}[{memory_size}]",
+                        "seconds",
+                        seconds,
+                        "s",
+                        higher_is_better=False,
+                        params={
+                            "memory_size": memory_size,
+                            "snapshot_bytes": len(snapshot),
+                        },
+                    )
+                )
+        engine.dispose()
+    return results
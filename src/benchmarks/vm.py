@@ -0,0 +1,98 @@
+import itertools
+import pathlib
+
+import bvm
+
+from .common import Result, measure
+from .programs import PROGRAMS
+
+BATCH_SIZE = 1000
+# steps per run of sliced programs, as jobs of /cloud/exec run in slices
+SLICE_STEPS = 10000
+
+
+def run_program(
+    code: str,
+    stdin: str,
+    backend: bvm.BackendType,
+    slice_steps: int | None = None,
+) -> int:
+    vm = bvm.BrainfuckVM(backend=backend)
+    vm.upload_code(code)
+    vm.input(stdin)
+    if slice_steps is None:
+        vm.execute()
+    else:
+        while vm.run(max_steps=slice_steps) is bvm.RunStatus.STEPS_EXHAUSTED:
+            pass
+    return vm.executed
+
+
+def run_batch(code: str, stdin: str) -> int:
+    batch = bvm.BatchVM(code, [stdin.encode(bvm.IO_ENCODING)] * BATCH_SIZE)
+    batch.run()
+    return int(batch.executed.sum())
+
+
+def bench_vm(
+    repeat: int = 5, programs: list[pathlib.Path] | None = None
+) -> list[Result]:
+    """
+    Steps per second of each program on each backend, run at once and in
+    slices of SLICE_STEPS, and of BATCH_SIZE VMs running it in lockstep
+
+    Parameters
+    ----------
+    repeat : number of runs to take median of
+    programs : files with extra programs to run, e.g. mandelbrot.b
+    """
+    all_programs = dict(PROGRAMS)
+    for path in programs or []:
+        all_programs[path.stem] = path.read_text(), ""
+
+    results = []
+    for name, (code, stdin) in all_programs.items():
+        for backend, slice_steps in itertools.product(
+            bvm.BackendType, (None, SLICE_STEPS)
+        ):
+            steps = run_program(code, stdin, backend, slice_steps)
+            seconds = measure(
+                lambda: run_program(code, stdin, backend, slice_steps), repeat
+            )
+            params = {"backend": backend.value, "steps": steps}
+            variant = backend.value
+            if slice_steps is not None:
+                params["slice_steps"] = slice_steps
+                variant += ",sliced"
+            results += [
+                Result(
+                    "vm",
+                    f"{name}[{variant}]",
+                    "steps_per_second",
+                    steps / seconds,
+                    "steps/s",
+                    params=params,
+                ),
+                Result(
+                    "vm",
+                    f"{name}[{variant}]",
+                    "seconds",
+                    seconds,
+                    "s",
+                    higher_is_better=False,
+                    params=params,
+                ),
+            ]
+        steps = run_batch(code, stdin)
+        seconds = measure(lambda: run_batch(code, stdin), repeat)
+        results.append(
+            Result(
+                "vm",
+                f"{name}[batch]",
+                "steps_per_second",
+                steps / seconds,
+                "steps/s",
+                params={"batch_size": BATCH_SIZE, "steps": steps},
+            )
+        )
+    return results
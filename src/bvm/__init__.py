@@ -1,6 +1,12 @@
-from . import code_samples
-from .bvm import BrainfuckVM
+from . import (backends, batch, channels, code_samples, compiler, optimizer,
+               profiler, registry, snapshot, tape)
+from .backends import (DEFAULT_BACKEND, DEFAULT_EOF, BackendType, EofBehavior,
+                       RunStatus)
+from .batch import BatchVM
+from .bvm import IO_ENCODING, BrainfuckVM
 from .ops import (BrainfuckOp, BrainfuckOpAdd, BrainfuckOpBreakpoint,
                   BrainfuckOpIn, BrainfuckOpLeft, BrainfuckOpLoopBegin,
                   BrainfuckOpLoopEnd, BrainfuckOpOut, BrainfuckOpRight,
                   BrainfuckOpSub)
+from .tape import (DEFAULT_CELL_TYPE, DEFAULT_OVERFLOW, CellType,
+                   OverflowBehavior)
@@ -0,0 +1,630 @@
+import abc
+import collections
+import enum
+import functools
+import hashlib
+import math
+import time
+from typing import Callable
+
+import numpy as np
+import numpy.typing as npt
+
+import bvm
+
+from . import compiler
+
+SCAN_CHUNK_SIZE = 32
+JIT_CACHE_SIZE = 256
+# JIT runs on list copy of tapes of at most so many cells, which it
+# indexes faster, and on memoryview of larger tapes, which it does not copy
+JIT_LIST_TAPE_SIZE = 1 << 16
+# loop iterations between deadline checks
+CLOCK_TICKS = 1024
+
+
+class BackendType(str, enum.Enum):
+    INTERPRETER = "interpreter"
+    JIT = "jit"
+
+
+DEFAULT_BACKEND = BackendType.INTERPRETER
+
+
+class EofBehavior(str, enum.Enum):
+    """
+    What "," does at the end of input: stores 0 or -1 to the cell, or
+    leaves it unchanged
+    """
+
+    ZERO = "zero"
+    MINUS_ONE = "minus_one"
+    UNCHANGED = "unchanged"
+
+
+DEFAULT_EOF = EofBehavior.ZERO
+# "." writes the low byte of the cell
+OUT_MASK = 0xFF
+
+
+class RunStatus(str, enum.Enum):
+    FINISHED = "Finished"
+    STEPS_EXHAUSTED = "Steps exhausted"
+    DEADLINE_EXCEEDED = "Deadline exceeded"
+    BREAKPOINT = "Breakpoint"
+    WAITING_INPUT = "Waiting for input"
+    # "+" or "-" of cell at its bound with OverflowBehavior.ERROR
+    OVERFLOW = "Overflow"
+
+
+def scan(memory: npt.NDArray, ptr: int, step: int) -> tuple[int | None, int]:
+    """
+    Find first zero cell from ptr moving by step with wraparound
+
+    Returns
+    -------
+    Pointer to zero cell, or None if there is no such cell on the way,
+    and number of steps made
+    """
+    size = len(memory)
+    iterations = 0
+    visited = set()
+    while ptr not in visited:
+        visited.add(ptr)
+        cells = memory[ptr::step]
+        chunk_begin, chunk_size = 0, SCAN_CHUNK_SIZE
+        while chunk_begin < len(cells):
+            chunk = cells[chunk_begin : chunk_begin + chunk_size]
+            i = int(chunk.argmin())
+            if chunk[i] == 0:
+                return ptr + (chunk_begin + i) * step, iterations + i
+            iterations += len(chunk)
+            chunk_begin += chunk_size
+            chunk_size *= 8
+        ptr = (ptr + len(cells) * step) % size
+    return None, iterations
+
+
+def budget_iterations(left: int, count: int) -> int:
+    """
+    Iterations of fused loop adding count to executed per iteration, after
+    which budget of left steps runs out, as it would for the loop unfused
+    """
+    return max(-(-left // (count + 1)), 1)
+
+
+def stop_fused_loop(
+    program: compiler.Program,
+    ip: int,
+    memory: npt.NDArray | list[int],
+    ptr: int,
+    size: int,
+    mask: int,
+    iterations: int,
+) -> int:
+    """
+    Leave loop fused into SET at ip after iterations of it, e.g. when
+    budget runs out in the middle of the loop. MULADDs of the loop have
+    added all of its iterations to their targets already, so they are
+    taken back to iterations, and the counter cell at ptr is stepped
+    iterations times
+
+    Returns
+    -------
+    Index of the first instruction of the loop, to resume it from
+    """
+    step = program.args[ip]
+    counter = int(memory[ptr])
+    begin = ip
+    while (
+        begin
+        and program.ops[begin - 1] == compiler.OP_MULADD
+        and program.positions[begin - 1] == program.positions[ip]
+    ):
+        begin -= 1
+        offset, factor = program.args[begin]
+        target = (ptr + offset) % size
+        memory[target] = (
+            int(memory[target]) + factor * (-step * iterations - counter)
+        ) & mask
+    memory[ptr] = (counter + step * iterations) & mask
+    return begin
+
+
+class Backend(abc.ABC):
+    """
+    Engine running program of BrainfuckVM on its state: memory,
+    memory_ptr, code_ptr, executed, stdin and stdout
+    """
+
+    @abc.abstractmethod
+    def run(
+        self,
+        vm: "bvm.BrainfuckVM",
+        max_steps: int | None = None,
+        deadline: float | None = None,
+        wait_for_input: bool = False,
+    ) -> RunStatus:
+        """
+        Run program of vm from its code_ptr until it stops
+
+        Parameters
+        ----------
+        vm : BrainfuckVM to run
+        max_steps : budget of steps: executed ops plus one step per loop
+            iteration, so empty loops exhaust it too. Budget is checked
+            on loop iterations, so it may be overrun by loop-free ops.
+            Fused loops run out of it after as many iterations as
+            unfused ones, and stop at their begin
+        deadline : time.monotonic() value to stop at. Checked every
+            CLOCK_TICKS loop iterations
+        wait_for_input : stop at "," when stdin is empty, instead of
+            reading 0
+
+        Returns
+        -------
+        Why vm stopped. vm.code_ptr is set to op to resume from, and
+        vm.spent to steps of budget spent
+        """
+        pass
+
+
+class InterpreterBackend(Backend):
+    """
+    Reference backend, interpreting compiled program op by op
+    """
+
+    def run(
+        self,
+        vm: "bvm.BrainfuckVM",
+        max_steps: int | None = None,
+        deadline: float | None = None,
+        wait_for_input: bool = False,
+    ) -> RunStatus:
+        program = vm.compiled()
+        ip = program.index_of(vm.code_ptr)
+        if ip is None:
+            # code_ptr points into fused instruction, so run it unfused
+            program = compiler.compile_code(vm.code)
+            ip = vm.code_ptr
+        ops, args, counts = program.ops, program.args, program.counts
+        jumps = program.jumps
+        end = len(ops)
+        memory = vm.memory
+        size = vm.memory_size
+        mask = int(np.iinfo(memory.dtype).max)
+        eof = vm.eof_value()
+        ptr = vm.memory_ptr
+        executed = vm.executed
+        stop_at = math.inf if max_steps is None else executed + max_steps
+        deadline = math.inf if deadline is None else deadline
+        spins = 0
+        ticks = CLOCK_TICKS
+        status = RunStatus.FINISHED
+        try:
+            while ip < end:
+                op = ops[ip]
+                if op == compiler.OP_ADD:
+                    memory[ptr] = (memory.item(ptr) + args[ip]) & mask
+                elif op == compiler.OP_MOVE:
+                    ptr = (ptr + args[ip]) % size
+                elif op == compiler.OP_LOOP_END:
+                    if not memory.item(ptr):
+                        ip += 1
+                        continue
+                    ip = jumps[ip] + 1
+                    spins += 1
+                    ticks -= 1
+                    if executed + spins >= stop_at:
+                        status = RunStatus.STEPS_EXHAUSTED
+                        break
+                    if not ticks:
+                        ticks = CLOCK_TICKS
+                        if time.monotonic() > deadline:
+                            status = RunStatus.DEADLINE_EXCEEDED
+                            break
+                    continue
+                elif op == compiler.OP_LOOP_BEGIN:
+                    if not memory.item(ptr):
+                        ip = jumps[ip]
+                    ip += 1
+                    continue
+                elif op == compiler.OP_SET:
+                    value = memory.item(ptr)
+                    if value:
+                        if args[ip] > 0:
+                            value = -value & mask
+                        left = stop_at - executed - spins
+                        if (
+                            value > 1
+                            and (value - 1) * (counts[ip] + 1) >= left
+                        ):
+                            value = budget_iterations(left, counts[ip])
+                            executed += counts[ip] * value
+                            spins += value
+                            ip = stop_fused_loop(
+                                program, ip, memory, ptr, size, mask, value
+                            )
+                            status = RunStatus.STEPS_EXHAUSTED
+                            break
+                        executed += counts[ip] * value
+                        spins += value
+                        memory[ptr] = 0
+                    ip += 1
+                    continue
+                elif op == compiler.OP_MULADD:
+                    offset, factor = args[ip]
+                    target = (ptr + offset) % size
+                    memory[target] = (
+                        memory.item(target) + factor * memory.item(ptr)
+                    ) & mask
+                elif op == compiler.OP_SCAN:
+                    zero_ptr, iterations = scan(memory, ptr, args[ip])
+                    # budget is checked on all iterations but the last
+                    checked = iterations - (zero_ptr is not None)
+                    left = stop_at - executed - spins
+                    if checked > 0 and checked * (counts[ip] + 1) >= left:
+                        iterations = budget_iterations(left, counts[ip])
+                        executed += counts[ip] * iterations
+                        spins += iterations
+                        ptr = (ptr + args[ip] * iterations) % size
+                        status = RunStatus.STEPS_EXHAUSTED
+                        break
+                    executed += counts[ip] * iterations
+                    spins += iterations
+                    if zero_ptr is None:
+                        # no zero cell on the way, the loop is infinite
+                        ptr = (ptr + args[ip] * iterations) % size
+                        if time.monotonic() > deadline:
+                            status = RunStatus.DEADLINE_EXCEEDED
+                            break
+                        continue
+                    ptr = zero_ptr
+                    ip += 1
+                    continue
+                elif op == compiler.OP_ADD_SATURATE:
+                    value = memory.item(ptr) + args[ip]
+                    memory[ptr] = min(max(value, 0), mask)
+                elif op == compiler.OP_ADD_CHECKED:
+                    value = memory.item(ptr) + args[ip]
+                    if not 0 <= value <= mask:
+                        status = RunStatus.OVERFLOW
+                        break
+                    memory[ptr] = value
+                elif op == compiler.OP_OUT:
+                    vm.stdout.append(memory.item(ptr) & OUT_MASK)
+                elif op == compiler.OP_IN:
+                    if wait_for_input and not vm.stdin:
+                        status = RunStatus.WAITING_INPUT
+                        break
+                    value = vm.stdin.read_byte(eof)
+                    if value is not None:
+                        memory[ptr] = value
+                else:
+                    ip += 1
+                    status = RunStatus.BREAKPOINT
+                    break
+                executed += counts[ip]
+                ip += 1
+        finally:
+            vm.memory_ptr = ptr
+            vm.code_ptr = program.position_of(ip)
+            vm.spent = executed - vm.executed + spins
+            vm.executed = executed
+        return status
+
+
+def scan_list(
+    memory: list[int] | memoryview, ptr: int, step: int, size: int
+) -> tuple[int | None, int]:
+    """
+    Same as scan, but for memory as list, or as memoryview of tape
+    """
+    if isinstance(memory, memoryview):
+        return scan(np.asarray(memory), ptr, step)
+    if step == 1 and 0 in memory:
+        try:
+            zero_ptr = memory.index(0, ptr)
+            return zero_ptr, zero_ptr - ptr
+        except ValueError:
+            zero_ptr = memory.index(0)
+            return zero_ptr, zero_ptr + size - ptr
+    iterations = 0
+    visited = set()
+    while memory[ptr]:
+        if ptr in visited:
+            return None, iterations
+        visited.add(ptr)
+        ptr = (ptr + step) % size
+        iterations += 1
+    return ptr, iterations
+
+
+class JitBackend(Backend):
+    """
+    Backend translating program into Python function with nested while
+    loops for brackets. Function runs program from the instruction at
+    code_ptr, e.g. where the previous slice of the run stopped, entering
+    loops around it in the middle. Translated functions are cached by
+    hash of code and ops, and by the instruction they start at.
+
+    VM stopped in the middle of fused instruction is resumed by
+    InterpreterBackend.
+    """
+
+    def __init__(self, cache_size: int = JIT_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: collections.OrderedDict[
+            str, Callable | None
+        ] = collections.OrderedDict()
+        self._fallback = InterpreterBackend()
+
+    def run(
+        self,
+        vm: "bvm.BrainfuckVM",
+        max_steps: int | None = None,
+        deadline: float | None = None,
+        wait_for_input: bool = False,
+    ) -> RunStatus:
+        function = None
+        # generated code indexes memory of dense tapes only
+        if not vm.sparse:
+            program = vm.compiled()
+            start = program.index_of(vm.code_ptr)
+            if start is not None:
+                function = self.function(program, start)
+        if function is None:
+            return self._fallback.run(vm, max_steps, deadline, wait_for_input)
+
+        if vm.memory_size <= JIT_LIST_TAPE_SIZE:
+            memory = vm.memory.tolist()
+        else:
+            memory = memoryview(vm.memory)
+        executed = vm.executed
+        try:
+            vm.memory_ptr, vm.executed, spins, vm.code_ptr, status = function(
+                memory,
+                vm.memory_ptr,
+                vm.executed,
+                math.inf if max_steps is None else vm.executed + max_steps,
+                math.inf if deadline is None else deadline,
+                vm.memory_size,
+                int(np.iinfo(vm.memory.dtype).max),
+                functools.partial(vm.stdin.read_byte, vm.eof_value()),
+                vm.stdout.append,
+                (lambda: len(vm.stdin)) if wait_for_input else None,
+            )
+        finally:
+            if isinstance(memory, list):
+                vm.memory[:] = memory
+        vm.spent = vm.executed - executed + spins
+        return status
+
+    def function(
+        self, program: compiler.Program, start: int = 0
+    ) -> Callable | None:
+        """
+        Get function translated from program, which runs it from its
+        instruction start
+
+        Returns
+        -------
+        Function, or None if program cannot be translated
+        """
+        # programs of the same code differ for small tapes, see
+        # bvm.optimizer.fitted, so ops are hashed too
+        digest = hashlib.sha256(
+            program.code.encode() + bytes(program.ops)
+        ).hexdigest()
+        key = f"{digest}:{start}"
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        namespace = {
+            "program": program,
+            "budget_iterations": budget_iterations,
+            "stop_fused_loop": stop_fused_loop,
+            "scan_list": scan_list,
+            "monotonic": time.monotonic,
+            "RunStatus": RunStatus,
+        }
+        try:
+            exec(
+                compile(
+                    self.translate(program, start),
+                    f"<bvm-jit {digest[:12]}:{start}>",
+                    "exec",
+                ),
+                namespace,
+            )
+            function = namespace["run"]
+        except (SyntaxError, RecursionError, MemoryError):
+            # too deep nesting of loops for Python compiler
+            function = None
+        self._cache[key] = function
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return function
+
+    @staticmethod
+    def translate(program: compiler.Program, start: int = 0) -> str:
+        """
+        Translate program into source of Python function
+        run(m, p, e, stop, deadline, size, mask, read, write, can_read)
+            -> (p, e, s, code_ptr, status)
+        running program from its instruction start, where s is the number
+        of loop iterations run. Loops around start are entered in the
+        middle: the rest of the iteration start is in runs first, then the
+        loop as usual. Fused loops, which run out of budget, are left by
+        stop_fused_loop of program
+        """
+        lines = [
+            "def run(m, p, e, stop, deadline, size, mask, read, write, "
+            "can_read):",
+            "    s = 0",
+            f"    ticks = {CLOCK_TICKS}",
+        ]
+        indent = 1
+        executed = 0
+
+        def emit(line: str) -> None:
+            lines.append("    " * indent + line)
+
+        def flush_executed() -> None:
+            nonlocal executed
+            if executed:
+                emit(f"e += {executed}")
+                executed = 0
+
+        def emit_stop(code_ptr: int, status: RunStatus) -> None:
+            emit(f"return p, e, s, {code_ptr}, RunStatus.{status.name}")
+
+        def emit_stop_if(
+            condition: str, code_ptr: int, status: RunStatus
+        ) -> None:
+            nonlocal indent
+            emit(f"if {condition}:")
+            indent += 1
+            emit_stop(code_ptr, status)
+            indent -= 1
+
+        def emit_budget_check(code_ptr: int) -> None:
+            nonlocal indent
+            emit_stop_if("e + s >= stop", code_ptr, RunStatus.STEPS_EXHAUSTED)
+            emit("ticks -= 1")
+            emit("if not ticks:")
+            indent += 1
+            emit(f"ticks = {CLOCK_TICKS}")
+            emit_stop_if(
+                "monotonic() > deadline", code_ptr, RunStatus.DEADLINE_EXCEEDED
+            )
+            indent -= 1
+
+        def emit_loop_end(code_ptr: int) -> None:
+            flush_executed()
+            # resume from loop end, which checks loop condition again
+            emit("s += 1")
+            emit_budget_check(code_ptr)
+
+        def emit_ops(begin: int, end: int) -> None:
+            """
+            Emit instructions from begin to end, which match brackets
+            """
+            nonlocal indent, executed
+            for i in range(begin, end):
+                op, arg = program.ops[i], program.args[i]
+                count = program.counts[i]
+                position = program.positions[i]
+                if op == compiler.OP_ADD:
+                    emit(f"m[p] = (m[p] + {arg}) & mask")
+                elif op == compiler.OP_MOVE:
+                    emit(f"p = (p + {arg}) % size")
+                elif op == compiler.OP_LOOP_BEGIN:
+                    flush_executed()
+                    emit("while m[p]:")
+                    indent += 1
+                elif op == compiler.OP_LOOP_END:
+                    emit_loop_end(position)
+                    indent -= 1
+                elif op == compiler.OP_SET:
+                    emit("if m[p]:")
+                    value = "m[p]" if arg < 0 else "(-m[p] & mask)"
+                    emit(f"    i = {value}")
+                    # ops since the last flush are not in e yet
+                    left = f"stop - e - s - {executed}"
+                    emit(f"    if i > 1 and (i - 1) * {count + 1} >= {left}:")
+                    emit(f"        i = budget_iterations({left}, {count})")
+                    emit(
+                        f"        stop_fused_loop(program, {i}, m, p, size, "
+                        "mask, i)"
+                    )
+                    emit(
+                        f"        return p, e + {executed} + {count} * i, "
+                        f"s + i, {position}, RunStatus.STEPS_EXHAUSTED"
+                    )
+                    emit(f"    e += {count} * i")
+                    emit("    s += i")
+                    emit("    m[p] = 0")
+                    continue
+                elif op == compiler.OP_MULADD:
+                    offset, factor = arg
+                    emit(f"t = (p + {offset}) % size")
+                    emit(f"m[t] = (m[t] + {factor} * m[p]) & mask")
+                elif op == compiler.OP_SCAN:
+                    flush_executed()
+                    emit("while True:")
+                    emit(f"    q, i = scan_list(m, p, {arg}, size)")
+                    emit("    left = stop - e - s")
+                    emit("    j = i if q is None else i - 1")
+                    emit(f"    if j > 0 and j * {count + 1} >= left:")
+                    emit(f"        i = budget_iterations(left, {count})")
+                    emit(f"        p = (p + {arg} * i) % size")
+                    emit(
+                        f"        return p, e + {count} * i, s + i, "
+                        f"{position}, RunStatus.STEPS_EXHAUSTED"
+                    )
+                    emit(f"    e += {count} * i")
+                    emit("    s += i")
+                    emit("    if q is not None:")
+                    emit("        p = q")
+                    emit("        break")
+                    indent += 1
+                    emit_budget_check(position)
+                    indent -= 1
+                    continue
+                elif op == compiler.OP_ADD_SATURATE:
+                    emit(f"m[p] = min(max(m[p] + {arg}, 0), mask)")
+                elif op == compiler.OP_ADD_CHECKED:
+                    flush_executed()
+                    emit(f"v = m[p] + {arg}")
+                    emit_stop_if(
+                        "not 0 <= v <= mask", position, RunStatus.OVERFLOW
+                    )
+                    emit("m[p] = v")
+                elif op == compiler.OP_OUT:
+                    emit(f"write(m[p] & {OUT_MASK})")
+                elif op == compiler.OP_IN:
+                    flush_executed()
+                    emit_stop_if(
+                        "can_read is not None and not can_read()",
+                        position,
+                        RunStatus.WAITING_INPUT,
+                    )
+                    emit("c = read()")
+                    emit("if c is not None:")
+                    emit("    m[p] = c")
+                elif op == compiler.OP_BREAKPOINT:
+                    flush_executed()
+                    emit_stop(program.position_of(i + 1), RunStatus.BREAKPOINT)
+                executed += count
+
+        # loops around start, innermost last
+        enclosing = [
+            begin
+            for begin in range(start)
+            if program.ops[begin] == compiler.OP_LOOP_BEGIN
+            and program.jumps[begin] >= start
+        ]
+        ip = start
+        for begin in reversed(enclosing):
+            end = program.jumps[begin]
+            if ip < end:
+                emit_ops(ip, end)
+                emit_loop_end(program.positions[end])
+            emit_ops(begin, end + 1)
+            ip = end + 1
+        emit_ops(ip, len(program))
+        flush_executed()
+        emit(f"return p, e, s, {len(program.code)}, RunStatus.FINISHED")
+        return "\n".join(lines) + "\n"
+
+
+BACKENDS: dict[BackendType, Backend] = {
+    BackendType.INTERPRETER: InterpreterBackend(),
+    BackendType.JIT: JitBackend(),
+}
+
+
+def get_backend(backend: BackendType) -> Backend:
+    return BACKENDS[BackendType(backend)]
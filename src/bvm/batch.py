@@ -0,0 +1,361 @@
+"""
+Lockstep execution of one program on many VMs.
+
+BatchVM keeps tapes of N VMs as rows of one 2-D array with a pointer per
+VM, and steps all of them through the shared optimized program: each
+instruction is one NumPy operation on the rows of VMs it is active for.
+Loops diverge by masks: VMs, whose cell is zero, skip or exit the loop
+and wait at its end, until the rest of VMs exit it too. So every VM
+executes the same ops as a separate BrainfuckVM would, while the
+interpreter overhead is paid once per instruction for the whole batch.
+"""
+import math
+import time
+
+import numpy as np
+import numpy.typing as npt
+
+from . import backends, bvm, channels, compiler, optimizer, registry, tape
+
+
+def scan_rows(
+    memory: npt.NDArray,
+    rows: npt.NDArray[np.intp],
+    ptrs: npt.NDArray[np.int64],
+    step: int,
+) -> tuple[npt.NDArray[np.int64], list[int]]:
+    """
+    Move pointers of rows by step to the first zero cell, as
+    backends.scan does. Pointers of all rows are moved together for
+    backends.SCAN_CHUNK_SIZE steps, then the rest of rows are scanned
+    one by one
+
+    Returns
+    -------
+    Number of steps made by each of rows, and rows without zero cells
+    on the way
+    """
+    size = memory.shape[1]
+    iterations = np.zeros(len(rows), np.int64)
+    scanning = np.flatnonzero(memory[rows, ptrs[rows]])
+    for _ in range(backends.SCAN_CHUNK_SIZE):
+        if not len(scanning):
+            return iterations, []
+        moving = rows[scanning]
+        ptrs[moving] = (ptrs[moving] + step) % size
+        iterations[scanning] += 1
+        scanning = scanning[memory[moving, ptrs[moving]] != 0]
+    infinite = []
+    for i, row in zip(scanning.tolist(), rows[scanning].tolist()):
+        zero_ptr, steps = backends.scan(memory[row], int(ptrs[row]), step)
+        iterations[i] += steps
+        if zero_ptr is None:
+            infinite.append(row)
+        else:
+            ptrs[row] = zero_ptr
+    return iterations, infinite
+
+
+class BatchVM:
+    """
+    N VMs running the same code on their own stdin
+    """
+
+    def __init__(
+        self,
+        code: str,
+        stdins: list[bytes],
+        memory_size: int = bvm.DEFAULT_MEMORY_SIZE,
+        cell_type: tape.CellType = tape.DEFAULT_CELL_TYPE,
+        eof: backends.EofBehavior = backends.DEFAULT_EOF,
+        overflow: tape.OverflowBehavior = tape.DEFAULT_OVERFLOW,
+    ):
+        if not bvm.is_memory_size_valid(memory_size):
+            raise ValueError(
+                f"BatchVM cannot be initialized with memory_size={memory_size}"
+            )
+        if not stdins:
+            raise ValueError("BatchVM cannot be initialized without VMs")
+        self.overflow = tape.OverflowBehavior(overflow)
+        program = registry.programs.register(code)
+        self.program = optimizer.fitted(program, memory_size, self.overflow)
+        self.code = program.code
+        self.memory_size = memory_size
+        self.memory = np.zeros(
+            (len(stdins), memory_size), tape.CellType(cell_type).value
+        )
+        self.memory_ptrs = np.zeros(len(stdins), np.int64)
+        self.code_ptrs = np.zeros(len(stdins), np.int64)
+        self.executed = np.zeros(len(stdins), np.int64)
+        self.eof = backends.EofBehavior(eof)
+        self.stdins = [channels.ByteChannel(data) for data in stdins]
+        self.stdouts = [channels.ByteChannel() for _ in stdins]
+        self.statuses: list[backends.RunStatus] | None = None
+
+    def __len__(self) -> int:
+        return len(self.stdins)
+
+    def run(
+        self, max_steps: int | None = None, deadline: float | None = None
+    ) -> list[backends.RunStatus]:
+        """
+        Run all VMs from the start of code, until each of them finishes
+        or runs out of max_steps or deadline. Breakpoints are ignored.
+        VM in loop scanning for zero cell, that has no zero cells, stops
+        at once, as it would loop until it runs out of budget
+
+        Parameters
+        ----------
+        max_steps : budget of steps of each VM, as for BrainfuckVM.run
+        deadline : time.monotonic() value to stop all VMs at
+
+        Raises
+        ------
+        ValueError : if batch has run already
+
+        Returns
+        -------
+        Why each VM stopped
+        """
+        if self.statuses is not None:
+            raise ValueError("BatchVM has run already")
+        program = self.program
+        ops, args, counts = program.ops, program.args, program.counts
+        jumps = program.jumps
+        end = len(ops)
+        memory = self.memory
+        ptrs = self.memory_ptrs
+        executed = self.executed
+        size = self.memory_size
+        cell = memory.dtype.type
+        mask = int(np.iinfo(memory.dtype).max)
+        eof = (
+            None
+            if self.eof is backends.EofBehavior.UNCHANGED
+            else mask
+            if self.eof is backends.EofBehavior.MINUS_ONE
+            else 0
+        )
+        stop_at = math.inf if max_steps is None else max_steps
+        infinite_status = (
+            backends.RunStatus.DEADLINE_EXCEEDED
+            if max_steps is None
+            else backends.RunStatus.STEPS_EXHAUSTED
+        )
+        deadline = math.inf if deadline is None else deadline
+        statuses: list[backends.RunStatus | None] = [None] * len(self)
+        spins = np.zeros(len(self), np.int64)
+        running = np.ones(len(self), bool)
+        active = running.copy()
+        rows = np.flatnonzero(active)
+        # masks of VMs active before entering loops, with their loop ends
+        entered: list[tuple[npt.NDArray[np.bool_], int]] = []
+        # executed ops not yet added to executed of active VMs
+        pending = 0
+        ticks = backends.CLOCK_TICKS
+        ip = 0
+
+        def stop(
+            stopped: npt.NDArray[np.intp], status: backends.RunStatus, at: int
+        ) -> None:
+            for row in stopped.tolist():
+                statuses[row] = status
+            running[stopped] = False
+            self.code_ptrs[stopped] = program.position_of(at)
+
+        while ip < end:
+            op = ops[ip]
+            if op == compiler.OP_ADD:
+                memory[rows, ptrs[rows]] += cell(args[ip] & mask)
+            elif op == compiler.OP_MOVE:
+                ptrs[rows] = (ptrs[rows] + args[ip]) % size
+            elif op == compiler.OP_LOOP_BEGIN or op == compiler.OP_LOOP_END:
+                executed[rows] += pending
+                pending = 0
+                looping = rows[memory[rows, ptrs[rows]] != 0]
+                if op == compiler.OP_LOOP_BEGIN:
+                    if not len(looping):
+                        ip = jumps[ip] + 1
+                        continue
+                    entered.append((active, jumps[ip]))
+                else:
+                    spins[looping] += 1
+                    exhausted = executed[looping] + spins[looping] >= stop_at
+                    if exhausted.any():
+                        stop(
+                            looping[exhausted],
+                            backends.RunStatus.STEPS_EXHAUSTED,
+                            jumps[ip] + 1,
+                        )
+                        looping = looping[~exhausted]
+                    if not len(looping):
+                        active = entered.pop()[0] & running
+                        rows = np.flatnonzero(active)
+                        ip += 1
+                        continue
+                    ticks -= 1
+                    if not ticks:
+                        ticks = backends.CLOCK_TICKS
+                        if time.monotonic() > deadline:
+                            stop(
+                                looping,
+                                backends.RunStatus.DEADLINE_EXCEEDED,
+                                jumps[ip] + 1,
+                            )
+                            break
+                    ip = jumps[ip]
+                active = np.zeros(len(self), bool)
+                active[looping] = True
+                rows = looping
+                ip += 1
+                continue
+            elif op == compiler.OP_SET:
+                cols = ptrs[rows]
+                values = memory[rows, cols].astype(np.int64)
+                if args[ip] > 0:
+                    values = -values & mask
+                if max_steps is not None:
+                    left = stop_at - pending - executed[rows] - spins[rows]
+                    capped = (values > 1) & (
+                        (values - 1) * (counts[ip] + 1) >= left
+                    )
+                    if capped.any():
+                        executed[rows] += pending
+                        pending = 0
+                        stopped = rows[capped]
+                        for row, row_left in zip(
+                            stopped.tolist(), left[capped].tolist()
+                        ):
+                            iterations = backends.budget_iterations(
+                                row_left, counts[ip]
+                            )
+                            executed[row] += counts[ip] * iterations
+                            begin = backends.stop_fused_loop(
+                                program,
+                                ip,
+                                memory[row],
+                                int(ptrs[row]),
+                                size,
+                                mask,
+                                iterations,
+                            )
+                        stop(
+                            stopped, backends.RunStatus.STEPS_EXHAUSTED, begin
+                        )
+                        active = active & running
+                        rows, cols = rows[~capped], cols[~capped]
+                        values = values[~capped]
+                executed[rows] += counts[ip] * values
+                spins[rows] += values
+                memory[rows, cols] = 0
+                ip += 1
+                continue
+            elif op == compiler.OP_MULADD:
+                offset, factor = args[ip]
+                cols = ptrs[rows]
+                memory[rows, (cols + offset) % size] += memory[
+                    rows, cols
+                ] * cell(factor & mask)
+            elif op == compiler.OP_SCAN:
+                executed[rows] += pending
+                pending = 0
+                starts = ptrs[rows]
+                iterations, infinite = scan_rows(memory, rows, ptrs, args[ip])
+                if max_steps is not None:
+                    # budget is checked on all iterations but the last
+                    checked = np.where(
+                        np.isin(rows, infinite), iterations, iterations - 1
+                    )
+                    left = stop_at - executed[rows] - spins[rows]
+                    capped = (checked > 0) & (
+                        checked * (counts[ip] + 1) >= left
+                    )
+                    if capped.any():
+                        stopped = rows[capped]
+                        steps = np.array(
+                            [
+                                backends.budget_iterations(
+                                    row_left, counts[ip]
+                                )
+                                for row_left in left[capped].tolist()
+                            ],
+                            np.int64,
+                        )
+                        ptrs[stopped] = (
+                            starts[capped] + args[ip] * steps
+                        ) % size
+                        executed[stopped] += counts[ip] * steps
+                        stop(stopped, backends.RunStatus.STEPS_EXHAUSTED, ip)
+                        infinite = [row for row in infinite if running[row]]
+                        active = active & running
+                        rows, iterations = rows[~capped], iterations[~capped]
+                executed[rows] += counts[ip] * iterations
+                spins[rows] += iterations
+                if infinite:
+                    stop(np.array(infinite), infinite_status, ip)
+                    active = active & running
+                    rows = np.flatnonzero(active)
+                ip += 1
+                continue
+            elif op == compiler.OP_ADD_SATURATE:
+                cols = ptrs[rows]
+                memory[rows, cols] = np.clip(
+                    memory[rows, cols].astype(np.int64) + args[ip], 0, mask
+                )
+            elif op == compiler.OP_ADD_CHECKED:
+                cols = ptrs[rows]
+                values = memory[rows, cols].astype(np.int64) + args[ip]
+                overflow = (values < 0) | (values > mask)
+                if overflow.any():
+                    executed[rows] += pending
+                    pending = 0
+                    stop(rows[overflow], backends.RunStatus.OVERFLOW, ip)
+                    active = active & running
+                    rows, cols = rows[~overflow], cols[~overflow]
+                    values = values[~overflow]
+                memory[rows, cols] = values
+            elif op == compiler.OP_OUT:
+                for row, value in zip(
+                    rows.tolist(), memory[rows, ptrs[rows]].tolist()
+                ):
+                    self.stdouts[row].append(value & backends.OUT_MASK)
+            elif op == compiler.OP_IN:
+                for row, ptr in zip(rows.tolist(), ptrs[rows].tolist()):
+                    value = self.stdins[row].read_byte(eof)
+                    if value is not None:
+                        memory[row, ptr] = value
+            pending += counts[ip]
+            ip += 1
+        else:
+            executed[rows] += pending
+            stop(rows, backends.RunStatus.FINISHED, end)
+
+        # on deadline, VMs waiting at loop ends resume after them
+        for waiting, loop_end in reversed(entered):
+            stop(
+                np.flatnonzero(waiting & running),
+                backends.RunStatus.DEADLINE_EXCEEDED,
+                loop_end + 1,
+            )
+        self.statuses = statuses
+        return statuses
+
+    def vm(self, index: int) -> bvm.BrainfuckVM:
+        """
+        State of VM by index as BrainfuckVM, e.g. to resume or store it
+        """
+        vm = bvm.BrainfuckVM(
+            self.memory_size,
+            memory=self.memory[index].copy(),
+            cell_type=self.memory.dtype.name,
+            eof=self.eof,
+            overflow=self.overflow,
+        )
+        vm.code = self.code
+        vm.program = self.program
+        vm.memory_ptr = int(self.memory_ptrs[index])
+        vm.code_ptr = int(self.code_ptrs[index])
+        vm.executed = int(self.executed[index])
+        vm.stdin.write(self.stdins[index].getvalue())
+        vm.stdout.write(self.stdouts[index].getvalue())
+        return vm
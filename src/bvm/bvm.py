@@ -1,50 +1,108 @@
-import queue
-
 import numpy as np
 import numpy.typing as npt
 
-import bvm
+from . import (
+    backends,
+    channels,
+    compiler,
+    optimizer,
+    profiler,
+    registry,
+    tape,
+)
 
 DEFAULT_MEMORY_SIZE = 128
-DEFAULT_STACK_SIZE = 1000
+# str of stdin and stdout has a char per byte
+IO_ENCODING = "latin-1"
 
 
 def is_memory_size_valid(memory_size: int) -> bool:
     return memory_size > 0
 
 
+def read_only_view(memory: npt.NDArray) -> npt.NDArray:
+    view = memory.view()
+    view.flags.writeable = False
+    return view
+
+
 class BrainfuckVM:
     __slots__ = (
         "memory_size",
         "memory",
+        "sparse",
+        "eof",
+        "overflow",
         "memory_ptr",
         "code",
         "code_ptr",
         "executed",
-        "stack",
+        "spent",
+        "program",
+        "backend",
         "stdin",
         "stdout",
-        "_ops",
+        "profile",
+        "base_memory",
+        "base_stdout",
+        "base_code",
+        "base_tag",
     )
 
-    def __init__(self, memory_size: int = DEFAULT_MEMORY_SIZE):
+    def __init__(
+        self,
+        memory_size: int = DEFAULT_MEMORY_SIZE,
+        backend: backends.BackendType = backends.DEFAULT_BACKEND,
+        memory: npt.NDArray | None = None,
+        sparse: bool = False,
+        cell_type: tape.CellType = tape.DEFAULT_CELL_TYPE,
+        eof: backends.EofBehavior = backends.DEFAULT_EOF,
+        overflow: tape.OverflowBehavior = tape.DEFAULT_OVERFLOW,
+    ):
         if not is_memory_size_valid(memory_size):
             raise ValueError(
                 f"BrainfuckVM cannot be initialized with memory_size={memory_size}"
             )
         self.memory_size = memory_size
-        self.memory = np.zeros(memory_size, np.uint8)
+        # sparse tape allocates pages on first touch, see tape
+        self.sparse = sparse
+        cell_type = tape.CellType(cell_type)
+        if memory is None:
+            memory = tape.zeros(memory_size, sparse, cell_type.value)
+        elif len(memory) != memory_size:
+            raise ValueError(
+                f"BrainfuckVM memory of {len(memory)} cells does not match "
+                f"memory_size={memory_size}"
+            )
+        elif memory.dtype != cell_type.value:
+            raise ValueError(
+                f"BrainfuckVM memory of {memory.dtype} cells does not match "
+                f"cell_type={cell_type.value}"
+            )
+        self.memory = memory
         self.memory_ptr = 0
         self.code: str | None = None
         self.code_ptr = 0
         self.executed = 0
-        self.stack = queue.LifoQueue(maxsize=DEFAULT_STACK_SIZE)
-        self.stdin = queue.Queue()
-        self.stdout = queue.Queue()
-        self._ops = {}
-        for op_cls in bvm.BrainfuckOp.__subclasses__():
-            op = op_cls(self)
-            self._ops |= {repr(op): op}
+        # steps of max_steps budget spent by the last run
+        self.spent = 0
+        self.program: compiler.Program | None = None
+        self.backend = backends.BackendType(backend)
+        self.eof = backends.EofBehavior(eof)
+        self.overflow = tape.OverflowBehavior(overflow)
+        self.stdin = channels.ByteChannel()
+        self.stdout = channels.ByteChannel()
+        # set to profiler.Profile() to profile runs
+        self.profile: profiler.Profile | None = None
+        # memory and stdout as they were stored, see mark_stored
+        self.base_memory: npt.NDArray | None = None
+        self.base_stdout: bytes | None = None
+        self.base_code: str | None = None
+        self.base_tag: object = None
+
+    @property
+    def cell_type(self) -> tape.CellType:
+        return tape.CellType(self.memory.dtype.name)
 
     @property
     def curr_memory(self) -> np.uint8:
@@ -72,34 +130,157 @@ class BrainfuckVM:
         return self.code[self.code_ptr - 4 : self.code_ptr + 5]
 
     def minified_code(self, source: str) -> str:
-        return "".join(s for s in source if s in self._ops.keys())
+        return compiler.minified(source)
 
     def upload_code(self, src: str) -> None:
-        self.code = self.minified_code(src)
+        program = registry.programs.register(src)
+        self.program = optimizer.fitted(
+            program, self.memory_size, self.overflow
+        )
+        self.code = program.code
 
-    def char_from_stdin(self) -> int:
-        if self.stdin.empty():
-            return 0
-        return ord(self.stdin.get_nowait())
+    def compiled(self) -> compiler.Program:
+        if self.program is None or self.program.code is not self.code:
+            program = registry.programs.compiled(self.code)
+            self.program = optimizer.fitted(
+                program, self.memory_size, self.overflow
+            )
+            self.code = program.code
+        return self.program
 
-    def execute(self) -> None:
+    def own_memory(self) -> None:
+        """
+        Copy memory, if it is read-only, e.g. shared with forked VMs
+        """
+        if not self.memory.flags.writeable:
+            self.memory = tape.copy(self.memory, self.sparse)
+
+    def mark_stored(self, tag: object = None) -> None:
+        """
+        Remember memory, stdout and code as stored, with tag of storage.
+        Memory becomes copy-on-write, so remembered memory is not changed
+        """
+        self.memory = read_only_view(self.memory)
+        self.base_memory = self.memory
+        self.base_stdout = self.stdout.getvalue()
+        self.base_code = self.code
+        self.base_tag = tag
+
+    def dirty_pages(self, page_size: int) -> npt.NDArray[np.intp] | None:
+        """
+        Indexes of memory pages of page_size cells changed since
+        mark_stored, or None if it was not called
+        """
+        if self.base_memory is None:
+            return None
+        if self.memory is self.base_memory:
+            return np.empty(0, np.intp)
+        return tape.changed_pages(
+            self.memory, self.base_memory, self.sparse, page_size
+        )
+
+    def fork(self) -> "BrainfuckVM":
+        """
+        Create VM in the same state. Code, compiled program and memory are
+        shared; memory is copy-on-write: both VMs get read-only view of
+        it, and each copies it on its first write
+        """
+        self.memory = read_only_view(self.memory)
+        child = BrainfuckVM(
+            self.memory_size,
+            self.backend,
+            read_only_view(self.memory),
+            self.sparse,
+            self.cell_type,
+            self.eof,
+            self.overflow,
+        )
+        child.memory_ptr = self.memory_ptr
+        child.code = self.code
+        child.code_ptr = self.code_ptr
+        child.executed = self.executed
+        child.program = self.program
+        child.stdin.write(self.stdin.getvalue())
+        child.stdout.write(self.stdout.getvalue())
+        return child
+
+    def eof_value(self) -> int | None:
+        """
+        Value "," stores at the end of input, None to leave cell unchanged
+        """
+        if self.eof is backends.EofBehavior.UNCHANGED:
+            return None
+        if self.eof is backends.EofBehavior.MINUS_ONE:
+            return int(np.iinfo(self.memory.dtype).max)
+        return 0
+
+    def char_from_stdin(self) -> int | None:
+        return self.stdin.read_byte(self.eof_value())
+
+    def run(
+        self,
+        max_steps: int | None = None,
+        deadline: float | None = None,
+        wait_for_input: bool = False,
+    ) -> backends.RunStatus:
+        """
+        Run code from code_ptr until it finishes, hits breakpoint, runs
+        out of max_steps or deadline, or waits for input. Next call
+        resumes from where this one stopped.
+
+        Parameters
+        ----------
+        max_steps : budget of executed ops; each loop iteration costs one
+            more step, so infinite empty loops run out of it too
+        deadline : time.monotonic() value to stop at
+        wait_for_input : stop at "," with empty stdin instead of reading 0
+
+        Returns
+        -------
+        Why run stopped. spent is set to steps of budget the run spent,
+        which may exceed executed ops by loop iterations
+        """
         if not self.code:
             raise ValueError("No code loaded to BrainfuckVM")
-        while self.code_ptr < len(self.code):
-            op: bvm.BrainfuckOp = self._ops.get(self.curr_op)
-            op.eval()
-            self.code_ptr += 1
-            if op.countable:
-                self.executed += 1
-            assert True
+        self.own_memory()
+        backend = (
+            profiler.BACKEND
+            if self.profile is not None
+            else backends.get_backend(self.backend)
+        )
+        return backend.run(self, max_steps, deadline, wait_for_input)
 
-    @property
-    def stack_view(self) -> str:
-        return str(self.stack.queue)
+    def execute(self) -> None:
+        """
+        Run code to the end, through breakpoints
+
+        Raises
+        ------
+        OverflowError : if cell overflows with OverflowBehavior.ERROR
+        """
+        while True:
+            status = self.run()
+            if status is backends.RunStatus.FINISHED:
+                return
+            if status is backends.RunStatus.OVERFLOW:
+                raise OverflowError(
+                    f"Cell {self.memory_ptr} overflows at op {self.code_ptr}"
+                )
+
+    def feed(self, data: bytes) -> None:
+        """
+        Append data to stdin
+        """
+        self.stdin.write(data)
+
+    def drain(self) -> bytes:
+        """
+        Take all output from stdout
+        """
+        return self.stdout.read()
 
     def stdout_as_str(self) -> str:
-        return "".join(self.stdout.queue)
+        return self.stdout.getvalue().decode(IO_ENCODING)
 
     def input(self, s: str) -> None:
-        for c in s:
-            self.stdin.put(c)
+        self.feed(s.encode(IO_ENCODING))
@@ -0,0 +1,53 @@
+class ByteChannel:
+    """
+    FIFO of bytes backed by bytearray with read cursor. Read bytes are
+    dropped from the buffer lazily, when they make up most of it
+    """
+
+    __slots__ = ("_buffer", "_pos")
+
+    def __init__(self, data: bytes = b""):
+        self._buffer = bytearray(data)
+        self._pos = 0
+
+    def __len__(self) -> int:
+        return len(self._buffer) - self._pos
+
+    def write(self, data: bytes) -> None:
+        self._compact()
+        self._buffer += data
+
+    def append(self, byte: int) -> None:
+        self._buffer.append(byte)
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Read at most size bytes, all bytes if size is negative
+        """
+        end = len(self._buffer)
+        if 0 <= size < end - self._pos:
+            end = self._pos + size
+        data = bytes(self._buffer[self._pos : end])
+        self._pos = end
+        self._compact()
+        return data
+
+    def read_byte(self, default: int | None = 0) -> int | None:
+        """
+        Read one byte, or get default if channel is empty
+        """
+        if self._pos >= len(self._buffer):
+            return default
+        self._pos += 1
+        return self._buffer[self._pos - 1]
+
+    def getvalue(self) -> bytes:
+        """
+        Get unread bytes without reading them
+        """
+        return bytes(self._buffer[self._pos :])
+
+    def _compact(self) -> None:
+        if self._pos > len(self._buffer) // 2:
+            del self._buffer[: self._pos]
+            self._pos = 0
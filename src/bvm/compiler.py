@@ -0,0 +1,151 @@
+import re
+
+OP_ADD = 0
+OP_MOVE = 1
+OP_OUT = 2
+OP_IN = 3
+OP_LOOP_BEGIN = 4
+OP_LOOP_END = 5
+OP_BREAKPOINT = 6
+# fused ops, produced by bvm.optimizer
+OP_SET = 7
+OP_MULADD = 8
+OP_SCAN = 9
+# "+" and "-" of cells, which do not wrap, see bvm.optimizer.fitted
+OP_ADD_SATURATE = 10
+OP_ADD_CHECKED = 11
+
+# op char -> (opcode, arg)
+OPCODES = {
+    "+": (OP_ADD, 1),
+    "-": (OP_ADD, -1),
+    ">": (OP_MOVE, 1),
+    "<": (OP_MOVE, -1),
+    ".": (OP_OUT, None),
+    ",": (OP_IN, None),
+    "[": (OP_LOOP_BEGIN, None),
+    "]": (OP_LOOP_END, None),
+    "#": (OP_BREAKPOINT, None),
+}
+UNCOUNTABLE_OPS = frozenset(("[", "]", "#"))
+NON_OPS = re.compile(r"[^+\-<>.,\[\]#]+")
+
+NO_JUMP = -1
+
+
+class Program:
+    """
+    Compiled form of minified Brainfuck code.
+
+    Instruction i is ops[i] with argument args[i]. It was compiled from
+    the ops of code starting at positions[i], and it adds counts[i] to
+    BrainfuckVM.executed (fused loops add counts[i] per loop iteration).
+    jumps[i] is the index of the matching bracket instruction, or NO_JUMP
+    for non-bracket instructions; brackets of code are matched by
+    source_jump instead, as fused loops have no bracket instructions.
+    """
+
+    __slots__ = (
+        "code",
+        "ops",
+        "args",
+        "counts",
+        "positions",
+        "jumps",
+        "_indexes",
+        "_source_jumps",
+    )
+
+    def __init__(
+        self,
+        code: str,
+        ops: tuple[int, ...],
+        args: tuple,
+        counts: tuple[int, ...],
+        positions: tuple[int, ...],
+    ):
+        self.code = code
+        self.ops = ops
+        self.args = args
+        self.counts = counts
+        self.positions = positions
+        self.jumps = bracket_jumps(ops)
+        self._indexes: dict[int, int] | None = None
+        self._source_jumps: tuple[int, ...] | None = None
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    def index_of(self, code_ptr: int) -> int | None:
+        """
+        Index of instruction starting at code_ptr, or None if code_ptr
+        points into the middle of a fused instruction
+        """
+        if self._indexes is None:
+            self._indexes = {}
+            for i, position in enumerate(self.positions):
+                self._indexes.setdefault(position, i)
+            self._indexes[len(self.code)] = len(self.ops)
+        return self._indexes.get(code_ptr)
+
+    def source_jump(self, code_ptr: int) -> int:
+        """
+        Position of bracket of code matching the one at code_ptr
+        """
+        if self._source_jumps is None:
+            self._source_jumps = compile_code(self.code).jumps
+        return self._source_jumps[code_ptr]
+
+    def position_of(self, index: int) -> int:
+        if index >= len(self.ops):
+            return len(self.code)
+        return self.positions[index]
+
+
+def minified(source: str) -> str:
+    return NON_OPS.sub("", source)
+
+
+def bracket_jumps(ops: tuple[int, ...]) -> tuple[int, ...]:
+    """
+    Match bracket instructions of ops
+
+    Raises
+    ------
+    ValueError : if brackets are unbalanced
+
+    Returns
+    -------
+    Index of matching bracket for each instruction of ops
+    """
+    jumps = [NO_JUMP] * len(ops)
+    opened = []
+    for i, op in enumerate(ops):
+        if op == OP_LOOP_BEGIN:
+            opened.append(i)
+        elif op == OP_LOOP_END:
+            if not opened:
+                raise ValueError(f"Unmatched ']' at position {i}")
+            begin = opened.pop()
+            jumps[begin] = i
+            jumps[i] = begin
+    if opened:
+        raise ValueError(f"Unmatched '[' at position {opened[-1]}")
+    return tuple(jumps)
+
+
+def compile_code(code: str) -> Program:
+    """
+    Compile minified code into instruction array with bracket jump table,
+    one instruction per op
+
+    Raises
+    ------
+    ValueError : if code contains non-Brainfuck ops or unbalanced brackets
+    """
+    try:
+        ops, args = zip(*(OPCODES[c] for c in code)) if code else ((), ())
+    except KeyError as e:
+        raise ValueError(f"Unknown op {e.args[0]!r} in code") from None
+    counts = tuple(int(c not in UNCOUNTABLE_OPS) for c in code)
+    return Program(code, ops, args, counts, tuple(range(len(code))))
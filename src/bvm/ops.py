@@ -19,6 +19,7 @@ class BrainfuckOp(abc.ABC):
 
 class BrainfuckOpAdd(BrainfuckOp):
     def eval(self) -> None:
+        self.vm.own_memory()
         self.vm.memory[self.vm.memory_ptr] += 1
 
     def __repr__(self):
@@ -27,6 +28,7 @@ class BrainfuckOpAdd(BrainfuckOp):
 
 class BrainfuckOpSub(BrainfuckOp):
     def eval(self) -> None:
+        self.vm.own_memory()
         self.vm.memory[self.vm.memory_ptr] -= 1
 
     def __repr__(self):
@@ -55,7 +57,9 @@ class BrainfuckOpRight(BrainfuckOp):
 
 class BrainfuckOpOut(BrainfuckOp):
     def eval(self) -> None:
-        self.vm.stdout.put(chr(self.vm.memory[self.vm.memory_ptr]))
+        self.vm.stdout.append(
+            int(self.vm.memory[self.vm.memory_ptr]) & bvm.backends.OUT_MASK
+        )
 
     def __repr__(self):
         return "."
@@ -63,7 +67,10 @@ class BrainfuckOpOut(BrainfuckOp):
 
 class BrainfuckOpIn(BrainfuckOp):
     def eval(self) -> None:
-        self.vm.memory[self.vm.memory_ptr] = self.vm.char_from_stdin()
+        value = self.vm.char_from_stdin()
+        if value is not None:
+            self.vm.own_memory()
+            self.vm.memory[self.vm.memory_ptr] = value
 
     def __repr__(self):
         return ","
@@ -74,20 +81,11 @@ class BrainfuckOpLoopBegin(BrainfuckOp):
         super().__init__(vm, countable=False)
 
     def go_to_closing_bracket(self) -> None:
-        nesting_level = 1
-        while nesting_level > 0:
-            self.vm.code_ptr += 1
-            match self.vm.code[self.vm.code_ptr]:
-                case "[":
-                    nesting_level += 1
-                case "]":
-                    nesting_level -= 1
+        self.vm.code_ptr = self.vm.compiled().source_jump(self.vm.code_ptr)
 
     def eval(self) -> None:
         if self.vm.curr_memory == 0:
             self.go_to_closing_bracket()
-        else:
-            self.vm.stack.put_nowait(self.vm.code_ptr)
 
     def __repr__(self):
         return "["
@@ -98,11 +96,10 @@ class BrainfuckOpLoopEnd(BrainfuckOp):
         super().__init__(vm, countable=False)
 
     def eval(self) -> None:
-        # need to move 1 less op, because we'll
-        #  move to loop begin at end of iter
-        begin_loop_ptr = self.vm.stack.get_nowait() - 1
+        # move to the opening bracket itself, because we'll
+        #  move to the first op of the loop body at end of iter
         if self.vm.curr_memory != 0:
-            self.vm.code_ptr = begin_loop_ptr
+            self.vm.code_ptr = self.vm.compiled().source_jump(self.vm.code_ptr)
 
     def __repr__(self):
         return "]"
@@ -0,0 +1,183 @@
+"""
+Optimizer pass for compiled Brainfuck programs.
+
+Rewrites the instruction stream of bvm.compiler.Program into fused
+instructions:
+
+    ADD n               runs of "+" and "-"
+    MOVE n              runs of ">" and "<"
+    SET 0               clear loops, e.g. "[-]"; arg is the per-iteration
+                        step of the cleared cell
+    MULADD off,factor   add cell * factor to cell at offset, emitted for
+                        each target of move/add loops like "[->+<]",
+                        followed by SET 0
+    SCAN step           "[>]", "[<<]", ... move by step until zero cell
+
+Fused instructions keep counts, so BrainfuckVM.executed stays the same
+as for the unoptimized program.
+
+MULADD assumes its target is not the counter cell of the loop, which it
+is on tapes of memory_size dividing the offset. Programs are optimized
+for any tape, and fitted to tapes of VMs, see fitted.
+
+Fused loops count their iterations by wraparound of cells, so VMs with
+cells, which do not wrap, run unoptimized programs, with ADD_SATURATE or
+ADD_CHECKED instead of ADD.
+"""
+from . import compiler, tape
+
+BOUNDED_ADDS = {
+    tape.OverflowBehavior.SATURATE: compiler.OP_ADD_SATURATE,
+    tape.OverflowBehavior.ERROR: compiler.OP_ADD_CHECKED,
+}
+
+
+def fold_runs(program: compiler.Program) -> list[tuple]:
+    """
+    Fold runs of ADD and MOVE instructions
+
+    Returns
+    -------
+    List of (op, arg, count, position) instructions
+    """
+    folded = []
+    for op, arg, count, position in zip(
+        program.ops, program.args, program.counts, program.positions
+    ):
+        if (
+            op in (compiler.OP_ADD, compiler.OP_MOVE)
+            and folded
+            and folded[-1][0] == op
+        ):
+            _, prev_arg, prev_count, prev_position = folded[-1]
+            folded[-1] = (
+                op,
+                prev_arg + arg,
+                prev_count + count,
+                prev_position,
+            )
+        else:
+            folded.append((op, arg, count, position))
+    return folded
+
+
+def fuse_loop(
+    body: list[tuple], position: int, memory_size: int | None = None
+) -> list[tuple] | None:
+    """
+    Fuse loop of ADD and MOVE instructions
+
+    Parameters
+    ----------
+    body : folded instructions between loop brackets
+    position : position of loop begin
+    memory_size : size of tape, loops with targets wrapping onto their
+        counter cell on it are not fused. Any size, if None
+
+    Returns
+    -------
+    Fused instructions, or None if loop cannot be fused
+    """
+    if not body or any(
+        op not in (compiler.OP_ADD, compiler.OP_MOVE) for op, *_ in body
+    ):
+        return None
+    count = sum(c for _, _, c, _ in body)
+
+    if all(op == compiler.OP_MOVE for op, *_ in body):
+        step = sum(arg for _, arg, _, _ in body)
+        if step == 0:
+            return None
+        return [(compiler.OP_SCAN, step, count, position)]
+
+    offset = 0
+    deltas: dict[int, int] = {}
+    for op, arg, _, _ in body:
+        if op == compiler.OP_MOVE:
+            offset += arg
+        else:
+            deltas[offset] = deltas.get(offset, 0) + arg
+    step = deltas.pop(0, 0)
+    if offset != 0 or step not in (1, -1):
+        return None
+    if memory_size is not None and any(
+        target % memory_size == 0 for target in deltas
+    ):
+        return None
+    # loop runs cell times for step -1 and -cell times for step 1,
+    #  so factors are negated for step 1
+    fused = [
+        (compiler.OP_MULADD, (target, -factor * step), 0, position)
+        for target, factor in deltas.items()
+        if factor != 0
+    ]
+    fused.append((compiler.OP_SET, step, count, position))
+    return fused
+
+
+def optimize(
+    program: compiler.Program, memory_size: int | None = None
+) -> compiler.Program:
+    """
+    Rewrite program into fused instructions
+
+    Parameters
+    ----------
+    program : program compiled by bvm.compiler.compile_code
+    memory_size : size of tape to run program on, any size if None
+
+    Returns
+    -------
+    Optimized program of the same code
+    """
+    optimized = []
+    opened = []
+    for instruction in fold_runs(program):
+        op, _, _, position = instruction
+        if op == compiler.OP_LOOP_BEGIN:
+            opened.append(len(optimized))
+        elif op == compiler.OP_LOOP_END:
+            begin = opened.pop()
+            fused = fuse_loop(
+                optimized[begin + 1 :], optimized[begin][3], memory_size
+            )
+            if fused is not None:
+                optimized[begin:] = fused
+                continue
+        optimized.append(instruction)
+
+    if not optimized:
+        return program
+    ops, args, counts, positions = zip(*optimized)
+    return compiler.Program(program.code, ops, args, counts, positions)
+
+
+def fitted(
+    program: compiler.Program,
+    memory_size: int,
+    overflow: tape.OverflowBehavior = tape.DEFAULT_OVERFLOW,
+) -> compiler.Program:
+    """
+    Program optimized for any tape, fitted to tape of memory_size with
+    overflow of cells: the same program, unless targets of its MULADD
+    wrap onto their counter cells, which are reoptimized without fusing
+    their loops then. Unoptimized program with bounded adds, if cells do
+    not wrap
+    """
+    overflow = tape.OverflowBehavior(overflow)
+    if overflow is not tape.OverflowBehavior.WRAP:
+        unfused = compiler.compile_code(program.code)
+        add = BOUNDED_ADDS[overflow]
+        return compiler.Program(
+            unfused.code,
+            tuple(add if op == compiler.OP_ADD else op for op in unfused.ops),
+            unfused.args,
+            unfused.counts,
+            unfused.positions,
+        )
+    if all(
+        op != compiler.OP_MULADD or arg[0] % memory_size
+        for op, arg in zip(program.ops, program.args)
+    ):
+        return program
+    return optimize(compiler.compile_code(program.code), memory_size)
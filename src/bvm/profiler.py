@@ -0,0 +1,208 @@
+"""
+Opt-in profiler of BrainfuckVM.
+
+VM with profile set runs on ProfilingBackend, which interprets the
+unoptimized program and records into the profile:
+
+    positions       executions of op at each code position
+    loop_entries    entries into loop by position of its "["
+    loop_iterations executions of loop body by position of its "["
+    loop_seconds    time spent in loop, including nested loops, by
+                    position of its "["
+
+VMs without profile run on their backend unchanged.
+"""
+import math
+import time
+
+import numpy as np
+
+import bvm
+
+from . import backends, compiler, tape
+
+
+class Profile:
+    __slots__ = (
+        "code",
+        "program",
+        "positions",
+        "loop_entries",
+        "loop_iterations",
+        "loop_seconds",
+    )
+
+    def __init__(self):
+        self.code: str | None = None
+        self.program: compiler.Program | None = None
+        self.positions: list[int] = []
+        self.loop_entries: dict[int, int] = {}
+        self.loop_iterations: dict[int, int] = {}
+        self.loop_seconds: dict[int, float] = {}
+
+    def compiled(self, code: str) -> compiler.Program:
+        """
+        Unoptimized program of code. Profile is reset, if code changed
+        """
+        if self.program is None or self.code != code:
+            self.code = code
+            self.program = compiler.compile_code(code)
+            self.positions = [0] * len(code)
+            self.loop_entries = {}
+            self.loop_iterations = {}
+            self.loop_seconds = {}
+        return self.program
+
+    def op_counts(self) -> dict[str, int]:
+        """
+        Executions by op
+        """
+        counts = dict.fromkeys(compiler.OPCODES, 0)
+        for op, count in zip(self.code or "", self.positions):
+            counts[op] += count
+        return counts
+
+    def loops(self) -> list[tuple[int, int, int, int, float]]:
+        """
+        Entered loops as (begin, end, entries, iterations, seconds),
+        slowest first
+        """
+        loops = [
+            (
+                begin,
+                self.program.jumps[begin],
+                entries,
+                self.loop_iterations.get(begin, 0),
+                self.loop_seconds.get(begin, 0.0),
+            )
+            for begin, entries in self.loop_entries.items()
+        ]
+        loops.sort(key=lambda loop: (-loop[4], loop[0]))
+        return loops
+
+
+def open_loops(program: compiler.Program, ip: int) -> list[int]:
+    """
+    Begins of loops enclosing instruction ip, outermost first
+    """
+    return [
+        begin
+        for begin, op in enumerate(program.ops[:ip])
+        if op == compiler.OP_LOOP_BEGIN and program.jumps[begin] >= ip
+    ]
+
+
+class ProfilingBackend(backends.Backend):
+    """
+    Interpreter of unoptimized program, recording vm.profile
+    """
+
+    def run(
+        self,
+        vm: "bvm.BrainfuckVM",
+        max_steps: int | None = None,
+        deadline: float | None = None,
+        wait_for_input: bool = False,
+    ) -> backends.RunStatus:
+        profile = vm.profile
+        program = profile.compiled(vm.code)
+        positions = profile.positions
+        entries = profile.loop_entries
+        iterations = profile.loop_iterations
+        seconds = profile.loop_seconds
+        ops, args, counts = program.ops, program.args, program.counts
+        jumps = program.jumps
+        end = len(ops)
+        memory = vm.memory
+        size = vm.memory_size
+        mask = int(np.iinfo(memory.dtype).max)
+        wrap = vm.overflow is tape.OverflowBehavior.WRAP
+        saturate = vm.overflow is tape.OverflowBehavior.SATURATE
+        eof = vm.eof_value()
+        ptr = vm.memory_ptr
+        ip = vm.code_ptr
+        executed = vm.executed
+        stop_at = math.inf if max_steps is None else executed + max_steps
+        deadline = math.inf if deadline is None else deadline
+        spins = 0
+        ticks = backends.CLOCK_TICKS
+        status = backends.RunStatus.FINISHED
+        # loop begin -> perf_counter() at its entry
+        now = time.perf_counter()
+        entered = {begin: now for begin in open_loops(program, ip)}
+        try:
+            while ip < end:
+                op = ops[ip]
+                positions[ip] += 1
+                if op == compiler.OP_ADD:
+                    value = memory.item(ptr) + args[ip]
+                    if wrap:
+                        memory[ptr] = value & mask
+                    elif saturate:
+                        memory[ptr] = min(max(value, 0), mask)
+                    elif not 0 <= value <= mask:
+                        positions[ip] -= 1
+                        status = backends.RunStatus.OVERFLOW
+                        break
+                    else:
+                        memory[ptr] = value
+                elif op == compiler.OP_MOVE:
+                    ptr = (ptr + args[ip]) % size
+                elif op == compiler.OP_LOOP_BEGIN:
+                    entries[ip] = entries.get(ip, 0) + 1
+                    if not memory.item(ptr):
+                        ip = jumps[ip] + 1
+                        continue
+                    iterations[ip] = iterations.get(ip, 0) + 1
+                    entered[ip] = time.perf_counter()
+                elif op == compiler.OP_LOOP_END:
+                    begin = jumps[ip]
+                    if not memory.item(ptr):
+                        seconds[begin] = (
+                            seconds.get(begin, 0.0)
+                            + time.perf_counter()
+                            - entered.pop(begin, now)
+                        )
+                        ip += 1
+                        continue
+                    iterations[begin] = iterations.get(begin, 0) + 1
+                    ip = begin + 1
+                    spins += 1
+                    ticks -= 1
+                    if executed + spins >= stop_at:
+                        status = backends.RunStatus.STEPS_EXHAUSTED
+                        break
+                    if not ticks:
+                        ticks = backends.CLOCK_TICKS
+                        if time.monotonic() > deadline:
+                            status = backends.RunStatus.DEADLINE_EXCEEDED
+                            break
+                    continue
+                elif op == compiler.OP_OUT:
+                    vm.stdout.append(memory.item(ptr) & backends.OUT_MASK)
+                elif op == compiler.OP_IN:
+                    if wait_for_input and not vm.stdin:
+                        positions[ip] -= 1
+                        status = backends.RunStatus.WAITING_INPUT
+                        break
+                    value = vm.stdin.read_byte(eof)
+                    if value is not None:
+                        memory[ptr] = value
+                else:
+                    ip += 1
+                    status = backends.RunStatus.BREAKPOINT
+                    break
+                executed += counts[ip]
+                ip += 1
+        finally:
+            now = time.perf_counter()
+            for begin, started in entered.items():
+                seconds[begin] = seconds.get(begin, 0.0) + now - started
+            vm.memory_ptr = ptr
+            vm.code_ptr = ip
+            vm.spent = executed - vm.executed + spins
+            vm.executed = executed
+        return status
+
+
+BACKEND = ProfilingBackend()
@@ -0,0 +1,159 @@
+"""
+Registry of compiled programs.
+
+Programs are identified by SHA-256 of their minified code, so a source
+is minified, validated and compiled once per process, and VMs running it
+share one compiled Program. Registry with root also keeps minified code
+of programs in files root/<id[:2]>/<id>.bf, where other processes find
+programs by id; snapshots reference such programs by id instead of
+embedding their code. Program files are written, when the first
+snapshot referencing them is dumped, so programs of throwaway VMs take
+no disk space, and are never deleted, as snapshots may reference them.
+"""
+import collections
+import hashlib
+import os
+import pathlib
+import re
+import threading
+import uuid
+
+from . import compiler, optimizer
+
+PROGRAM_SUFFIX = ".bf"
+CACHE_SIZE = 1024
+ID_PATTERN = re.compile("[0-9a-f]{64}")
+
+
+def program_id(code: str) -> str:
+    """
+    Id of program of minified code
+    """
+    return hashlib.sha256(code.encode()).hexdigest()
+
+
+class ProgramRegistry:
+    """
+    LRU cache of cache_size compiled programs by id and by hash of
+    source, backed by program files in root, if it is set
+    """
+
+    def __init__(
+        self, root: pathlib.Path | None = None, cache_size: int = CACHE_SIZE
+    ):
+        self.root = root
+        self.cache_size = cache_size
+        self._programs: collections.OrderedDict[
+            str, compiler.Program
+        ] = collections.OrderedDict()
+        # programs by SHA-256 of their source, so sources are not kept
+        self._sources: collections.OrderedDict[
+            str, compiler.Program
+        ] = collections.OrderedDict()
+        # ids of programs known to have files in root
+        self._stored: set[str] = set()
+        self._lock = threading.Lock()
+
+    def register(self, source: str) -> compiler.Program:
+        """
+        Minify, validate and compile source, unless it was done already
+
+        Raises
+        ------
+        ValueError : if source has unbalanced brackets
+        """
+        key = program_id(source)
+        with self._lock:
+            program = self._sources.get(key)
+            if program is not None:
+                self._sources.move_to_end(key)
+                return program
+        program = self.compiled(compiler.minified(source))
+        with self._lock:
+            self._sources[key] = program
+            if len(self._sources) > self.cache_size:
+                self._sources.popitem(last=False)
+        return program
+
+    def compiled(self, code: str) -> compiler.Program:
+        """
+        Get program of minified code, compile it on first call
+
+        Raises
+        ------
+        ValueError : if code has unbalanced brackets or non-Brainfuck ops
+        """
+        return self._get(program_id(code), code)
+
+    def get(self, program_id: str) -> compiler.Program:
+        """
+        Get program by id from cache or from root
+
+        Raises
+        ------
+        KeyError : if there is no such program
+        """
+        return self._get(program_id, None)
+
+    def store(self, code: str) -> str | None:
+        """
+        Write program of minified code to root, if it is not there yet,
+        e.g. when snapshot referencing it is dumped
+
+        Returns
+        -------
+        Id of program, or None if registry has no root
+        """
+        if self.root is None:
+            return None
+        key = program_id(code)
+        if key not in self._stored:
+            path = self._path(key)
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+                tmp.write_text(code, "ascii")
+                os.replace(tmp, path)
+            self._stored.add(key)
+        return key
+
+    def clear(self) -> None:
+        with self._lock:
+            self._programs.clear()
+            self._sources.clear()
+            self._stored.clear()
+
+    def _get(self, key: str, code: str | None) -> compiler.Program:
+        with self._lock:
+            program = self._programs.get(key)
+            if program is not None:
+                self._programs.move_to_end(key)
+                return program
+        if code is None:
+            code = self._read(key)
+        program = optimizer.optimize(compiler.compile_code(code))
+        with self._lock:
+            # compiled concurrently by other thread, keep the first one
+            program = self._programs.setdefault(key, program)
+            if len(self._programs) > self.cache_size:
+                self._programs.popitem(last=False)
+        return program
+
+    def _read(self, key: str) -> str:
+        if self.root is not None and ID_PATTERN.fullmatch(key):
+            try:
+                code = self._path(key).read_text("ascii")
+            except (FileNotFoundError, ValueError):
+                pass
+            else:
+                if program_id(code) == key:
+                    self._stored.add(key)
+                    return code
+        raise KeyError(f"No program with id={key}")
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.root / key[:2] / f"{key}{PROGRAM_SUFFIX}"
+
+
+# registry of VMs; set its root to share programs between processes
+programs = ProgramRegistry()
@@ -0,0 +1,764 @@
+"""
+Binary snapshot format of BrainfuckVM state.
+
+Snapshot is a fixed-size header followed by code, stdin and stdout
+blobs, padding up to MEMORY_ALIGNMENT, and raw memory buffer:
+
+    magic       4s  b"BVMS"
+    version     H
+    flags       H   FLAG_HAS_CODE, FLAG_EXTERNAL_MEMORY, FLAG_SPARSE,
+                    FLAG_EOF_MINUS_ONE, FLAG_EOF_UNCHANGED, FLAG_PROGRAM_REF,
+                    FLAG_OVERFLOW_SATURATE, FLAG_OVERFLOW_ERROR
+    memory_size Q
+    memory_ptr  Q
+    code_ptr    Q
+    executed    Q
+    code_len    Q
+    stdin_len   Q
+    stdout_len  Q
+    dtype       8s  numpy dtype of memory, e.g. b"|u1"
+    backend     16s
+
+Snapshot with FLAG_EXTERNAL_MEMORY ends after stdout blob, its memory
+buffer is stored elsewhere and passed to loads.
+
+Code blob of snapshot with FLAG_PROGRAM_REF is id of program in
+bvm.registry.programs. Code is referenced so, when the registry has root.
+
+Snapshot with FLAG_SPARSE is of VM with sparse tape. Its memory is
+stored as touched pages only, instead of raw memory buffer:
+
+    page_size   Q   cells in page
+    page_count  Q
+
+and then page indexes as uint32, padding and pages.
+
+Snapshot with memory may be followed by delta records, each with changes
+since the previous record:
+
+    magic       4s  b"BVMD"
+    flags       H   DELTA_STDOUT_APPENDED, DELTA_CODE_KEPT
+    reserved    H
+    page_size   I   cells in page
+    page_count  I
+    length      Q   bytes of record after this header
+
+and then snapshot of VM without memory, padding, page indexes as uint32,
+padding and pages. Last page of memory may be shorter than page_size,
+here and in sparse memory.
+Stdout of record with DELTA_STDOUT_APPENDED is appended to stdout of the
+previous one, record with DELTA_CODE_KEPT has code of the previous one.
+Truncated last record is ignored.
+"""
+import functools
+import io
+import json
+import os
+import struct
+from typing import BinaryIO
+
+import numpy as np
+
+import bvm
+from bvm import backends, registry, tape
+
+MAGIC = b"BVMS"
+VERSION = 4
+SUPPORTED_VERSIONS = (1, 2, 3, VERSION)
+HEADER = struct.Struct("<4sHH7Q8s16s")
+MEMORY_ALIGNMENT = 8
+FLAG_HAS_CODE = 1
+FLAG_EXTERNAL_MEMORY = 2
+FLAG_SPARSE = 4
+FLAG_EOF_MINUS_ONE = 8
+FLAG_EOF_UNCHANGED = 16
+FLAG_PROGRAM_REF = 32
+FLAG_OVERFLOW_SATURATE = 64
+FLAG_OVERFLOW_ERROR = 128
+EOF_FLAGS = {
+    backends.EofBehavior.MINUS_ONE: FLAG_EOF_MINUS_ONE,
+    backends.EofBehavior.UNCHANGED: FLAG_EOF_UNCHANGED,
+}
+OVERFLOW_FLAGS = {
+    tape.OverflowBehavior.SATURATE: FLAG_OVERFLOW_SATURATE,
+    tape.OverflowBehavior.ERROR: FLAG_OVERFLOW_ERROR,
+}
+SPARSE_HEADER = struct.Struct("<QQ")
+DELTA_MAGIC = b"BVMD"
+DELTA_HEADER = struct.Struct("<4sHHIIQ")
+DELTA_STDOUT_APPENDED = 1
+DELTA_CODE_KEPT = 2
+# parts of snapshot, which read_fields reads on demand
+SECTIONS = frozenset({"code", "stdin", "stdout", "memory"})
+# stdin and stdout of version 1 are str encoded with V1_IO_ENCODING
+V1_IO_ENCODING = "utf-8"
+V1_IO_ERRORS = "surrogatepass"
+
+
+def is_snapshot(data: bytes) -> bool:
+    return data[: len(MAGIC)] == MAGIC
+
+
+def _padding(length: int) -> bytes:
+    return b"\0" * (-length % MEMORY_ALIGNMENT)
+
+
+def memory_buffer(vm: "bvm.BrainfuckVM") -> memoryview:
+    """
+    Raw memory of vm as bytes
+    """
+    return memoryview(np.ascontiguousarray(vm.memory)).cast("B")
+
+
+def _dump_pages(
+    f: BinaryIO, vm: "bvm.BrainfuckVM", pages: np.ndarray, page_size: int
+) -> None:
+    """
+    Write page indexes, padding and pages of vm memory, from aligned
+    offset
+    """
+    f.write(pages.astype("<u4").tobytes())
+    f.write(_padding(4 * len(pages)))
+    memory = memory_buffer(vm)
+    itemsize = vm.memory.dtype.itemsize
+    for page in pages.tolist():
+        start = page * page_size * itemsize
+        f.write(memory[start : start + page_size * itemsize])
+
+
+def _pages(
+    view: memoryview, offset: int, page_count: int
+) -> tuple[memoryview, int]:
+    """
+    Page indexes at offset in view, and offset of pages after them
+    """
+    indexes = view[offset : offset + 4 * page_count]
+    offset += 4 * page_count
+    return indexes, offset + len(_padding(offset))
+
+
+def _sparse_memory(
+    data: bytes | bytearray,
+    offset: int,
+    memory_size: int,
+    dtype: np.dtype,
+) -> tuple[np.ndarray, int]:
+    """
+    Sparse tape from sparse memory at offset in data, and offset of its
+    end
+    """
+    page_size, page_count = SPARSE_HEADER.unpack_from(data, offset)
+    indexes, offset = _pages(
+        memoryview(data), offset + SPARSE_HEADER.size, page_count
+    )
+    memory = tape.zeros(memory_size, True, dtype)
+    for page in np.frombuffer(indexes, "<u4").tolist():
+        start = page * page_size
+        end = min(start + page_size, memory_size)
+        memory[start:end] = np.frombuffer(
+            data, dtype, count=end - start, offset=offset
+        )
+        offset += (end - start) * dtype.itemsize
+    return memory, offset
+
+
+def dump(
+    vm: "bvm.BrainfuckVM",
+    f: BinaryIO,
+    with_memory: bool = True,
+    program_ref: bool = True,
+) -> None:
+    """
+    Write snapshot of vm to binary file f. Without memory, if with_memory
+    is False. Code is embedded, if program_ref is False, e.g. for
+    snapshots loaded where bvm.registry.programs has no root
+    """
+    _dump(vm, f, with_memory, vm.code, vm.stdout.getvalue(), program_ref)
+
+
+def _dump(
+    vm: "bvm.BrainfuckVM",
+    f: BinaryIO,
+    with_memory: bool,
+    code: str | None,
+    stdout: bytes,
+    program_ref: bool = True,
+) -> None:
+    flags = 0 if with_memory else FLAG_EXTERNAL_MEMORY
+    if vm.sparse:
+        flags |= FLAG_SPARSE
+    flags |= EOF_FLAGS.get(vm.eof, 0)
+    flags |= OVERFLOW_FLAGS.get(vm.overflow, 0)
+    if code is not None:
+        flags |= FLAG_HAS_CODE
+        program_id = registry.programs.store(code) if program_ref else None
+        if program_id is not None:
+            flags |= FLAG_PROGRAM_REF
+            code = program_id
+    code = (code or "").encode()
+    stdin = vm.stdin.getvalue()
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        flags,
+        vm.memory_size,
+        vm.memory_ptr,
+        vm.code_ptr,
+        vm.executed,
+        len(code),
+        len(stdin),
+        len(stdout),
+        vm.memory.dtype.str.encode(),
+        vm.backend.value.encode(),
+    )
+    f.write(header)
+    f.write(code)
+    f.write(stdin)
+    f.write(stdout)
+    if with_memory:
+        f.write(_padding(HEADER.size + len(code) + len(stdin) + len(stdout)))
+        if vm.sparse:
+            pages = tape.touched_pages(vm.memory)
+            f.write(SPARSE_HEADER.pack(tape.PAGE_SIZE, len(pages)))
+            _dump_pages(f, vm, pages, tape.PAGE_SIZE)
+        else:
+            f.write(memory_buffer(vm))
+
+
+def dumps(
+    vm: "bvm.BrainfuckVM", with_memory: bool = True, program_ref: bool = True
+) -> bytes:
+    """
+    Get snapshot of vm, see dump
+    """
+    f = io.BytesIO()
+    dump(vm, f, with_memory, program_ref)
+    return f.getvalue()
+
+
+def _header(data: bytes | bytearray | memoryview) -> tuple:
+    """
+    Fields of snapshot header at the start of data
+
+    Raises
+    ------
+    ValueError : if data is not a snapshot of supported version
+    """
+    if not is_snapshot(data) or len(data) < HEADER.size:
+        raise ValueError("Data is not a BrainfuckVM snapshot")
+    fields = HEADER.unpack_from(data)
+    if fields[1] not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unsupported snapshot version {fields[1]}")
+    return fields
+
+
+def _unpack(data: bytes | bytearray | memoryview) -> tuple:
+    """
+    Fields of snapshot header, code, stdin and stdout, and offset of
+    memory buffer in data
+    """
+    (
+        _,
+        version,
+        flags,
+        memory_size,
+        memory_ptr,
+        code_ptr,
+        executed,
+        code_len,
+        stdin_len,
+        stdout_len,
+        dtype,
+        backend,
+    ) = _header(data)
+
+    view = memoryview(data)
+    offset = HEADER.size
+    code = str(view[offset : offset + code_len], "ascii")
+    offset += code_len
+    stdin = view[offset : offset + stdin_len]
+    offset += stdin_len
+    stdout = view[offset : offset + stdout_len]
+    offset += stdout_len
+    if version == 1:
+        stdin, stdout = (
+            str(blob, V1_IO_ENCODING, V1_IO_ERRORS).encode(bvm.IO_ENCODING)
+            for blob in (stdin, stdout)
+        )
+    offset += len(_padding(offset))
+    return (
+        flags,
+        memory_size,
+        memory_ptr,
+        code_ptr,
+        executed,
+        np.dtype(dtype.rstrip(b"\0").decode()),
+        backend.rstrip(b"\0").decode(),
+        code,
+        stdin,
+        stdout,
+        offset,
+    )
+
+
+def size(data: bytes | bytearray) -> int:
+    """
+    Length of snapshot with memory at the start of data, without delta
+    records after it
+    """
+    fields = _unpack(data)
+    flags, memory_size, dtype, offset = (
+        fields[0],
+        fields[1],
+        fields[5],
+        fields[-1],
+    )
+    if flags & FLAG_SPARSE:
+        return _sparse_memory(data, offset, memory_size, dtype)[1]
+    return offset + memory_size * dtype.itemsize
+
+
+def loads(
+    data: bytes | bytearray, memory: bytes | bytearray | None = None
+) -> "bvm.BrainfuckVM":
+    """
+    Load BrainfuckVM from snapshot, replaying delta records after it.
+    Memory of VM is a view on data, or on memory for snapshots without
+    memory, so it is writable only if that buffer is bytearray. Pages of
+    delta records are written to that buffer. Sparse memory is loaded to
+    new sparse tape
+
+    Raises
+    ------
+    ValueError : if data is not a snapshot of supported version, memory
+        is missing or not expected, or program it references is not in
+        bvm.registry.programs
+    """
+    (
+        flags,
+        memory_size,
+        memory_ptr,
+        code_ptr,
+        executed,
+        dtype,
+        backend,
+        code,
+        stdin,
+        stdout,
+        offset,
+    ) = _unpack(data)
+    deltas = []
+    if flags & FLAG_EXTERNAL_MEMORY:
+        if memory is None:
+            raise ValueError("Snapshot memory is stored externally")
+        memory = np.frombuffer(memory, dtype=dtype, count=memory_size)
+    elif memory is not None:
+        raise ValueError("Snapshot contains memory")
+    elif flags & FLAG_SPARSE:
+        memory, end = _sparse_memory(data, offset, memory_size, dtype)
+        deltas = _deltas(data, end)
+    else:
+        memory = np.frombuffer(
+            data, dtype=dtype, count=memory_size, offset=offset
+        )
+        deltas = _deltas(data, offset + memory_size * dtype.itemsize)
+
+    vm = bvm.BrainfuckVM(
+        memory_size=memory_size,
+        backend=backend,
+        memory=memory,
+        sparse=bool(flags & FLAG_SPARSE),
+        cell_type=dtype.name,
+        eof=_eof(flags),
+        overflow=_overflow(flags),
+    )
+    if deltas:
+        # the newest record has the latest state
+        (
+            _,
+            _,
+            memory_ptr,
+            code_ptr,
+            executed,
+            _,
+            backend,
+            _,
+            stdin,
+            _,
+            _,
+        ) = _unpack(deltas[-1][1])
+        vm.backend = bvm.BackendType(backend)
+        vm.own_memory()
+        stdout, newest_code = _replay(vm.memory, stdout, deltas)
+        if newest_code is not None:
+            flags, code = newest_code
+    vm.memory_ptr = memory_ptr
+    vm.code = _code(flags, code)
+    vm.code_ptr = code_ptr
+    vm.executed = executed
+    vm.stdin.write(stdin)
+    vm.stdout.write(stdout)
+    return vm
+
+
+def _code(flags: int, code: str) -> str | None:
+    """
+    Code of snapshot with flags from its code blob
+    """
+    if not flags & FLAG_HAS_CODE:
+        return None
+    if flags & FLAG_PROGRAM_REF:
+        try:
+            return registry.programs.get(code).code
+        except KeyError:
+            raise ValueError(
+                f"Snapshot references unknown program {code}"
+            ) from None
+    return code
+
+
+def _eof(flags: int) -> "backends.EofBehavior":
+    for eof, flag in EOF_FLAGS.items():
+        if flags & flag:
+            return eof
+    return backends.EofBehavior.ZERO
+
+
+def _overflow(flags: int) -> "tape.OverflowBehavior":
+    for overflow, flag in OVERFLOW_FLAGS.items():
+        if flags & flag:
+            return overflow
+    return tape.OverflowBehavior.WRAP
+
+
+def dumps_delta(vm: "bvm.BrainfuckVM", page_size: int) -> bytes | None:
+    """
+    Get delta record with changes of vm since vm.mark_stored, or None if
+    it was not called
+    """
+    pages = vm.dirty_pages(page_size)
+    if pages is None:
+        return None
+    flags = 0
+    stdout = vm.stdout.getvalue()
+    if stdout.startswith(vm.base_stdout):
+        flags |= DELTA_STDOUT_APPENDED
+        stdout = stdout[len(vm.base_stdout) :]
+    code = vm.code
+    if code == vm.base_code:
+        flags |= DELTA_CODE_KEPT
+        code = None
+    f = io.BytesIO()
+    _dump(vm, f, False, code, stdout)
+    f.write(_padding(f.tell()))
+    _dump_pages(f, vm, pages, page_size)
+    body = f.getvalue()
+    header = DELTA_HEADER.pack(
+        DELTA_MAGIC, flags, 0, page_size, len(pages), len(body)
+    )
+    return header + body
+
+
+def _deltas(
+    data: bytes | bytearray, offset: int
+) -> list[tuple[int, memoryview, int, memoryview, memoryview]]:
+    """
+    Delta records in data from offset as (flags, snapshot without memory,
+    page_size, page indexes, pages). Parsing stops at truncated record
+    """
+    view = memoryview(data)
+    deltas = []
+    while offset + DELTA_HEADER.size <= len(data):
+        (
+            magic,
+            flags,
+            _,
+            page_size,
+            page_count,
+            length,
+        ) = DELTA_HEADER.unpack_from(data, offset)
+        offset += DELTA_HEADER.size
+        if magic != DELTA_MAGIC or offset + length > len(data):
+            break
+        body = view[offset : offset + length]
+        offset += length
+        indexes, pages_offset = _pages(body, _unpack(body)[-1], page_count)
+        deltas.append((flags, body, page_size, indexes, body[pages_offset:]))
+    return deltas
+
+
+def _replay(
+    memory: np.ndarray,
+    stdout: memoryview,
+    deltas: list[tuple[int, memoryview, int, memoryview, memoryview]],
+) -> tuple[bytes, tuple[int, str] | None]:
+    """
+    Write pages of deltas to memory, newest first, so every cell is
+    written once at most
+
+    Returns
+    -------
+    Stdout after deltas, and snapshot flags and code of the newest record
+    with code, if any
+    """
+    written = np.zeros(len(memory), bool)
+    stdouts = []
+    stdout_done = False
+    code = None
+    for flags, body, page_size, indexes, pages in reversed(deltas):
+        fields = _unpack(body)
+        if not stdout_done:
+            stdouts.append(fields[9])
+            stdout_done = not flags & DELTA_STDOUT_APPENDED
+        if code is None and not flags & DELTA_CODE_KEPT:
+            code = (fields[0], fields[7])
+        values = np.frombuffer(pages, memory.dtype)
+        offset = 0
+        for page in np.frombuffer(indexes, "<u4").tolist():
+            start = page * page_size
+            end = min(start + page_size, len(memory))
+            if not written[start:end].all():
+                fresh = ~written[start:end]
+                memory[start:end][fresh] = values[
+                    offset : offset + end - start
+                ][fresh]
+                written[start:end] = True
+            offset += end - start
+    if not stdout_done:
+        stdouts.append(stdout)
+    return b"".join(bytes(blob) for blob in reversed(stdouts)), code
+
+
+def load(f: BinaryIO) -> "bvm.BrainfuckVM":
+    """
+    Load BrainfuckVM from snapshot in binary file f
+    """
+    data = bytearray(os.fstat(f.fileno()).st_size - f.tell())
+    f.readinto(data)
+    return loads(data)
+
+
+def _window(
+    memory_size: int, memory_start: int, memory_stop: int | None
+) -> tuple[int, int]:
+    stop = memory_size if memory_stop is None else memory_stop
+    return min(max(memory_start, 0), memory_size), min(stop, memory_size)
+
+
+def vm_fields(
+    vm: "bvm.BrainfuckVM",
+    sections: frozenset[str] = SECTIONS,
+    memory_start: int = 0,
+    memory_stop: int | None = None,
+) -> dict:
+    """
+    Fields of vm, as read_fields reads them from snapshot of vm
+    """
+    fields = {
+        "memory_size": vm.memory_size,
+        "memory_ptr": vm.memory_ptr,
+        "code_ptr": vm.code_ptr,
+        "executed": vm.executed,
+        "backend": vm.backend,
+        "sparse": vm.sparse,
+        "cell_type": vm.cell_type,
+        "eof": vm.eof,
+        "overflow": vm.overflow,
+    }
+    if "code" in sections:
+        fields["code"] = vm.code
+    if "stdin" in sections:
+        fields["stdin"] = vm.stdin.getvalue()
+    if "stdout" in sections:
+        fields["stdout"] = vm.stdout.getvalue()
+    if "memory" in sections:
+        start, stop = _window(vm.memory_size, memory_start, memory_stop)
+        cells = vm.memory[start:stop]
+        if vm.sparse:
+            fields["memory_pages"] = _window_pages(cells, start)
+        else:
+            fields["memory"] = cells
+    return fields
+
+
+def _window_pages(cells: np.ndarray, first: int) -> dict[int, np.ndarray]:
+    """
+    Parts of tape pages in cells from first cell with non-zero cells, by
+    their first cell
+    """
+    pages = {}
+    page_first = first - first % tape.PAGE_SIZE
+    while page_first < first + len(cells):
+        start = max(page_first, first) - first
+        page = cells[start : page_first + tape.PAGE_SIZE - first]
+        if page.any():
+            pages[first + start] = page
+        page_first += tape.PAGE_SIZE
+    return pages
+
+
+def read_fields(
+    f: BinaryIO,
+    sections: frozenset[str] = SECTIONS,
+    memory_start: int = 0,
+    memory_stop: int | None = None,
+    memory: BinaryIO | None = None,
+) -> dict:
+    """
+    Read fields of VM from snapshot in seekable binary file f, without
+    loading the VM. Header fields are always read, code, stdin, stdout
+    and memory cells from memory_start to memory_stop only if they are
+    in sections; the rest of file is skipped. Snapshot followed by delta
+    records is loaded whole, as its state is in the records
+
+    Parameters
+    ----------
+    f : file positioned at the start of snapshot
+    sections : parts of snapshot to read, of SECTIONS
+    memory_start : first cell of memory to read
+    memory_stop : cell to stop reading memory at, memory_size by default
+    memory : file of memory buffer of snapshot without memory
+
+    Raises
+    ------
+    ValueError : if f is not a snapshot of supported version, memory is
+        missing or not expected, or program it references is not in
+        bvm.registry.programs
+
+    Returns
+    -------
+    Fields as vm_fields returns them
+    """
+    start = f.tell()
+    (
+        _,
+        version,
+        flags,
+        memory_size,
+        memory_ptr,
+        code_ptr,
+        executed,
+        code_len,
+        stdin_len,
+        stdout_len,
+        dtype,
+        backend,
+    ) = _header(f.read(HEADER.size))
+    dtype = np.dtype(dtype.rstrip(b"\0").decode())
+    offset = HEADER.size + code_len + stdin_len + stdout_len
+    offset += len(_padding(offset))
+    end = f.seek(0, io.SEEK_END) - start
+    pages: list[tuple[int, int, int]] = []
+    if flags & FLAG_EXTERNAL_MEMORY:
+        if memory is None:
+            raise ValueError("Snapshot memory is stored externally")
+    elif memory is not None:
+        raise ValueError("Snapshot contains memory")
+    elif flags & FLAG_SPARSE:
+        f.seek(start + offset)
+        page_size, page_count = SPARSE_HEADER.unpack(
+            f.read(SPARSE_HEADER.size)
+        )
+        indexes = np.frombuffer(f.read(4 * page_count), "<u4").tolist()
+        offset += SPARSE_HEADER.size + 4 * page_count
+        offset += len(_padding(offset))
+        # first and last cell of each page, and its offset in f
+        for page in indexes:
+            first = page * page_size
+            last = min(first + page_size, memory_size)
+            pages.append((first, last, offset))
+            offset += (last - first) * dtype.itemsize
+        if offset < end:
+            f.seek(start)
+            return vm_fields(
+                loads(f.read()), sections, memory_start, memory_stop
+            )
+    elif offset + memory_size * dtype.itemsize < end:
+        f.seek(start)
+        return vm_fields(loads(f.read()), sections, memory_start, memory_stop)
+
+    fields = {
+        "memory_size": memory_size,
+        "memory_ptr": memory_ptr,
+        "code_ptr": code_ptr,
+        "executed": executed,
+        "backend": backends.BackendType(backend.rstrip(b"\0").decode()),
+        "sparse": bool(flags & FLAG_SPARSE),
+        "cell_type": tape.CellType(dtype.name),
+        "eof": _eof(flags),
+        "overflow": _overflow(flags),
+    }
+    blobs = {
+        "code": (HEADER.size, code_len),
+        "stdin": (HEADER.size + code_len, stdin_len),
+        "stdout": (HEADER.size + code_len + stdin_len, stdout_len),
+    }
+    for section, (blob_offset, blob_len) in blobs.items():
+        if section not in sections:
+            continue
+        f.seek(start + blob_offset)
+        blob = f.read(blob_len)
+        if section == "code":
+            fields["code"] = _code(flags, blob.decode("ascii"))
+        elif version == 1:
+            fields[section] = blob.decode(V1_IO_ENCODING, V1_IO_ERRORS).encode(
+                bvm.IO_ENCODING
+            )
+        else:
+            fields[section] = blob
+    if "memory" not in sections:
+        return fields
+
+    first, stop = _window(memory_size, memory_start, memory_stop)
+    if memory is not None or not flags & FLAG_SPARSE:
+        if memory is None:
+            memory, offset = f, start + offset
+        else:
+            offset = 0
+        memory.seek(offset + first * dtype.itemsize)
+        cells = np.frombuffer(
+            memory.read(max(stop - first, 0) * dtype.itemsize), dtype
+        )
+        if flags & FLAG_SPARSE:
+            fields["memory_pages"] = _window_pages(cells, first)
+        else:
+            fields["memory"] = cells
+        return fields
+    fields["memory_pages"] = {}
+    for page_first, page_last, page_offset in pages:
+        cells_first = max(page_first, first)
+        cells_last = min(page_last, stop)
+        if cells_first >= cells_last:
+            continue
+        f.seek(
+            start + page_offset + (cells_first - page_first) * dtype.itemsize
+        )
+        cells = np.frombuffer(
+            f.read((cells_last - cells_first) * dtype.itemsize), dtype
+        )
+        if cells.any():
+            fields["memory_pages"][cells_first] = cells
+    return fields
+
+
+@functools.lru_cache(maxsize=None)
+def _json_cells_table(dtype: np.dtype) -> np.ndarray:
+    """
+    JSON of each value of dtype followed by comma, as fixed-width bytes
+    padded with zero bytes
+    """
+    values = range(np.iinfo(dtype).max + 1)
+    return np.array([b"%d," % value for value in values])
+
+
+def json_memory(cells: np.ndarray) -> bytes:
+    """
+    JSON array of memory cells. Cells of up to 16 bits are encoded by
+    table lookup, without Python ints
+    """
+    if not len(cells):
+        return b"[]"
+    if cells.dtype.itemsize > 2:
+        return json.dumps(cells.tolist(), separators=(",", ":")).encode()
+    encoded = _json_cells_table(cells.dtype)[cells].tobytes()
+    return b"[" + encoded.replace(b"\0", b"")[:-1] + b"]"
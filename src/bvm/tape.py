@@ -0,0 +1,119 @@
+"""
+Memory tapes of BrainfuckVM.
+
+Dense tape is a regular array. Sparse tape is a flat array on anonymous
+memory map: the OS allocates its pages on first write, so untouched
+pages take no RAM. Both keep wraparound of the pointer, as cells are
+addressed the same way. Values of cells wrap around too, unless VM has
+other OverflowBehavior. Pages of PAGE_SIZE cells without non-zero cells
+are not stored in snapshots of sparse tapes.
+"""
+import enum
+import mmap
+
+import numpy as np
+import numpy.typing as npt
+
+PAGE_SIZE = 4096
+
+
+class CellType(str, enum.Enum):
+    UINT8 = "uint8"
+    UINT16 = "uint16"
+    UINT32 = "uint32"
+
+
+DEFAULT_CELL_TYPE = CellType.UINT8
+
+
+class OverflowBehavior(str, enum.Enum):
+    """
+    What "+" and "-" do to cell at the bounds of its type: wrap around,
+    saturate at the bound, or stop VM with RunStatus.OVERFLOW
+    """
+
+    WRAP = "wrap"
+    SATURATE = "saturate"
+    ERROR = "error"
+
+
+DEFAULT_OVERFLOW = OverflowBehavior.WRAP
+
+
+def zeros(
+    size: int, sparse: bool = False, dtype: npt.DTypeLike = np.uint8
+) -> npt.NDArray:
+    """
+    Tape of size zero cells
+    """
+    if not sparse:
+        return np.zeros(size, dtype)
+    # anonymous map is zero filled and allocated by pages on first write
+    buffer = mmap.mmap(-1, size * np.dtype(dtype).itemsize)
+    return np.frombuffer(buffer, dtype, count=size)
+
+
+def page_bounds(
+    memory: npt.NDArray, page: int, page_size: int = PAGE_SIZE
+) -> tuple[int, int]:
+    start = page * page_size
+    return start, min(start + page_size, len(memory))
+
+
+def touched_pages(
+    memory: npt.NDArray, page_size: int = PAGE_SIZE
+) -> npt.NDArray[np.intp]:
+    """
+    Indexes of pages of memory with non-zero cells
+    """
+    full = len(memory) // page_size * page_size
+    # max does not allocate temporary array of tape size, unlike any
+    pages = np.flatnonzero(memory[:full].reshape(-1, page_size).max(axis=1))
+    if full < len(memory) and memory[full:].max():
+        pages = np.append(pages, full // page_size)
+    return pages
+
+
+def copy(memory: npt.NDArray, sparse: bool = False) -> npt.NDArray:
+    """
+    Writable copy of memory. Only touched pages of sparse tape are copied
+    """
+    if not sparse:
+        return memory.copy()
+    copied = zeros(len(memory), True, memory.dtype)
+    for page in touched_pages(memory).tolist():
+        start, end = page_bounds(memory, page)
+        copied[start:end] = memory[start:end]
+    return copied
+
+
+def changed_pages(
+    memory: npt.NDArray,
+    base: npt.NDArray,
+    sparse: bool = False,
+    page_size: int = PAGE_SIZE,
+) -> npt.NDArray[np.intp]:
+    """
+    Indexes of pages, where memory differs from base. Only touched pages
+    of sparse tapes are compared
+    """
+    if not sparse:
+        return np.unique(np.flatnonzero(memory != base) // page_size)
+    candidates = np.union1d(
+        touched_pages(memory, page_size), touched_pages(base, page_size)
+    )
+    changed = []
+    for page in candidates.tolist():
+        start, end = page_bounds(memory, page, page_size)
+        if not np.array_equal(memory[start:end], base[start:end]):
+            changed.append(page)
+    return np.array(changed, np.intp)
+
+
+def resident_bytes(memory: npt.NDArray, sparse: bool = False) -> int:
+    """
+    Approximate amount of RAM in bytes taken by memory
+    """
+    if not sparse:
+        return memory.nbytes
+    return len(touched_pages(memory)) * PAGE_SIZE * memory.dtype.itemsize
@@ -1,6 +1,8 @@
 import fastapi
 
 from .alloc import router as alloc_router
+from .execution import router as execution_router
 
 router = fastapi.APIRouter(prefix="/cloud")
 router.include_router(alloc_router)
+router.include_router(execution_router)
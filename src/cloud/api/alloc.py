@@ -1,27 +1,146 @@
 import fastapi
 
-from cloud import constants, exceptions, schemas, services
+import bvm
+from cloud import (
+    constants,
+    exceptions,
+    responses,
+    scheduler,
+    schemas,
+    services,
+)
+from cloud.settings import settings
 
 router = fastapi.APIRouter(prefix="/alloc", tags=["BVM Allocation"])
 
 
+def _memory_window(
+    memory_offset: int | None, memory_len: int | None
+) -> tuple[int, int | None]:
+    start = memory_offset or 0
+    return start, None if memory_len is None else start + memory_len
+
+
+def _memory_offset(
+    memory_offset: int | None, memory_len: int | None
+) -> int | None:
+    # memory_offset is reported only for windows of memory
+    if memory_offset is None and memory_len is None:
+        return None
+    return memory_offset or 0
+
+
+@router.get(
+    "/cache/stats",
+    response_model=schemas.VmCacheStatsSchema,
+)
+def get_vm_cache_stats() -> schemas.VmCacheStatsSchema:
+    """
+    Get counters of in-process cache of loaded VMs
+
+    Returns
+    -------
+    Number and footprint of cached VMs, hits, misses and evictions
+    """
+    return services.alloc.vm_cache.stats()
+
+
+@router.get(
+    "",
+    response_model=list[schemas.BvmInstanceFieldsSchema],
+    response_model_exclude_unset=True,
+    responses={
+        400: {"model": schemas.Message},
+    },
+)
+async def get_bvm_instances(
+    ids: list[int] = fastapi.Query(max_items=settings.alloc_batch_max_size),
+    fields: str | None = None,
+    memory_offset: int | None = fastapi.Query(default=None, ge=0),
+    memory_len: int | None = fastapi.Query(default=None, ge=0),
+    memory_encoding: schemas.MemoryEncoding = schemas.MemoryEncoding.LIST,
+    alloc_service: services.alloc.AsyncAllocService = fastapi.Depends(),
+) -> fastapi.responses.Response:
+    """
+    Get BvmInstances of ids
+
+    Parameters
+    ----------
+    ids : IDs of BvmInstances
+    fields : comma-separated fields of BvmInstances and their bvms to
+        get, e.g. state,memory_ptr,stdout, all by default. Only sections
+        of stored vms with selected fields are read
+    memory_offset : first cell of memory to get, 0 by default
+    memory_len : number of cells of memory to get, up to the end of
+        memory by default
+    memory_encoding : encoding of memory cells: list of ints, or base64
+        of little-endian cells
+
+    Returns
+    -------
+    Found VMs and their current states. Not found ids are skipped
+    """
+    try:
+        instance_fields, bvm_fields = schemas.select_fields(fields)
+    except ValueError as e:
+        return fastapi.responses.JSONResponse(
+            status_code=400,
+            content={"message": str(e)},
+        )
+    memory_start, memory_stop = _memory_window(memory_offset, memory_len)
+    found = await alloc_service.get_instances_fields(
+        ids, schemas.bvm_sections(bvm_fields), memory_start, memory_stop
+    )
+    return responses.json_response(
+        [
+            responses.instance_json(
+                instance,
+                vm_fields,
+                instance_fields,
+                bvm_fields,
+                _memory_offset(memory_offset, memory_len),
+                memory_encoding,
+            )
+            for instance, vm_fields in found
+        ]
+    )
+
+
 @router.get(
     "/{bvm_instance_id}",
-    response_model=schemas.BvmInstanceSchema,
+    response_model=schemas.BvmInstanceFieldsSchema,
+    response_model_exclude_unset=True,
     responses={
+        200: {"content": {responses.SNAPSHOT_MEDIA_TYPE: {}}},
+        400: {"model": schemas.Message},
         404: {"model": schemas.Message},
     },
 )
-def get_bvm_instance(
+async def get_bvm_instance(
     bvm_instance_id: int,
-    alloc_service: services.alloc.AllocService = fastapi.Depends(),
-) -> schemas.BvmInstanceSchema | fastapi.responses.JSONResponse:
+    fields: str | None = None,
+    memory_offset: int | None = fastapi.Query(default=None, ge=0),
+    memory_len: int | None = fastapi.Query(default=None, ge=0),
+    memory_encoding: schemas.MemoryEncoding = schemas.MemoryEncoding.LIST,
+    accept: str | None = fastapi.Header(default=None),
+    alloc_service: services.alloc.AsyncAllocService = fastapi.Depends(),
+) -> fastapi.responses.Response:
     """
     Get BvmInstance of bvm_instance_id
 
     Parameters
     ----------
     bvm_instance_id : ID of BvmInstance
+    fields : comma-separated fields of BvmInstance and its bvm to get,
+        e.g. state,memory_ptr,stdout, all by default. Only sections of
+        stored vm with selected fields are read
+    memory_offset : first cell of memory to get, 0 by default
+    memory_len : number of cells of memory to get, up to the end of
+        memory by default
+    memory_encoding : encoding of memory cells: list of ints, or base64
+        of little-endian cells
+    accept : application/octet-stream to get whole vm as binary snapshot
+        (see bvm.snapshot), which ignores the other parameters
 
     Returns
     -------
@@ -30,20 +149,45 @@ def get_bvm_instance(
 
     """
     try:
-        instance_record, vm = alloc_service.get_instance_and_vm(
-            bvm_instance_id
+        if responses.negotiate(accept) == responses.SNAPSHOT_MEDIA_TYPE:
+            _, vm = await alloc_service.get_instance_and_vm(bvm_instance_id)
+            if vm is None:
+                return fastapi.responses.JSONResponse(
+                    status_code=404,
+                    content={
+                        "message": f"BvmInstance with id={bvm_instance_id} "
+                        "has no Bvm"
+                    },
+                )
+            return responses.snapshot_response(vm)
+        instance_fields, bvm_fields = schemas.select_fields(fields)
+        memory_start, memory_stop = _memory_window(memory_offset, memory_len)
+        instance_record, vm_fields = await alloc_service.get_instance_fields(
+            bvm_instance_id,
+            schemas.bvm_sections(bvm_fields),
+            memory_start,
+            memory_stop,
         )
-        return schemas.BvmInstanceSchema(
-            id=instance_record.id,
-            state=instance_record.state,
-            stored_at=instance_record.stored_at,
-            bvm=schemas.BrainfuckVMSchema.from_vm(vm),
+        return responses.json_response(
+            responses.instance_json(
+                instance_record,
+                vm_fields,
+                instance_fields,
+                bvm_fields,
+                _memory_offset(memory_offset, memory_len),
+                memory_encoding,
+            )
         )
     except exceptions.NoSuchBvmInstance:
         return fastapi.responses.JSONResponse(
             status_code=404,
             content={"message": f"No BvmInstance with id={bvm_instance_id}"},
         )
+    except ValueError as e:
+        return fastapi.responses.JSONResponse(
+            status_code=400,
+            content={"message": str(e)},
+        )
 
 
 @router.post(
@@ -53,28 +197,43 @@ def get_bvm_instance(
         400: {"model": schemas.Message},
     },
 )
-def new_bvm_instance(
+async def new_bvm_instance(
     memory_size: int = constants.BVM_DEFAULT_MEMORY_SIZE,
-    alloc_service: services.alloc.AllocService = fastapi.Depends(),
-) -> schemas.BvmInstanceSchema | fastapi.responses.JSONResponse:
+    backend: bvm.BackendType = bvm.DEFAULT_BACKEND,
+    sparse: bool = False,
+    cell_type: bvm.CellType = bvm.DEFAULT_CELL_TYPE,
+    eof: bvm.EofBehavior = bvm.DEFAULT_EOF,
+    overflow: bvm.OverflowBehavior = bvm.DEFAULT_OVERFLOW,
+    tenant: str = fastapi.Depends(scheduler.tenant),
+    alloc_service: services.alloc.AsyncAllocService = fastapi.Depends(),
+) -> fastapi.responses.Response:
     """
-    Create a new vm with memory_size amount of memory
+    Create a new vm with memory_size amount of memory, owned by tenant of
+    X-Tenant header
 
     Parameters
     ----------
     memory_size : amount of memory in new Bvm. Must be greater than zero
+    backend : engine executing code of new Bvm
+    sparse : allocate memory of new Bvm by pages on first touch, for
+        large memory_size
+    cell_type : type of memory cells of new Bvm: uint8, uint16 or uint32
+    eof : what "," does at the end of input: stores zero or minus_one to
+        the cell, or leaves it unchanged
+    overflow : what "+" and "-" do to cell at the bounds of cell_type:
+        wrap around, saturate, or stop run with "Overflow" status on
+        error
 
     Returns
     -------
     created vm and its current state
     """
     try:
-        instance, vm = alloc_service.new_bvm_instance(memory_size)
-        return schemas.BvmInstanceSchema(
-            id=instance.id,
-            state=instance.state,
-            stored_at=instance.stored_at,
-            bvm=schemas.BrainfuckVMSchema.from_vm(vm),
+        instance, vm = await alloc_service.new_bvm_instance(
+            memory_size, backend, sparse, cell_type, eof, overflow, tenant
+        )
+        return responses.json_response(
+            responses.vm_instance_json(instance, vm)
         )
     except FileNotFoundError as e:
         return fastapi.responses.JSONResponse(
@@ -83,16 +242,114 @@ def new_bvm_instance(
         )
 
 
+@router.post(
+    "/batch",
+    response_model=list[schemas.BvmInstanceSchema],
+    responses={
+        400: {"model": schemas.Message},
+    },
+)
+async def new_bvm_instances(
+    batch: schemas.BvmBatchAllocSchema,
+    tenant: str = fastapi.Depends(scheduler.tenant),
+    alloc_service: services.alloc.AsyncAllocService = fastapi.Depends(),
+) -> fastapi.responses.Response:
+    """
+    Create a new vm for each of memory_sizes in one transaction, owned by
+    tenant of X-Tenant header
+
+    Parameters
+    ----------
+    batch : memory_sizes of new Bvms, each must be greater than zero,
+        their backend, whether their memory is sparse, cell_type, eof and
+        overflow
+
+    Returns
+    -------
+    created vms and their current states
+    """
+    try:
+        created = await alloc_service.new_bvm_instances(
+            batch.memory_sizes,
+            batch.backend,
+            batch.sparse,
+            batch.cell_type,
+            batch.eof,
+            batch.overflow,
+            tenant,
+        )
+    except ValueError as e:
+        return fastapi.responses.JSONResponse(
+            status_code=400,
+            content={"message": str(e)},
+        )
+    return responses.json_response(
+        [responses.vm_instance_json(instance, vm) for instance, vm in created]
+    )
+
+
+@router.post(
+    "/{bvm_instance_id}/fork",
+    response_model=list[schemas.BvmInstanceSchema],
+    responses={
+        400: {"model": schemas.Message},
+        404: {"model": schemas.Message},
+        409: {"model": schemas.Message},
+    },
+)
+async def fork_bvm_instance(
+    bvm_instance_id: int,
+    count: int = fastapi.Query(
+        default=1, ge=1, le=settings.alloc_batch_max_size
+    ),
+    alloc_service: services.alloc.AsyncAllocService = fastapi.Depends(),
+) -> fastapi.responses.Response:
+    """
+    Create count new vms in the state of vm of bvm_instance_id. They
+    share its memory until they first change it
+
+    Parameters
+    ----------
+    bvm_instance_id : ID of BvmInstance to fork
+    count : number of new vms
+
+    Returns
+    -------
+    created vms and their current states
+    """
+    try:
+        forked = await alloc_service.fork_bvm_instance(bvm_instance_id, count)
+    except exceptions.NoSuchBvmInstance as e:
+        return fastapi.responses.JSONResponse(
+            status_code=404,
+            content={"message": str(e)},
+        )
+    except exceptions.BvmInstanceBusy as e:
+        return fastapi.responses.JSONResponse(
+            status_code=409,
+            content={"message": str(e)},
+        )
+    except ValueError as e:
+        return fastapi.responses.JSONResponse(
+            status_code=400,
+            content={"message": str(e)},
+        )
+    return responses.json_response(
+        [responses.vm_instance_json(instance, vm) for instance, vm in forked]
+    )
+
+
 @router.delete(
     "/delete",
     responses={
         200: {"model": schemas.Message},
         404: {"model": schemas.Message},
+        409: {"model": schemas.Message},
     },
 )
-def delete_bvm_instance(
+async def delete_bvm_instance(
     bvm_instance_id: int,
-    alloc_service: services.alloc.AllocService = fastapi.Depends(),
+    alloc_service: services.alloc.AsyncAllocService = fastapi.Depends(),
 ) -> fastapi.responses.JSONResponse:
     """
     Delete VM
@@ -104,10 +361,11 @@ def delete_bvm_instance(
     Returns
     -------
     200 : if BvmInstance wa deleted successfully \n
-    404 : if no BvmInstance was found with such id
+    404 : if no BvmInstance was found with such id \n
+    409 : if BvmInstance is computing
     """
     try:
-        alloc_service.delete_bvm_instance(bvm_instance_id)
+        await alloc_service.delete_bvm_instance(bvm_instance_id)
         return fastapi.responses.JSONResponse(
             content=f"BvmInstance({bvm_instance_id}) was deleted"
         )
@@ -116,3 +374,8 @@ def delete_bvm_instance(
             status_code=404,
             content=str(e),
         )
+    except exceptions.BvmInstanceBusy as e:
+        return fastapi.responses.JSONResponse(
+            status_code=409,
+            content=str(e),
+        )
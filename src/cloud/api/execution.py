@@ -0,0 +1,332 @@
+import asyncio
+
+import fastapi
+import fastapi.concurrency
+
+import bvm
+from cloud import exceptions, scheduler, schemas, services
+
+router = fastapi.APIRouter(prefix="/exec", tags=["BVM Execution"])
+
+
+# before /{bvm_instance_id}, so "batch" is not taken for an id
+@router.post(
+    "/batch",
+    response_model=list[schemas.ExecResultSchema],
+    responses={
+        400: {"model": schemas.Message},
+        429: {"model": schemas.Message},
+    },
+)
+async def exec_batch(
+    request: schemas.BatchExecRequestSchema,
+    tenant: str = fastapi.Depends(scheduler.tenant),
+    exec_service: services.execution.ExecService = fastapi.Depends(),
+) -> list[schemas.ExecResultSchema] | fastapi.responses.JSONResponse:
+    """
+    Run code on each of stdins in new VMs, stepped together through the
+    program. Much faster than separate VMs for many inputs of one program.
+    VMs are not stored. The run counts to tenant of X-Tenant header
+
+    Parameters
+    ----------
+    request : code, stdins, memory_size, cell_type, eof and overflow of
+        VMs, max_steps of each VM and time_limit in seconds of the run
+
+    Returns
+    -------
+    200 : result of each VM in order of stdins \n
+    400 : if code or memory_size is invalid, or VMs take too much memory \n
+    429 : if tenant exceeded its quota, or too many jobs are queued
+    """
+    try:
+        return await asyncio.wrap_future(
+            exec_service.submit_batch(request, tenant)
+        )
+    except (exceptions.QuotaExceeded, exceptions.ExecQueueFull) as e:
+        return fastapi.responses.JSONResponse(
+            status_code=429,
+            content={"message": str(e)},
+        )
+    except ValueError as e:
+        return fastapi.responses.JSONResponse(
+            status_code=400,
+            content={"message": str(e)},
+        )
+
+
+@router.get("/usage", response_model=schemas.TenantUsageSchema)
+def get_usage(
+    tenant: str = fastapi.Depends(scheduler.tenant),
+) -> schemas.TenantUsageSchema:
+    """
+    Get execution usage and quota of tenant of X-Tenant header
+
+    Returns
+    -------
+    Steps and run seconds used in current quota period, quota and
+    unfinished jobs of tenant
+    """
+    return scheduler.scheduler.usage(tenant)
+
+
+@router.post(
+    "/{bvm_instance_id}",
+    status_code=202,
+    response_model=schemas.JobSchema,
+    responses={
+        404: {"model": schemas.Message},
+        409: {"model": schemas.Message},
+        429: {"model": schemas.Message},
+    },
+)
+def exec_bvm_instance(
+    bvm_instance_id: int,
+    request: schemas.ExecRequestSchema,
+    exec_service: services.execution.ExecService = fastapi.Depends(),
+) -> schemas.JobSchema | fastapi.responses.JSONResponse:
+    """
+    Queue execution of BvmInstance. Jobs of owners of BvmInstances share
+    workers fairly, in time slices
+
+    Parameters
+    ----------
+    bvm_instance_id : ID of BvmInstance
+    request : code to upload (code of Bvm is resumed, if not set), input,
+        max_steps and time_limit in seconds of the run
+
+    Returns
+    -------
+    202 : queued job. BvmInstance is computing, until job is done \n
+    404 : if no BvmInstance was found with such id \n
+    409 : if BvmInstance is computing already \n
+    429 : if owner of BvmInstance exceeded its quota, or too many jobs are
+        queued
+    """
+    try:
+        return exec_service.submit(bvm_instance_id, request).as_schema()
+    except exceptions.NoSuchBvmInstance as e:
+        return fastapi.responses.JSONResponse(
+            status_code=404,
+            content={"message": str(e)},
+        )
+    except exceptions.BvmInstanceBusy as e:
+        return fastapi.responses.JSONResponse(
+            status_code=409,
+            content={"message": str(e)},
+        )
+    except (exceptions.QuotaExceeded, exceptions.ExecQueueFull) as e:
+        return fastapi.responses.JSONResponse(
+            status_code=429,
+            content={"message": str(e)},
+        )
+
+
+@router.post(
+    "/{bvm_instance_id}/stream",
+    response_class=fastapi.responses.StreamingResponse,
+    responses={
+        200: {"content": {"application/octet-stream": {}}},
+        400: {"model": schemas.Message},
+        404: {"model": schemas.Message},
+        409: {"model": schemas.Message},
+        429: {"model": schemas.Message},
+    },
+)
+async def stream_bvm_instance(
+    bvm_instance_id: int,
+    request: schemas.ExecRequestSchema,
+    stream_service: services.streaming.StreamService = fastapi.Depends(),
+) -> fastapi.responses.Response:
+    """
+    Run BvmInstance and stream its output in chunked response, while it
+    runs. "," reads 0, when input is over
+
+    Parameters
+    ----------
+    bvm_instance_id : ID of BvmInstance
+    request : code to upload (code of Bvm is resumed, if not set), input,
+        max_steps and time_limit in seconds of the run
+
+    Returns
+    -------
+    200 : output bytes of the run \n
+    400 : if no code is uploaded to BvmInstance \n
+    404 : if no BvmInstance was found with such id \n
+    409 : if BvmInstance is computing already \n
+    429 : if owner of BvmInstance exceeded its quota
+    """
+    try:
+        stream = await fastapi.concurrency.run_in_threadpool(
+            stream_service.open, bvm_instance_id, request
+        )
+    except exceptions.NoSuchBvmInstance as e:
+        return fastapi.responses.JSONResponse(
+            status_code=404,
+            content={"message": str(e)},
+        )
+    except exceptions.BvmInstanceBusy as e:
+        return fastapi.responses.JSONResponse(
+            status_code=409,
+            content={"message": str(e)},
+        )
+    except exceptions.QuotaExceeded as e:
+        return fastapi.responses.JSONResponse(
+            status_code=429,
+            content={"message": str(e)},
+        )
+    except ValueError as e:
+        return fastapi.responses.JSONResponse(
+            status_code=400,
+            content={"message": str(e)},
+        )
+
+    async def output():
+        try:
+            status = None
+            while status is None:
+                status = await stream.step()
+                if stream.stdout:
+                    yield stream.stdout.read()
+        finally:
+            await stream.close()
+
+    return fastapi.responses.StreamingResponse(
+        output(), media_type="application/octet-stream"
+    )
+
+
+@router.websocket("/{bvm_instance_id}/stream")
+async def stream_bvm_instance_interactive(
+    websocket: fastapi.WebSocket,
+    bvm_instance_id: int,
+    stream_service: services.streaming.StreamService = fastapi.Depends(),
+) -> None:
+    """
+    Run BvmInstance interactively over WebSocket:
+
+    1. client sends ExecRequestSchema as JSON
+    2. server sends output bytes in binary messages, while it runs
+    3. when "," has no input, server waits for binary message with input.
+       Empty message means end of input, "," reads 0 after that
+    4. server sends StreamResultSchema as JSON and closes
+
+    Errors are sent as Message and close codes 4400, 4404, 4409 and 4429,
+    matching HTTP statuses of other endpoints
+    """
+    await websocket.accept()
+    try:
+        request = schemas.ExecRequestSchema(**await websocket.receive_json())
+        stream = await fastapi.concurrency.run_in_threadpool(
+            stream_service.open, bvm_instance_id, request, True
+        )
+    except fastapi.WebSocketDisconnect:
+        return
+    except (
+        exceptions.NoSuchBvmInstance,
+        exceptions.BvmInstanceBusy,
+        exceptions.QuotaExceeded,
+        ValueError,
+    ) as e:
+        code = 4400
+        if isinstance(e, exceptions.NoSuchBvmInstance):
+            code = 4404
+        elif isinstance(e, exceptions.BvmInstanceBusy):
+            code = 4409
+        elif isinstance(e, exceptions.QuotaExceeded):
+            code = 4429
+        await websocket.send_json({"message": str(e)})
+        await websocket.close(code)
+        return
+
+    try:
+        while True:
+            status = await stream.step()
+            if stream.stdout:
+                await websocket.send_bytes(stream.stdout.read())
+            if status is bvm.RunStatus.WAITING_INPUT:
+                data = await websocket.receive_bytes()
+                if data:
+                    stream.stdin.write(data)
+                else:
+                    stream.end_of_input()
+            elif status is not None:
+                break
+        await websocket.send_text(stream.result().json())
+        await websocket.close()
+    except fastapi.WebSocketDisconnect:
+        pass
+    finally:
+        await stream.close()
+
+
+@router.get(
+    "/{bvm_instance_id}/profile",
+    response_model=schemas.ProfileReportSchema,
+    responses={
+        404: {"model": schemas.Message},
+    },
+)
+def get_profile_report(
+    bvm_instance_id: int,
+    exec_service: services.execution.ExecService = fastapi.Depends(),
+) -> schemas.ProfileReportSchema | fastapi.responses.JSONResponse:
+    """
+    Get profile report of the last run of BvmInstance with profile set
+
+    Parameters
+    ----------
+    bvm_instance_id : ID of BvmInstance
+
+    Returns
+    -------
+    Executions by op and of the most executed code positions, entries,
+    iterations and time of the slowest loops. Error message, if BvmInstance
+    was not profiled
+    """
+    try:
+        return exec_service.get_profile_report(bvm_instance_id)
+    except exceptions.NoSuchProfile as e:
+        return fastapi.responses.JSONResponse(
+            status_code=404,
+            content={"message": str(e)},
+        )
+
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=schemas.JobSchema,
+    responses={
+        404: {"model": schemas.Message},
+    },
+)
+async def get_job(
+    job_id: str,
+    wait: float = fastapi.Query(default=0, ge=0, le=60),
+    exec_service: services.execution.ExecService = fastapi.Depends(),
+) -> schemas.JobSchema | fastapi.responses.JSONResponse:
+    """
+    Get execution job
+
+    Parameters
+    ----------
+    job_id : ID of job
+    wait : seconds to wait for job to finish
+
+    Returns
+    -------
+    Job with result, if it is done. Error message, if no such job
+    """
+    try:
+        job = exec_service.get_job(job_id)
+    except exceptions.NoSuchJob as e:
+        return fastapi.responses.JSONResponse(
+            status_code=404,
+            content={"message": str(e)},
+        )
+    if wait and not job.future.done():
+        waiter = asyncio.wrap_future(job.future)
+        # job errors are reported in response, not logged by asyncio
+        waiter.add_done_callback(lambda f: f.cancelled() or f.exception())
+        await asyncio.wait([waiter], timeout=wait)
+    return job.as_schema()
@@ -0,0 +1,67 @@
+import time
+
+import fastapi
+import starlette.types
+
+from cloud import metrics
+
+router = fastapi.APIRouter(tags=["Metrics"])
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+@router.get(
+    "/metrics",
+    response_class=fastapi.responses.PlainTextResponse,
+)
+def get_metrics() -> fastapi.responses.PlainTextResponse:
+    """
+    Get metrics of the service process in Prometheus text format
+
+    Returns
+    -------
+    200 : metrics
+    """
+    return fastapi.responses.PlainTextResponse(
+        metrics.render(), media_type=CONTENT_TYPE
+    )
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware observing latency of HTTP requests by their route
+    """
+
+    UNMATCHED_ROUTE = "<unmatched>"
+
+    def __init__(self, app: starlette.types.ASGIApp):
+        self.app = app
+
+    async def __call__(
+        self,
+        scope: starlette.types.Scope,
+        receive: starlette.types.Receive,
+        send: starlette.types.Send,
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message: starlette.types.Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            metrics.HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                route.path if route is not None else self.UNMATCHED_ROUTE,
+                status,
+            )
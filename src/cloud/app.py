@@ -2,9 +2,37 @@ import fastapi
 
 from cloud import api as cloud_api
 from cloud import constants as cloud_constants
+from cloud import database, services, storage, tables
+from cloud.api import metrics as metrics_api
 
 app = fastapi.FastAPI(
     title=cloud_constants.APP_TITLE,
     description=cloud_constants.APP_DESCRIPTION,
 )
 app.include_router(cloud_api.router)
+app.include_router(metrics_api.router)
+app.add_middleware(metrics_api.MetricsMiddleware)
+
+
+@app.on_event("startup")
+def create_tables() -> None:
+    tables.Base.metadata.create_all(database.engine)
+    database.add_missing_columns(database.engine, tables.Base.metadata)
+
+
+@app.on_event("shutdown")
+def shutdown_worker_pool() -> None:
+    services.execution.shutdown_worker_pool()
+
+
+@app.on_event("shutdown")
+def flush_storage() -> None:
+    storage.flush()
+
+
+@app.on_event("shutdown")
+async def dispose_database_engines() -> None:
+    # pooled aiosqlite connections run on non-daemon threads, which keep
+    # the process alive until they are closed
+    await database.async_engine.dispose()
+    database.engine.dispose()
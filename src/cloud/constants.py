@@ -4,7 +4,12 @@ APP_TITLE = "BrainfCloud"
 APP_DESCRIPTION = "Create Brainfuck Virtual Machines. Now in cloud!"
 PROJECT_ROOT = pathlib.Path(__file__).parent.parent.parent
 
-# services.alloc
+# storage
 BVM_STORAGE_ROOT = PROJECT_ROOT / "data" / "vm"
+BVM_CAS_ROOT = PROJECT_ROOT / "data" / "cas"
+BVM_DELTA_ROOT = PROJECT_ROOT / "data" / "delta"
+BVM_PROGRAM_ROOT = PROJECT_ROOT / "data" / "programs"
+BVM_SNAPSHOT_SUFFIX = ".bvm"
+BVM_JSON_SUFFIX = ".json"
 BVM_STORAGE_MAX_PATH_LENGTH = 255
 BVM_DEFAULT_MEMORY_SIZE = 128
@@ -1,14 +1,118 @@
 import sqlalchemy
+import sqlalchemy.pool
 from sqlalchemy import orm
+from sqlalchemy.ext import asyncio as sqlalchemy_asyncio
 
+from cloud import metrics
 from cloud.settings import settings
 
-engine = sqlalchemy.create_engine(
-    url=settings.database_url,
-    connect_args={
-        "check_same_thread": False,
-    },
+# async drivers of database backends, used if database_async_url is not set
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+
+def async_url(url: str) -> sqlalchemy.engine.URL:
+    """
+    URL of database at url with async driver of its backend
+    """
+    parsed = sqlalchemy.engine.make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for {backend} database")
+    return parsed.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+def engine_options(url: sqlalchemy.engine.URL, is_async: bool = False) -> dict:
+    """
+    create_engine options of database at url: pool of
+    settings.database_pool_size connections, and SQLite connections,
+    which are shared between threads and wait for locks for
+    settings.database_sqlite_busy_timeout seconds
+    """
+    options = {}
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {
+            "check_same_thread": False,
+            "timeout": settings.database_sqlite_busy_timeout,
+        }
+        if url.database in (None, "", ":memory:"):
+            # each connection to in-memory database is a new database
+            return options
+        # SQLite dialects do not pool connections to files by default
+        options["poolclass"] = (
+            sqlalchemy.pool.AsyncAdaptedQueuePool
+            if is_async
+            else sqlalchemy.pool.QueuePool
+        )
+    options.update(
+        pool_size=settings.database_pool_size,
+        max_overflow=settings.database_max_overflow,
+        pool_timeout=settings.database_pool_timeout,
+    )
+    return options
+
+
+def enable_sqlite_wal(engine: sqlalchemy.engine.Engine) -> None:
+    """
+    Switch connections of SQLite engine to write-ahead log, so reads do
+    not wait for writes. Commits are synced on checkpoints only
+    """
+
+    @sqlalchemy.event.listens_for(engine, "connect")
+    def set_wal_mode(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+
+def add_missing_columns(
+    engine: sqlalchemy.engine.Engine, metadata: sqlalchemy.MetaData
+) -> None:
+    """
+    Add nullable columns of metadata tables, which existing tables of
+    database lack, as create_all does not alter existing tables
+    """
+    with engine.begin() as connection:
+        inspector = sqlalchemy.inspect(connection)
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(engine.dialect)
+                connection.execute(
+                    sqlalchemy.text(
+                        f"ALTER TABLE {table.name} "
+                        f"ADD COLUMN {column.name} {column_type}"
+                    )
+                )
+
+
+def _setup(engine: sqlalchemy.engine.Engine) -> None:
+    metrics.instrument_engine(engine)
+    if settings.database_sqlite_wal and engine.dialect.name == "sqlite":
+        enable_sqlite_wal(engine)
+
+
+_url = sqlalchemy.engine.make_url(settings.database_url)
+engine = sqlalchemy.create_engine(_url, **engine_options(_url))
+_setup(engine)
+
+_async_url = (
+    sqlalchemy.engine.make_url(settings.database_async_url)
+    if settings.database_async_url
+    else async_url(settings.database_url)
 )
+async_engine = sqlalchemy_asyncio.create_async_engine(
+    _async_url, **engine_options(_async_url, is_async=True)
+)
+_setup(async_engine.sync_engine)
 
 _Session = orm.sessionmaker(
     engine,
@@ -16,6 +120,14 @@ _Session = orm.sessionmaker(
     autoflush=False,
 )
 
+_AsyncSession = orm.sessionmaker(
+    async_engine,
+    class_=sqlalchemy_asyncio.AsyncSession,
+    autoflush=False,
+    # attributes of committed objects can not be lazy loaded in async
+    expire_on_commit=False,
+)
+
 
 def session() -> _Session:
     s = _Session()
@@ -23,3 +135,8 @@ def session() -> _Session:
         yield s
     finally:
         s.close()
+
+
+async def async_session() -> sqlalchemy_asyncio.AsyncSession:
+    async with _AsyncSession() as s:
+        yield s
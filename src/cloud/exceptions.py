@@ -3,3 +3,38 @@ class NoSuchBvmInstance(Exception):
     Raise, when no bvm found by query
     """
     pass
+
+
+class BvmInstanceBusy(Exception):
+    """
+    Raise, when bvm is already computing
+    """
+    pass
+
+
+class NoSuchJob(Exception):
+    """
+    Raise, when no execution job found by id
+    """
+    pass
+
+
+class NoSuchProfile(Exception):
+    """
+    Raise, when bvm has no profile of its runs
+    """
+    pass
+
+
+class QuotaExceeded(Exception):
+    """
+    Raise, when tenant has used up its quota of execution
+    """
+    pass
+
+
+class ExecQueueFull(Exception):
+    """
+    Raise, when too many execution jobs are queued
+    """
+    pass
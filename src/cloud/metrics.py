@@ -0,0 +1,250 @@
+"""
+Prometheus-style metrics of the cloud service.
+
+Metrics are updated without locks: every thread updates its own shard
+of values, and shards are summed up, when metrics are rendered. Metrics
+are per process.
+"""
+import abc
+import bisect
+import contextlib
+import math
+import threading
+import time
+from typing import Callable, Iterator
+
+import sqlalchemy
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+SIZE_BUCKETS = tuple(256 * 4**i for i in range(10))
+
+
+class Metric(abc.ABC):
+    type = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, labels: tuple[str, ...] = ()
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._local = threading.local()
+        self._shards: list[dict] = []
+        self._shards_lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            # lock is taken once per thread
+            with self._shards_lock:
+                self._shards.append(shard)
+            return shard
+
+    def _label_str(self, values: tuple, extra: str = "") -> str:
+        pairs = [
+            f'{label}="{_escape(str(value))}"'
+            for label, value in zip(self.labels, values)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    @abc.abstractmethod
+    def samples(self) -> Iterator[str]:
+        pass
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+            *self.samples(),
+        ]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, *label_values) -> None:
+        shard = self._shard()
+        shard[label_values] = shard.get(label_values, 0) + amount
+
+    def values(self) -> dict[tuple, float]:
+        totals: dict[tuple, float] = {}
+        for shard in list(self._shards):
+            for labels, value in shard.copy().items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in sorted(self.values().items()):
+            yield f"{self.name}{self._label_str(labels)} {_number(value)}"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *label_values) -> None:
+        shard = self._shard()
+        # counts of buckets and +Inf, then sum
+        state = shard.get(label_values)
+        if state is None:
+            state = shard[label_values] = [0] * (len(self.buckets) + 2)
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, *label_values) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def values(self) -> dict[tuple, list[float]]:
+        totals: dict[tuple, list[float]] = {}
+        for shard in list(self._shards):
+            for labels, state in shard.copy().items():
+                total = totals.setdefault(labels, [0] * len(state))
+                for i, value in enumerate(state):
+                    total[i] += value
+        return totals
+
+    def samples(self) -> Iterator[str]:
+        for labels, state in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), state):
+                cumulative += count
+                le = self._label_str(labels, f'le="{_number(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            label_str = self._label_str(labels)
+            yield f"{self.name}_sum{label_str} {_number(state[-1])}"
+            yield f"{self.name}_count{label_str} {cumulative}"
+
+
+class CallbackGauge(Metric):
+    """
+    Gauge, which values are got by callback, when metrics are rendered
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...],
+        callback: Callable[[], dict[tuple, float]],
+    ):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in sorted(self.callback().items()):
+            yield f"{self.name}{self._label_str(labels)} {_number(value)}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY: list[Metric] = []
+
+
+def render() -> str:
+    """
+    All metrics in Prometheus text exposition format
+    """
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests",
+    ("method", "route", "status"),
+)
+STORAGE_SECONDS = Histogram(
+    "bvm_storage_duration_seconds",
+    "Duration of VM storage operations",
+    ("backend", "operation"),
+)
+SNAPSHOT_BYTES = Histogram(
+    "bvm_snapshot_bytes",
+    "Size of stored VM snapshots",
+    ("backend",),
+    buckets=SIZE_BUCKETS,
+)
+COALESCED_WRITES = Counter(
+    "bvm_storage_coalesced_writes_total",
+    "VM writes replaced by later writes to the same location before flush",
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds",
+    "Duration of database queries",
+    ("statement",),
+)
+EXECUTED_STEPS = Counter(
+    "bvm_executed_steps_total",
+    "Ops executed by VMs; divided by bvm_run_seconds_total it gives steps "
+    "per second",
+    ("mode",),
+)
+RUN_SECONDS = Counter(
+    "bvm_run_seconds_total",
+    "Time VMs ran for",
+    ("mode",),
+)
+
+
+def instrument_engine(engine: sqlalchemy.engine.Engine) -> None:
+    """
+    Observe duration of queries of engine in DB_QUERY_SECONDS
+    """
+
+    @sqlalchemy.event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, *_):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @sqlalchemy.event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, *_):
+        started = conn.info["query_started"].pop()
+        DB_QUERY_SECONDS.observe(
+            time.perf_counter() - started,
+            statement.lstrip().split(None, 1)[0].upper(),
+        )
@@ -0,0 +1,189 @@
+"""
+Responses with BvmInstances encoded without pydantic.
+
+Schemas of BvmInstances describe responses of alloc API in OpenAPI, but
+validating and encoding large memories through them dominates response
+time. So endpoints return JSON encoded here from fields of Bvms (see
+bvm.snapshot.read_fields), with memory encoded by
+bvm.snapshot.json_memory, or as base64 of raw cells. Bvm may be also
+requested as binary snapshot (see bvm.snapshot) by Accept header.
+"""
+import base64
+import json
+
+import fastapi
+
+import bvm
+from cloud import schemas, tables
+
+JSON_MEDIA_TYPE = "application/json"
+SNAPSHOT_MEDIA_TYPE = "application/octet-stream"
+MEMORY_FIELDS = frozenset({"memory", "memory_pages"})
+
+
+def negotiate(accept: str | None) -> str:
+    """
+    Media type of response preferred by Accept header, of
+    JSON_MEDIA_TYPE and SNAPSHOT_MEDIA_TYPE. JSON, if neither is accepted
+    """
+    best, best_quality = JSON_MEDIA_TYPE, 0.0
+    for item in (accept or "").split(","):
+        media_type, *params = (part.strip() for part in item.split(";"))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type in (JSON_MEDIA_TYPE, "*/*", "application/*"):
+            media_type = JSON_MEDIA_TYPE
+        elif media_type != SNAPSHOT_MEDIA_TYPE:
+            continue
+        if quality > best_quality or (
+            quality == best_quality and media_type == JSON_MEDIA_TYPE
+        ):
+            best, best_quality = media_type, quality
+    return best
+
+
+def _json(value) -> bytes:
+    # the same separators as fastapi.responses.JSONResponse
+    return json.dumps(
+        value, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode()
+
+
+def _object(items: list[tuple[str, bytes]]) -> bytes:
+    return b"{" + b",".join(_json(k) + b":" + v for k, v in items) + b"}"
+
+
+def _cells(cells, memory_encoding: schemas.MemoryEncoding) -> bytes:
+    if memory_encoding is schemas.MemoryEncoding.BASE64:
+        raw = cells.astype(cells.dtype.newbyteorder("<"), copy=False)
+        return b'"' + base64.b64encode(raw.tobytes()) + b'"'
+    return bvm.snapshot.json_memory(cells)
+
+
+def bvm_json(
+    fields: dict,
+    selected: frozenset[str],
+    memory_offset: int | None = None,
+    memory_encoding: schemas.MemoryEncoding = schemas.MemoryEncoding.LIST,
+) -> bytes:
+    """
+    JSON of schemas.BrainfuckVMFieldsSchema with selected fields of Bvm
+
+    Parameters
+    ----------
+    fields : fields of Bvm, see bvm.snapshot.read_fields
+    selected : names of fields to encode, of schemas.BVM_FIELDS
+    memory_offset : first cell of memory window, if memory is windowed
+    memory_encoding : encoding of memory cells
+    """
+    with_memory = bool(selected & MEMORY_FIELDS)
+    items = []
+    for name in schemas.BrainfuckVMFieldsSchema.__fields__:
+        if name == "memory_offset":
+            if with_memory and memory_offset is not None:
+                offset = min(memory_offset, fields["memory_size"])
+                items.append((name, _json(offset)))
+        elif name == "memory" and with_memory:
+            memory = fields.get("memory")
+            items.append(
+                (
+                    name,
+                    b"null"
+                    if memory is None
+                    else _cells(memory, memory_encoding),
+                )
+            )
+        elif name == "memory_pages" and with_memory:
+            pages = fields.get("memory_pages")
+            items.append(
+                (
+                    name,
+                    b"null"
+                    if pages is None
+                    else _object(
+                        [
+                            (str(start), _cells(cells, memory_encoding))
+                            for start, cells in pages.items()
+                        ]
+                    ),
+                )
+            )
+        elif name in selected and name not in MEMORY_FIELDS:
+            value = fields[name]
+            if name in ("stdin", "stdout"):
+                value = value.decode(bvm.IO_ENCODING)
+            items.append((name, _json(value)))
+    return _object(items)
+
+
+def instance_json(
+    instance: tables.BvmInstance,
+    fields: dict | None,
+    instance_fields: frozenset[str] = frozenset(schemas.INSTANCE_FIELDS),
+    bvm_fields: frozenset[str] = frozenset(schemas.BVM_FIELDS),
+    memory_offset: int | None = None,
+    memory_encoding: schemas.MemoryEncoding = schemas.MemoryEncoding.LIST,
+) -> bytes:
+    """
+    JSON of schemas.BvmInstanceFieldsSchema with selected fields of
+    BvmInstance record and of fields of its Bvm, all by default, see
+    bvm_json
+    """
+    items = [("id", _json(instance.id))]
+    for name in schemas.INSTANCE_FIELDS:
+        if name in instance_fields:
+            items.append((name, _json(getattr(instance, name))))
+    if bvm_fields:
+        items.append(
+            (
+                "bvm",
+                b"null"
+                if fields is None
+                else bvm_json(
+                    fields, bvm_fields, memory_offset, memory_encoding
+                ),
+            )
+        )
+    return _object(items)
+
+
+def json_response(
+    content: bytes | list[bytes], status_code: int = 200
+) -> fastapi.responses.Response:
+    """
+    Response with encoded JSON, or JSON array of list of encoded JSONs
+    """
+    if isinstance(content, list):
+        content = b"[" + b",".join(content) + b"]"
+    return fastapi.responses.Response(
+        content, status_code=status_code, media_type=JSON_MEDIA_TYPE
+    )
+
+
+def vm_instance_json(
+    instance: tables.BvmInstance, vm: bvm.BrainfuckVM | None
+) -> bytes:
+    """
+    JSON of BvmInstance with all fields of its Bvm vm, as
+    schemas.BvmInstanceSchema
+    """
+    return instance_json(
+        instance, None if vm is None else bvm.snapshot.vm_fields(vm)
+    )
+
+
+def snapshot_response(vm: bvm.BrainfuckVM) -> fastapi.responses.Response:
+    """
+    Response with binary snapshot of vm with embedded code, so it loads
+    without program registry
+    """
+    return fastapi.responses.Response(
+        bvm.snapshot.dumps(vm, program_ref=False),
+        media_type=SNAPSHOT_MEDIA_TYPE,
+    )
@@ -0,0 +1,407 @@
+"""
+Fair-share scheduler of execution jobs of tenants.
+
+Jobs run in bounded slices, e.g. settings.exec_slice_time seconds of a
+VM run, and at most max_running slices run at once. Each tenant has a
+queue of jobs waiting for their next slice, and the next slice is taken
+from tenant queues by deficit round robin: a tenant gets quantum seconds
+of credit per round, and run seconds of its slices are charged to it
+after they finish. So tenants share workers evenly by run time, however
+many jobs or however long loops they have. Job of idle tenant takes the
+next free worker, and other jobs wait for at most a slice of each other
+tenant.
+
+Steps and run seconds of tenants are counted per quota period. Jobs of
+tenant, which has exceeded its quota, are rejected and stopped at the
+end of their current slice. Jobs are rejected too, when queues are full.
+"""
+import abc
+import collections
+import concurrent.futures
+import threading
+import time
+
+import fastapi
+
+from cloud import exceptions, metrics, schemas
+from cloud.settings import settings
+
+DEFAULT_TENANT = "default"
+TENANT_MAX_LENGTH = 64
+
+
+def tenant(
+    x_tenant: str
+    | None = fastapi.Header(default=None, max_length=TENANT_MAX_LENGTH),
+) -> str:
+    """
+    Tenant of request by X-Tenant header, DEFAULT_TENANT if it is not set
+    """
+    return x_tenant or DEFAULT_TENANT
+
+
+class SlicedJob(abc.ABC):
+    """
+    Job run by Scheduler in slices. Its future is set, when it is done
+    """
+
+    def __init__(self, tenant: str):
+        self.tenant = tenant
+        self.future = concurrent.futures.Future()
+
+    @abc.abstractmethod
+    def start_slice(self) -> concurrent.futures.Future:
+        """
+        Start next slice of job, e.g. in worker pool
+
+        Returns
+        -------
+        Future of slice
+        """
+
+    @abc.abstractmethod
+    def slice_done(
+        self, future: concurrent.futures.Future
+    ) -> tuple[int, float]:
+        """
+        Take result of done slice, and set future of job, if it is done
+
+        Returns
+        -------
+        Steps executed and seconds run by slice
+        """
+
+    def fail(self, e: BaseException) -> None:
+        if not self.future.done():
+            self.future.set_exception(e)
+
+
+class Quota:
+    """
+    Steps and run seconds, which tenant may use per period seconds. None
+    is no limit
+    """
+
+    __slots__ = ("max_steps", "max_seconds", "period")
+
+    def __init__(
+        self,
+        max_steps: int | None = None,
+        max_seconds: float | None = None,
+        period: float = 3600.0,
+    ):
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.period = period
+
+
+class Usage:
+    __slots__ = ("since", "steps", "seconds")
+
+    def __init__(self, since: float):
+        self.since = since
+        self.steps = 0
+        self.seconds = 0.0
+
+
+class Scheduler:
+    """
+    Runs slices of SlicedJobs of tenants, at most max_running at once, by
+    deficit round robin with quantum seconds of credit per round.
+    Accepts at most max_queued unfinished jobs, and max_tenant_queued of
+    each tenant
+    """
+
+    def __init__(
+        self,
+        max_running: int,
+        quantum: float,
+        max_queued: int,
+        max_tenant_queued: int,
+        quota: Quota,
+    ):
+        self.max_running = max_running
+        self.quantum = quantum
+        self.max_queued = max_queued
+        self.max_tenant_queued = max_tenant_queued
+        self.quota = quota
+        # jobs waiting for next slice by tenant
+        self._queues: dict[str, collections.deque[SlicedJob]] = {}
+        # tenants with waiting jobs in round robin order
+        self._round: collections.deque[str] = collections.deque()
+        self._deficits: collections.defaultdict[
+            str, float
+        ] = collections.defaultdict(float)
+        # unfinished jobs by tenant
+        self._jobs: collections.Counter[str] = collections.Counter()
+        self._usage: dict[str, Usage] = {}
+        self._running = 0
+        self._done: list[tuple[SlicedJob, concurrent.futures.Future]] = []
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    def submit(self, job: SlicedJob) -> None:
+        """
+        Queue job to run its slices
+
+        Raises
+        ------
+        cloud.exceptions.QuotaExceeded : if tenant of job exceeded quota
+        cloud.exceptions.ExecQueueFull : if there are too many queued
+            jobs, or jobs of tenant
+        """
+        with self._cond:
+            self._check_quota(job.tenant)
+            if sum(self._jobs.values()) >= self.max_queued:
+                REJECTED_JOBS.inc(1, "queue_full")
+                raise exceptions.ExecQueueFull(
+                    f"Execution queue is full: {self.max_queued} jobs"
+                )
+            if self._jobs[job.tenant] >= self.max_tenant_queued:
+                REJECTED_JOBS.inc(1, "queue_full")
+                raise exceptions.ExecQueueFull(
+                    f"Tenant {job.tenant} has {self.max_tenant_queued} "
+                    "unfinished jobs already"
+                )
+            # job of idle tenant takes the next slice, as in "new flows"
+            # of FQ-CoDel, so tenants running few short jobs are not
+            # delayed by a round of busy ones
+            idle = not self._jobs[job.tenant]
+            self._jobs[job.tenant] += 1
+            self._enqueue(job, idle)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._dispatch, name="exec-scheduler", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+
+    def check_quota(self, tenant: str) -> None:
+        """
+        Raises
+        ------
+        cloud.exceptions.QuotaExceeded : if tenant exceeded quota
+        """
+        with self._cond:
+            self._check_quota(tenant)
+
+    def charge(self, tenant: str, steps: int, seconds: float) -> None:
+        """
+        Count steps and seconds run by tenant outside of scheduler, e.g.
+        in streams, to its quota
+        """
+        with self._cond:
+            self._charge(tenant, steps, seconds)
+
+    def usage(self, tenant: str) -> schemas.TenantUsageSchema:
+        """
+        Usage of tenant in current quota period and its quota
+        """
+        with self._cond:
+            usage = self._current_usage(tenant)
+            return schemas.TenantUsageSchema(
+                tenant=tenant,
+                steps=usage.steps,
+                seconds=usage.seconds,
+                max_steps=self.quota.max_steps,
+                max_seconds=self.quota.max_seconds,
+                period=self.quota.period,
+                period_left=max(
+                    usage.since + self.quota.period - time.monotonic(), 0.0
+                ),
+                jobs=self._jobs[tenant],
+            )
+
+    def counts(self) -> dict[tuple, int]:
+        """
+        Number of running slices and of jobs waiting for their slices
+        """
+        with self._cond:
+            waiting = sum(len(queue) for queue in self._queues.values())
+            return {("running",): self._running, ("waiting",): waiting}
+
+    def _current_usage(self, tenant: str) -> Usage:
+        now = time.monotonic()
+        usage = self._usage.get(tenant)
+        if usage is None or now - usage.since >= self.quota.period:
+            usage = self._usage[tenant] = Usage(now)
+        return usage
+
+    def _check_quota(self, tenant: str) -> None:
+        usage = self._current_usage(tenant)
+        if (
+            self.quota.max_steps is not None
+            and usage.steps >= self.quota.max_steps
+        ):
+            REJECTED_JOBS.inc(1, "quota")
+            raise exceptions.QuotaExceeded(
+                f"Tenant {tenant} exceeded quota of {self.quota.max_steps} "
+                f"steps per {self.quota.period:g} seconds"
+            )
+        if (
+            self.quota.max_seconds is not None
+            and usage.seconds >= self.quota.max_seconds
+        ):
+            REJECTED_JOBS.inc(1, "quota")
+            raise exceptions.QuotaExceeded(
+                f"Tenant {tenant} exceeded quota of "
+                f"{self.quota.max_seconds:g} run seconds per "
+                f"{self.quota.period:g} seconds"
+            )
+
+    def _charge(self, tenant: str, steps: int, seconds: float) -> None:
+        usage = self._current_usage(tenant)
+        usage.steps += steps
+        usage.seconds += seconds
+
+    def _enqueue(self, job: SlicedJob, first: bool = False) -> None:
+        queue = self._queues.get(job.tenant)
+        if queue is None:
+            queue = self._queues[job.tenant] = collections.deque()
+            if first:
+                self._round.appendleft(job.tenant)
+            else:
+                self._round.append(job.tenant)
+        queue.append(job)
+
+    def _next(self) -> SlicedJob | None:
+        """
+        Take job for next slice by deficit round robin. Tenant at the head
+        of round gets quantum of credit, up to quantum, and runs a slice,
+        if it has credit. Otherwise it waits for the next round
+        """
+        while self._round:
+            tenant = self._round.popleft()
+            self._deficits[tenant] = min(
+                self._deficits[tenant] + self.quantum, self.quantum
+            )
+            if self._deficits[tenant] <= 0:
+                self._round.append(tenant)
+                continue
+            queue = self._queues[tenant]
+            job = queue.popleft()
+            if queue:
+                self._round.append(tenant)
+            else:
+                del self._queues[tenant]
+            return job
+        return None
+
+    def _slice_finished(
+        self, job: SlicedJob, future: concurrent.futures.Future
+    ) -> None:
+        with self._cond:
+            self._done.append((job, future))
+            self._cond.notify()
+
+    def _dispatch(self) -> None:
+        """
+        Loop of scheduler thread: take results of done slices and start
+        next slices. Slices are started here rather than in callbacks of
+        worker pools, which must not submit to them
+        """
+        while True:
+            with self._cond:
+                while not self._done and (
+                    self._running >= self.max_running or not self._round
+                ):
+                    self._cond.wait()
+                done, self._done = self._done, []
+            for job, future in done:
+                self._finish_slice(job, future)
+            while True:
+                with self._cond:
+                    if self._running >= self.max_running:
+                        break
+                    job = self._next()
+                    if job is None:
+                        break
+                    self._running += 1
+                self._start_slice(job)
+
+    def _start_slice(self, job: SlicedJob) -> None:
+        if (
+            not job.future.running()
+            and not job.future.set_running_or_notify_cancel()
+        ):
+            # cancelled before its first slice
+            with self._cond:
+                self._running -= 1
+                self._jobs[job.tenant] -= 1
+            self._fail(job, concurrent.futures.CancelledError())
+            return
+        try:
+            future = job.start_slice()
+        except Exception as e:
+            with self._cond:
+                self._running -= 1
+                self._jobs[job.tenant] -= 1
+            self._fail(job, e)
+            return
+        future.add_done_callback(
+            lambda slice_future: self._slice_finished(job, slice_future)
+        )
+
+    def _finish_slice(
+        self, job: SlicedJob, future: concurrent.futures.Future
+    ) -> None:
+        steps, seconds = 0, 0.0
+        try:
+            steps, seconds = job.slice_done(future)
+        except Exception as e:
+            self._fail(job, e)
+        error = None
+        with self._cond:
+            self._running -= 1
+            self._charge(job.tenant, steps, seconds)
+            self._deficits[job.tenant] -= seconds
+            if not job.future.done():
+                try:
+                    self._check_quota(job.tenant)
+                except exceptions.QuotaExceeded as e:
+                    error = e
+                else:
+                    self._enqueue(job)
+                    return
+            self._jobs[job.tenant] -= 1
+            if not self._jobs[job.tenant]:
+                # idle tenant keeps its debt, but not its credit
+                deficit = self._deficits.pop(job.tenant)
+                if deficit < 0:
+                    self._deficits[job.tenant] = deficit
+        if error is not None:
+            self._fail(job, error)
+
+    @staticmethod
+    def _fail(job: SlicedJob, e: BaseException) -> None:
+        try:
+            job.fail(e)
+        except Exception:
+            # future of job is set anyway, and scheduler thread must go on
+            pass
+
+
+REJECTED_JOBS = metrics.Counter(
+    "bvm_exec_rejected_jobs_total",
+    "Execution jobs rejected or stopped by scheduler",
+    ("reason",),
+)
+
+scheduler = Scheduler(
+    settings.exec_workers,
+    settings.exec_quantum,
+    settings.exec_queue_max_size,
+    settings.exec_tenant_queue_max_size,
+    Quota(
+        settings.exec_tenant_max_steps,
+        settings.exec_tenant_max_seconds,
+        settings.exec_tenant_quota_period,
+    ),
+)
+
+metrics.CallbackGauge(
+    "bvm_exec_slices",
+    "Running slices of execution jobs and jobs waiting for their slices",
+    ("state",),
+    scheduler.counts,
+)
@@ -1,2 +1,3 @@
 from .bvm_instance import *
 from .common import *
+from .execution import *
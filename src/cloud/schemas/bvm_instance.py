@@ -1,10 +1,10 @@
 import enum
-import pathlib
 
 import numpy
 import pydantic
 
 import bvm
+from cloud.settings import settings
 
 
 class BvmState(str, enum.Enum):
@@ -15,48 +15,86 @@ class BvmState(str, enum.Enum):
 
 class BrainfuckVMSchema(pydantic.BaseModel):
     memory_size: int
-    memory: list[int]
+    # memory of sparse tape is memory_pages: touched pages by first cell
+    memory: list[int] | None
+    memory_pages: dict[int, list[int]] | None = None
+    sparse: bool = False
+    cell_type: bvm.CellType = bvm.DEFAULT_CELL_TYPE
     memory_ptr: int
     code: str | None
     code_ptr: int
     executed: int
-    stdin: list[str]
-    stdout: list[str]
+    stdin: str
+    stdout: str
+    backend: bvm.BackendType = bvm.DEFAULT_BACKEND
+    eof: bvm.EofBehavior = bvm.DEFAULT_EOF
+    overflow: bvm.OverflowBehavior = bvm.DEFAULT_OVERFLOW
 
     class Config:
         orm_mode = True
 
+    @pydantic.validator("stdin", "stdout", pre=True)
+    def join_chars(cls, value):
+        # stdin and stdout were lists of chars before
+        if isinstance(value, list):
+            return "".join(value)
+        return value
+
     @classmethod
     def from_vm(cls, vm: bvm.BrainfuckVM) -> "BrainfuckVMSchema":
+        memory, memory_pages = None, None
+        if vm.sparse:
+            memory_pages = {}
+            for page in bvm.tape.touched_pages(vm.memory).tolist():
+                start, end = bvm.tape.page_bounds(vm.memory, page)
+                memory_pages[start] = vm.memory[start:end].tolist()
+        else:
+            memory = vm.memory.tolist()
         return BrainfuckVMSchema(
             memory_size=vm.memory_size,
-            memory=vm.memory.tolist(),
+            memory=memory,
+            memory_pages=memory_pages,
+            sparse=vm.sparse,
+            cell_type=vm.cell_type,
             memory_ptr=vm.memory_ptr,
             code=vm.code,
             code_ptr=vm.code_ptr,
             executed=vm.executed,
-            stdin=vm.stdin.queue,
-            stdout=vm.stdout.queue,
+            stdin=vm.stdin.getvalue().decode(bvm.IO_ENCODING),
+            stdout=vm.stdout_as_str(),
+            backend=vm.backend,
+            eof=vm.eof,
+            overflow=vm.overflow,
         )
 
     def as_vm(self) -> bvm.BrainfuckVM:
-        vm = bvm.BrainfuckVM(memory_size=self.memory_size)
-        vm.memory = numpy.array(self.memory, dtype=numpy.uint8)
+        vm = bvm.BrainfuckVM(
+            memory_size=self.memory_size,
+            backend=self.backend,
+            sparse=self.sparse,
+            cell_type=self.cell_type,
+            eof=self.eof,
+            overflow=self.overflow,
+        )
+        if self.memory is not None:
+            vm.memory = numpy.array(self.memory, dtype=self.cell_type.value)
+        for start, cells in (self.memory_pages or {}).items():
+            vm.memory[start : start + len(cells)] = cells
         vm.memory_ptr = self.memory_ptr
         if self.code:
             vm.code = self.code
         vm.code_ptr = self.code_ptr
         vm.executed = self.executed
-        if self.stdin:
-            [vm.stdin.put_nowait(i) for i in self.stdin]
-        if self.stdout:
-            [vm.stdout.put_nowait(i) for i in self.stdout]
+        vm.feed(self.stdin.encode(bvm.IO_ENCODING))
+        vm.stdout.write(self.stdout.encode(bvm.IO_ENCODING))
         return vm
 
 
 class BvmInstanceBaseSchema(pydantic.BaseModel):
     state: BvmState
-    stored_at: pathlib.Path | None
+    stored_at: str | None
+    program_id: str | None = None
+    owner: str | None = None
     bvm: BrainfuckVMSchema | None
 
     class Config:
@@ -65,3 +103,113 @@ class BvmInstanceBaseSchema(pydantic.BaseModel):
 
 class BvmInstanceSchema(BvmInstanceBaseSchema):
     id: int
+
+
+class MemoryEncoding(str, enum.Enum):
+    LIST = "list"
+    # base64 of little-endian cells
+    BASE64 = "base64"
+
+
+class BrainfuckVMFieldsSchema(pydantic.BaseModel):
+    """
+    Selected fields of BrainfuckVMSchema, the rest are unset. Memory is
+    window of tape from memory_offset cell, if it was requested. Cells
+    of memory and memory_pages are list, or str with
+    MemoryEncoding.BASE64
+    """
+
+    memory_size: int | None
+    memory_offset: int | None
+    memory: list[int] | str | None
+    memory_pages: dict[int, list[int] | str] | None
+    sparse: bool | None
+    cell_type: bvm.CellType | None
+    memory_ptr: int | None
+    code: str | None
+    code_ptr: int | None
+    executed: int | None
+    stdin: str | None
+    stdout: str | None
+    backend: bvm.BackendType | None
+    eof: bvm.EofBehavior | None
+    overflow: bvm.OverflowBehavior | None
+
+
+# fields of BvmInstanceSchema and of its bvm, which can be selected
+INSTANCE_FIELDS = ("state", "stored_at", "program_id", "owner")
+BVM_FIELDS = tuple(BrainfuckVMSchema.__fields__)
+
+
+def select_fields(
+    fields: str | None,
+) -> tuple[frozenset[str], frozenset[str]]:
+    """
+    Parse comma-separated fields of BvmInstanceSchema to select. "bvm"
+    selects all fields of bvm
+
+    Raises
+    ------
+    ValueError : if there is unknown field
+
+    Returns
+    -------
+    Selected fields of BvmInstanceSchema and of its bvm, all by default
+    """
+    if fields is None:
+        return frozenset(INSTANCE_FIELDS), frozenset(BVM_FIELDS)
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = names - {*INSTANCE_FIELDS, *BVM_FIELDS, "bvm", "id"}
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    bvm_fields = frozenset(BVM_FIELDS) if "bvm" in names else names
+    return (
+        frozenset(names.intersection(INSTANCE_FIELDS)),
+        frozenset(bvm_fields.intersection(BVM_FIELDS)),
+    )
+
+
+def bvm_sections(bvm_fields: frozenset[str]) -> frozenset[str] | None:
+    """
+    Sections of Bvm snapshot to read for bvm_fields, None if Bvm is not
+    needed at all
+    """
+    if not bvm_fields:
+        return None
+    sections = set(bvm_fields.intersection(bvm.snapshot.SECTIONS))
+    if "memory_pages" in bvm_fields:
+        sections.add("memory")
+    return frozenset(sections)
+
+
+class BvmInstanceFieldsSchema(pydantic.BaseModel):
+    """
+    Selected fields of BvmInstanceSchema, the rest are unset
+    """
+
+    id: int
+    state: BvmState | None
+    stored_at: str | None
+    program_id: str | None
+    owner: str | None
+    bvm: BrainfuckVMFieldsSchema | None
+
+
+class BvmBatchAllocSchema(pydantic.BaseModel):
+    memory_sizes: pydantic.conlist(
+        int, min_items=1, max_items=settings.alloc_batch_max_size
+    )
+    backend: bvm.BackendType = bvm.DEFAULT_BACKEND
+    sparse: bool = False
+    cell_type: bvm.CellType = bvm.DEFAULT_CELL_TYPE
+    eof: bvm.EofBehavior = bvm.DEFAULT_EOF
+    overflow: bvm.OverflowBehavior = bvm.DEFAULT_OVERFLOW
+
+
+class VmCacheStatsSchema(pydantic.BaseModel):
+    vms: int
+    bytes: int
+    max_bytes: int
+    hits: int
+    misses: int
+    evictions: int
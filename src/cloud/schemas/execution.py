@@ -0,0 +1,128 @@
+import enum
+
+import pydantic
+
+import bvm
+from cloud import constants
+from cloud.settings import settings
+
+
+class JobState(str, enum.Enum):
+    QUEUED = "Queued"
+    RUNNING = "Running"
+    DONE = "Done"
+    FAILED = "Failed"
+
+
+class ExecRequestSchema(pydantic.BaseModel):
+    code: str | None = None
+    stdin: str = ""
+    max_steps: int | None = None
+    time_limit: float | None = None
+    profile: bool = False
+
+
+class BatchExecRequestSchema(pydantic.BaseModel):
+    code: str
+    stdins: pydantic.conlist(
+        str, min_items=1, max_items=settings.exec_batch_max_size
+    )
+    memory_size: int = constants.BVM_DEFAULT_MEMORY_SIZE
+    cell_type: bvm.CellType = bvm.DEFAULT_CELL_TYPE
+    eof: bvm.EofBehavior = bvm.DEFAULT_EOF
+    overflow: bvm.OverflowBehavior = bvm.DEFAULT_OVERFLOW
+    max_steps: int | None = None
+    time_limit: float | None = None
+
+
+class PositionProfileSchema(pydantic.BaseModel):
+    position: int
+    op: str
+    executed: int
+
+
+class LoopProfileSchema(pydantic.BaseModel):
+    begin: int
+    end: int
+    entries: int
+    iterations: int
+    seconds: float
+
+
+class ProfileReportSchema(pydantic.BaseModel):
+    ops: dict[str, int]
+    hot_positions: list[PositionProfileSchema]
+    loops: list[LoopProfileSchema]
+
+    @classmethod
+    def from_profile(
+        cls, profile: bvm.profiler.Profile, top: int
+    ) -> "ProfileReportSchema":
+        """
+        Report of profile with top most executed positions and top
+        slowest loops
+        """
+        code = profile.code or ""
+        hot = sorted(
+            range(len(code)), key=lambda i: (-profile.positions[i], i)
+        )[:top]
+        return cls(
+            ops=profile.op_counts(),
+            hot_positions=[
+                PositionProfileSchema(
+                    position=i, op=code[i], executed=profile.positions[i]
+                )
+                for i in hot
+                if profile.positions[i]
+            ],
+            loops=[
+                LoopProfileSchema(
+                    begin=begin,
+                    end=end,
+                    entries=entries,
+                    iterations=iterations,
+                    seconds=seconds,
+                )
+                for begin, end, entries, iterations, seconds in (
+                    profile.loops()[:top]
+                )
+            ],
+        )
+
+
+class StreamResultSchema(pydantic.BaseModel):
+    status: bvm.RunStatus
+    executed: int
+    code_ptr: int
+    program_id: str | None = None
+    # ops executed and seconds spent by the run
+    steps: int = 0
+    seconds: float = 0.0
+    profile: ProfileReportSchema | None = None
+
+
+class ExecResultSchema(StreamResultSchema):
+    stdout: str
+
+
+class JobSchema(pydantic.BaseModel):
+    id: str
+    bvm_instance_id: int
+    state: JobState
+    result: ExecResultSchema | None
+    error: str | None
+
+
+class TenantUsageSchema(pydantic.BaseModel):
+    tenant: str
+    # used in current quota period
+    steps: int
+    seconds: float
+    # quota, None is no limit
+    max_steps: int | None
+    max_seconds: float | None
+    period: float
+    # seconds until usage is reset
+    period_left: float
+    # unfinished execution jobs
+    jobs: int
@@ -1 +1 @@
-from . import alloc
+from . import alloc, execution, streaming
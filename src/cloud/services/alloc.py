@@ -1,81 +1,229 @@
-import json
-import pathlib
-import uuid
+import asyncio
+import collections
+import threading
 
 import fastapi
+import numpy as np
 import sqlalchemy.orm
+from sqlalchemy.ext import asyncio as sqlalchemy_asyncio
 
 import bvm
-from cloud import constants, database, exceptions, schemas, tables
+from cloud import database, exceptions, metrics, schemas, storage, tables
+from cloud.settings import settings
 
 
-def bvm_storage_path() -> pathlib.Path:
+def vm_footprint(vm: bvm.BrainfuckVM) -> int:
     """
-    Create new file to store bvm state.
-
-    Returns
-    -------
-    Path to file, where vm state stored
+    Approximate amount of memory in bytes held by vm
     """
-    filename = f"vm_{uuid.uuid4()}.json"
-    storage_path = constants.BVM_STORAGE_ROOT / filename
-    if storage_path.exists():
-        return bvm_storage_path()
-    storage_path.parent.mkdir(parents=True, exist_ok=True)
-    storage_path.touch()
-    return storage_path
+    footprint = (
+        bvm.tape.resident_bytes(vm.memory, vm.sparse)
+        + len(vm.code or "")
+        + len(vm.stdin)
+        + len(vm.stdout)
+    )
+    if vm.base_memory is not None and not np.may_share_memory(
+        vm.base_memory, vm.memory
+    ):
+        # memory was copied on write, stored memory is kept too
+        footprint += bvm.tape.resident_bytes(vm.base_memory, vm.sparse) + len(
+            vm.base_stdout
+        )
+    return footprint
 
 
-def store_bvm(vm: bvm.BrainfuckVM, dest: pathlib.Path) -> None:
+class VmCache:
     """
-    Store VM to dest file
+    LRU cache of loaded BrainfuckVMs by BvmInstance id. Least recently
+    used VMs are evicted, when footprint of cached VMs exceeds max_bytes.
 
-    Parameters
-    ----------
-    vm : BrainfuckVM to store
-    dest : file, where vm will be stored. Must exists
+    New, forked and streamed VMs are written through the cache. Execution
+    jobs store new state from worker processes, so they invalidate the
+    cached VM instead, and it is loaded from storage on next access
 
-    Raises
-    ------
-    ValueError : if dest file not exists
+    invalidate bumps generation of id, so VM loaded before it, e.g. while
+    a job stored new state, is not put back by put with generation read
+    before loading
     """
-    if not dest.exists():
-        raise FileNotFoundError(f"File {dest} not exists")
-    with open(dest, "w") as f:
-        f.write(schemas.BrainfuckVMSchema.from_vm(vm).json())
 
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._vms: collections.OrderedDict[
+            int, tuple[bvm.BrainfuckVM, int]
+        ] = collections.OrderedDict()
+        self._generations: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, bvm_instance_id: int) -> bvm.BrainfuckVM | None:
+        with self._lock:
+            cached = self._vms.get(bvm_instance_id)
+            if cached is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._vms.move_to_end(bvm_instance_id)
+            return cached[0]
+
+    def generation(self, bvm_instance_id: int) -> int:
+        with self._lock:
+            return self._generations.get(bvm_instance_id, 0)
+
+    def put(
+        self,
+        bvm_instance_id: int,
+        vm: bvm.BrainfuckVM,
+        generation: int | None = None,
+    ) -> None:
+        """
+        Cache vm. VM loaded from storage is put with generation read
+        before loading it, and is dropped, if it was invalidated since
+        """
+        footprint = vm_footprint(vm)
+        with self._lock:
+            if generation is not None and generation != self._generations.get(
+                bvm_instance_id, 0
+            ):
+                return
+            self._pop(bvm_instance_id)
+            if footprint > self.max_bytes:
+                return
+            self._vms[bvm_instance_id] = vm, footprint
+            self.bytes += footprint
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_footprint) = self._vms.popitem(last=False)
+                self.bytes -= evicted_footprint
+                self.evictions += 1
+
+    def invalidate(self, bvm_instance_id: int) -> None:
+        with self._lock:
+            self._pop(bvm_instance_id)
+            self._generations[bvm_instance_id] = (
+                self._generations.get(bvm_instance_id, 0) + 1
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._vms.clear()
+            self.bytes = 0
+
+    def _pop(self, bvm_instance_id: int) -> None:
+        cached = self._vms.pop(bvm_instance_id, None)
+        if cached is not None:
+            self.bytes -= cached[1]
+
+    def stats(self) -> schemas.VmCacheStatsSchema:
+        with self._lock:
+            return schemas.VmCacheStatsSchema(
+                vms=len(self._vms),
+                bytes=self.bytes,
+                max_bytes=self.max_bytes,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+            )
 
-def load_vm_from_file(vm_file: pathlib.Path) -> bvm.BrainfuckVM:
-    """
-    Load BrainfuckVM from file
 
-    Parameters
-    ----------
-    vm_file: file, where vm is stored. Must exists
+vm_cache = VmCache(settings.vm_cache_max_bytes)
 
-    Raises
-    ------
-    ValueError : if vm_file file not exists
+
+def count_bvm_instances() -> dict[tuple, int]:
+    """
+    Count BvmInstances by state
+    """
+    counts = {(state.value,): 0 for state in schemas.BvmState}
+    with sqlalchemy.orm.Session(database.engine) as session:
+        for state, count in session.query(
+            tables.BvmInstance.state, sqlalchemy.func.count()
+        ).group_by(tables.BvmInstance.state):
+            counts[(state.value,)] = count
+    return counts
+
+
+def read_vm_fields(
+    instance: tables.BvmInstance,
+    sections: frozenset[str] | None,
+    memory_start: int = 0,
+    memory_stop: int | None = None,
+) -> dict | None:
+    """
+    Read sections of Bvm of instance from VM cache, or from storage
+    without loading the Bvm, see storage.load_fields
 
     Returns
     -------
-    Loaded BrainfuckVM
+    Fields of Bvm, or None if sections are None or Bvm does not exist
     """
-    if not vm_file.exists():
-        raise FileNotFoundError(f"File {vm_file} not exists")
-    with open(vm_file, "r") as f:
-        json_vm = json.loads(f.read())
-        return schemas.BrainfuckVMSchema(**json_vm).as_vm()
+    if sections is None or instance.state is schemas.BvmState.NOT_EXISTS:
+        return None
+    vm = vm_cache.get(instance.id)
+    if vm is not None:
+        return bvm.snapshot.vm_fields(vm, sections, memory_start, memory_stop)
+    return storage.load_fields(
+        instance.stored_at, sections, memory_start, memory_stop
+    )
+
+
+metrics.CallbackGauge(
+    "bvm_instances",
+    "BvmInstances by state",
+    ("state",),
+    count_bvm_instances,
+)
 
 
-class AllocService:
+class AsyncAllocService:
+    """
+    Allocates BvmInstances on async database session. Storage I/O runs in
+    threads, so it blocks neither event loop nor threadpool of sync
+    handlers
+    """
+
     def __init__(
         self,
-        session: sqlalchemy.orm.Session = fastapi.Depends(database.session),
+        session: sqlalchemy_asyncio.AsyncSession = fastapi.Depends(
+            database.async_session
+        ),
     ):
         self.session = session
 
-    def get_instance_and_vm(
+    async def _get_instance(self, bvm_instance_id: int) -> tables.BvmInstance:
+        instance = await self.session.get(tables.BvmInstance, bvm_instance_id)
+        if not instance:
+            raise exceptions.NoSuchBvmInstance(
+                f"No BvmInstance with id={bvm_instance_id}"
+            )
+        return instance
+
+    @staticmethod
+    async def _load_vms(
+        instances: list[tables.BvmInstance],
+    ) -> dict[int, bvm.BrainfuckVM | None]:
+        vms: dict[int, bvm.BrainfuckVM | None] = {}
+        not_cached = []
+        for instance in instances:
+            vms[instance.id] = None
+            if instance.state is schemas.BvmState.NOT_EXISTS:
+                continue
+            vms[instance.id] = vm_cache.get(instance.id)
+            if vms[instance.id] is None:
+                not_cached.append(instance)
+        generations = [vm_cache.generation(i.id) for i in not_cached]
+        loaded = await asyncio.gather(
+            *(
+                storage.load_async(instance.stored_at)
+                for instance in not_cached
+            )
+        )
+        for instance, vm, generation in zip(not_cached, loaded, generations):
+            vm_cache.put(instance.id, vm, generation)
+            vms[instance.id] = vm
+        return vms
+
+    async def get_instance_and_vm(
         self, bvm_instance_id: int
     ) -> tuple[tables.BvmInstance, bvm.BrainfuckVM]:
         """
@@ -95,23 +243,121 @@ class AllocService:
         -------
         Info and Bvm of BvmInstance, if exists
         """
-        instance = (
-            self.session.query(tables.BvmInstance)
-            .filter_by(id=bvm_instance_id)
-            .first()
-        )
-        if not instance:
-            raise exceptions.NoSuchBvmInstance(
-                f"No BvmInstance with id={bvm_instance_id}"
+        instance = await self._get_instance(bvm_instance_id)
+        vms = await self._load_vms([instance])
+        return instance, vms[instance.id]
+
+    async def get_instances_and_vms(
+        self, bvm_instance_ids: list[int]
+    ) -> list[tuple[tables.BvmInstance, bvm.BrainfuckVM]]:
+        """
+        Get from database bvm instances by bvm_instance_ids with one query.
+        Load Bvms, which are not cached, from storage in parallel.
+
+        Parameters
+        ----------
+        bvm_instance_ids : IDs of BvmInstances
+
+        Returns
+        -------
+        Info and Bvm of found BvmInstances in order of bvm_instance_ids.
+        Not found ids are skipped
+        """
+        bvm_instance_ids = list(dict.fromkeys(bvm_instance_ids))
+        result = await self.session.execute(
+            sqlalchemy.select(tables.BvmInstance).where(
+                tables.BvmInstance.id.in_(bvm_instance_ids)
             )
+        )
+        instances = {instance.id: instance for instance in result.scalars()}
+        found = [instances[i] for i in bvm_instance_ids if i in instances]
+        vms = await self._load_vms(found)
+        return [(instance, vms[instance.id]) for instance in found]
+
+    async def get_instance_fields(
+        self,
+        bvm_instance_id: int,
+        sections: frozenset[str] | None,
+        memory_start: int = 0,
+        memory_stop: int | None = None,
+    ) -> tuple[tables.BvmInstance, dict | None]:
+        """
+        Get from database bvm instance by bvm_instance_id. Read requested
+        sections of its Bvm without loading it, see get_instances_fields
+
+        Raises
+        ------
+        cloud.exceptions.NoSuchBvmInstance :
+            if no record with bvm_instance_id found
+
+        Returns
+        -------
+        Info and fields of Bvm of BvmInstance
+        """
+        instance = await self._get_instance(bvm_instance_id)
+        fields = await asyncio.to_thread(
+            read_vm_fields, instance, sections, memory_start, memory_stop
+        )
+        return instance, fields
+
+    async def get_instances_fields(
+        self,
+        bvm_instance_ids: list[int],
+        sections: frozenset[str] | None,
+        memory_start: int = 0,
+        memory_stop: int | None = None,
+    ) -> list[tuple[tables.BvmInstance, dict | None]]:
+        """
+        Get from database bvm instances by bvm_instance_ids with one query.
+        Read requested sections of their Bvms in parallel, without
+        loading them. Bvms are not read at all, if sections are None
+
+        Parameters
+        ----------
+        bvm_instance_ids : IDs of BvmInstances
+        sections : sections of Bvm snapshots to read, see
+            bvm.snapshot.read_fields
+        memory_start : first cell of memory window
+        memory_stop : cell to stop memory window at, memory_size by default
 
-        vm: bvm.BrainfuckVM | None = None
-        if instance.state is not schemas.BvmState.NOT_EXISTS:
-            vm = load_vm_from_file(pathlib.Path(instance.stored_at))
-        return instance, vm
+        Returns
+        -------
+        Info and fields of Bvm of found BvmInstances in order of
+        bvm_instance_ids. Not found ids are skipped
+        """
+        bvm_instance_ids = list(dict.fromkeys(bvm_instance_ids))
+        result = await self.session.execute(
+            sqlalchemy.select(tables.BvmInstance).where(
+                tables.BvmInstance.id.in_(bvm_instance_ids)
+            )
+        )
+        instances = {instance.id: instance for instance in result.scalars()}
+        found = [instances[i] for i in bvm_instance_ids if i in instances]
+        if sections is None:
+            return [(instance, None) for instance in found]
+        fields = await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    read_vm_fields,
+                    instance,
+                    sections,
+                    memory_start,
+                    memory_stop,
+                )
+                for instance in found
+            )
+        )
+        return list(zip(found, fields))
 
-    def new_bvm_instance(
-        self, memory_size: int
+    async def new_bvm_instance(
+        self,
+        memory_size: int,
+        backend: bvm.BackendType = bvm.DEFAULT_BACKEND,
+        sparse: bool = False,
+        cell_type: bvm.CellType = bvm.DEFAULT_CELL_TYPE,
+        eof: bvm.EofBehavior = bvm.DEFAULT_EOF,
+        overflow: bvm.OverflowBehavior = bvm.DEFAULT_OVERFLOW,
+        owner: str | None = None,
     ) -> tuple[tables.BvmInstance, bvm.BrainfuckVM]:
         """
         Creates new BvmInstance
@@ -119,6 +365,13 @@ class AllocService:
         Parameters
         ----------
         memory_size : amount of memory in new Bvm
+        backend : execution backend of new Bvm
+        sparse : whether memory of new Bvm is allocated by pages on first
+            touch
+        cell_type : type of memory cells of new Bvm
+        eof : what "," does in new Bvm at the end of input
+        overflow : what "+" and "-" do to cells of new Bvm at their bounds
+        owner : tenant creating BvmInstance
 
         Raises
         ------
@@ -128,25 +381,147 @@ class AllocService:
         -------
         New BvmInstance with Bvm
         """
-        if memory_size <= 0:
-            raise ValueError(
-                f"BrainfuckVM cannot be initialized with memory_size={memory_size}"
+        (created,) = await self.new_bvm_instances(
+            [memory_size], backend, sparse, cell_type, eof, overflow, owner
+        )
+        return created
+
+    async def new_bvm_instances(
+        self,
+        memory_sizes: list[int],
+        backend: bvm.BackendType = bvm.DEFAULT_BACKEND,
+        sparse: bool = False,
+        cell_type: bvm.CellType = bvm.DEFAULT_CELL_TYPE,
+        eof: bvm.EofBehavior = bvm.DEFAULT_EOF,
+        overflow: bvm.OverflowBehavior = bvm.DEFAULT_OVERFLOW,
+        owner: str | None = None,
+    ) -> list[tuple[tables.BvmInstance, bvm.BrainfuckVM]]:
+        """
+        Creates new BvmInstances in one transaction. Their Bvms are stored
+        in parallel
+
+        Parameters
+        ----------
+        memory_sizes : amount of memory in each new Bvm
+        backend : execution backend of new Bvms
+        sparse : whether memory of new Bvms is allocated by pages on first
+            touch
+        cell_type : type of memory cells of new Bvms
+        eof : what "," does in new Bvms at the end of input
+        overflow : what "+" and "-" do to cells of new Bvms at their
+            bounds
+        owner : tenant creating BvmInstances
+
+        Raises
+        ------
+        ValueError : if any of memory_sizes is invalid
+
+        Returns
+        -------
+        New BvmInstances with Bvms in order of memory_sizes
+        """
+        for memory_size in memory_sizes:
+            if memory_size <= 0:
+                raise ValueError(
+                    "BrainfuckVM cannot be initialized with "
+                    f"memory_size={memory_size}"
+                )
+
+        vms = [
+            bvm.BrainfuckVM(
+                size,
+                backend,
+                sparse=sparse,
+                cell_type=cell_type,
+                eof=eof,
+                overflow=overflow,
+            )
+            for size in memory_sizes
+        ]
+        locations = [storage.new_location() for _ in vms]
+        new_instances = [
+            tables.BvmInstance(
+                state=schemas.BvmState.AVAILABLE,
+                stored_at=location,
+                owner=owner,
             )
+            for location in locations
+        ]
+        try:
+            await asyncio.to_thread(storage.store_many, vms, locations)
+            self.session.add_all(new_instances)
+            await self.session.commit()
+        except Exception:
+            await self.session.rollback()
+            await asyncio.to_thread(_delete_all, locations)
+            raise
+        for instance, vm in zip(new_instances, vms):
+            vm_cache.put(instance.id, vm)
+        return list(zip(new_instances, vms))
+
+    async def fork_bvm_instance(
+        self, bvm_instance_id: int, count: int = 1
+    ) -> list[tuple[tables.BvmInstance, bvm.BrainfuckVM]]:
+        """
+        Creates count new BvmInstances in the state of BvmInstance of
+        bvm_instance_id. Forks share code, compiled program and memory with
+        it until their first write, both loaded and in storage
 
-        new_instance_storage = bvm_storage_path()
-        new_instance = tables.BvmInstance(
-            state=schemas.BvmState.AVAILABLE,
-            stored_at=str(new_instance_storage),
-        )
+        Parameters
+        ----------
+        bvm_instance_id : ID of BvmInstance to fork
+        count : number of forks
 
-        vm = bvm.BrainfuckVM(memory_size)
-        store_bvm(vm, new_instance_storage)
+        Raises
+        ------
+        cloud.exceptions.NoSuchBvmInstance :
+            if no record with bvm_instance_id found
+        cloud.exceptions.BvmInstanceBusy :
+            if BvmInstance is computing
+        ValueError : if count is invalid or BvmInstance has no Bvm
 
-        self.session.add(new_instance)
-        self.session.commit()
-        return new_instance, vm
+        Returns
+        -------
+        New BvmInstances with Bvms
+        """
+        if count <= 0:
+            raise ValueError(f"Cannot fork BvmInstance {count} times")
+        parent, vm = await self.get_instance_and_vm(bvm_instance_id)
+        if parent.state is schemas.BvmState.COMPUTING:
+            raise exceptions.BvmInstanceBusy(
+                f"BvmInstance with id={bvm_instance_id} is "
+                f"{parent.state.value}"
+            )
+        if vm is None:
+            raise ValueError(
+                f"BvmInstance with id={bvm_instance_id} has no BrainfuckVM"
+            )
 
-    def delete_bvm_instance(self, bvm_instance_id: int):
+        locations = await asyncio.to_thread(
+            storage.fork, parent.stored_at, count
+        )
+        new_instances = [
+            tables.BvmInstance(
+                state=schemas.BvmState.AVAILABLE,
+                stored_at=location,
+                program_id=parent.program_id,
+                owner=parent.owner,
+            )
+            for location in locations
+        ]
+        try:
+            self.session.add_all(new_instances)
+            await self.session.commit()
+        except Exception:
+            await self.session.rollback()
+            await asyncio.to_thread(_delete_all, locations)
+            raise
+        forked = [(instance, vm.fork()) for instance in new_instances]
+        for instance, forked_vm in forked:
+            vm_cache.put(instance.id, forked_vm)
+        return forked
+
+    async def delete_bvm_instance(self, bvm_instance_id: int):
         """
         Delete Bvm instance
 
@@ -158,16 +533,36 @@ class AllocService:
         ------
         cloud.exceptions.NoSuchBvmInstance :
             if no record with bvm_instance_id found
+        cloud.exceptions.BvmInstanceBusy :
+            if BvmInstance is computing, as its job would store Bvm again
         """
-        instance = (
-            self.session.query(tables.BvmInstance)
-            .filter_by(id=bvm_instance_id)
-            .first()
+        instance = await self._get_instance(bvm_instance_id)
+        stored_at = instance.stored_at
+        await self.session.execute(
+            sqlalchemy.delete(tables.BvmProfile).where(
+                tables.BvmProfile.bvm_instance_id == bvm_instance_id
+            )
         )
-        if not instance:
-            raise exceptions.NoSuchBvmInstance(
-                f"No BvmInstance with id={bvm_instance_id}"
+        # state is checked by the delete itself, so no job acquires
+        # BvmInstance in between
+        deleted = await self.session.execute(
+            sqlalchemy.delete(tables.BvmInstance).where(
+                tables.BvmInstance.id == bvm_instance_id,
+                tables.BvmInstance.state != schemas.BvmState.COMPUTING,
             )
+        )
+        if not deleted.rowcount:
+            await self.session.rollback()
+            raise exceptions.BvmInstanceBusy(
+                f"BvmInstance with id={bvm_instance_id} is "
+                f"{schemas.BvmState.COMPUTING.value}"
+            )
+        await self.session.commit()
+        vm_cache.invalidate(bvm_instance_id)
+        if stored_at:
+            await asyncio.to_thread(storage.delete, stored_at)
+
 
-        self.session.delete(instance)
-        self.session.commit()
+def _delete_all(locations: list[str]) -> None:
+    for location in locations:
+        storage.delete(location)
@@ -0,0 +1,578 @@
+import collections
+import concurrent.futures
+import functools
+import multiprocessing
+import threading
+import time
+import uuid
+from typing import Callable
+
+import fastapi
+import numpy as np
+import sqlalchemy.orm
+
+import bvm
+from cloud import (
+    database,
+    exceptions,
+    metrics,
+    scheduler,
+    schemas,
+    storage,
+    tables,
+)
+from cloud.settings import settings
+
+from . import alloc
+
+_worker_pool: concurrent.futures.Executor | None = None
+_worker_pool_lock = threading.Lock()
+
+
+def worker_pool() -> concurrent.futures.Executor:
+    """
+    Get process pool running execution jobs, create it on first call
+    """
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=settings.exec_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _worker_pool
+
+
+def shutdown_worker_pool() -> None:
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is not None:
+            _worker_pool.shutdown(cancel_futures=True)
+            _worker_pool = None
+
+
+def run_job(
+    stored_at: str,
+    request: schemas.ExecRequestSchema,
+    time_limit: float,
+    profile: bvm.profiler.Profile | None = None,
+) -> tuple[schemas.ExecResultSchema, bvm.profiler.Profile | None, int]:
+    """
+    Load VM, run it and store it back. Executed in worker process
+
+    Parameters
+    ----------
+    stored_at : storage location of vm
+    request : what to run
+    time_limit : seconds to run vm for at most
+    profile : profile of previous slices of profiled run to resume
+
+    Returns
+    -------
+    Result of run, its profile, if it was profiled, and steps of
+    request.max_steps it spent, see BrainfuckVM.spent
+    """
+    vm = storage.load(stored_at)
+    if request.code is not None:
+        vm.upload_code(request.code)
+        vm.code_ptr = 0
+    vm.input(request.stdin)
+    if request.profile:
+        vm.profile = bvm.profiler.Profile() if profile is None else profile
+    executed_before = vm.executed
+    started = time.monotonic()
+    status = vm.run(
+        max_steps=request.max_steps,
+        deadline=started + time_limit,
+    )
+    seconds = time.monotonic() - started
+    storage.store(vm, stored_at)
+    result = schemas.ExecResultSchema(
+        status=status,
+        executed=vm.executed,
+        code_ptr=vm.code_ptr,
+        program_id=bvm.registry.program_id(vm.code) if vm.code else None,
+        steps=vm.executed - executed_before,
+        seconds=seconds,
+        stdout=vm.stdout_as_str(),
+        profile=profile_report(vm),
+    )
+    return result, vm.profile, vm.spent
+
+
+def run_batch(
+    request: schemas.BatchExecRequestSchema, time_limit: float
+) -> list[schemas.ExecResultSchema]:
+    """
+    Run code on each of stdins in new VMs stepped in lockstep. Executed
+    in worker process
+
+    Parameters
+    ----------
+    request : what to run
+    time_limit : seconds to run VMs for at most
+
+    Raises
+    ------
+    ValueError : if code has unbalanced brackets or memory_size is invalid
+
+    Returns
+    -------
+    Result of run of each VM in order of stdins
+    """
+    batch = bvm.BatchVM(
+        request.code,
+        [stdin.encode(bvm.IO_ENCODING) for stdin in request.stdins],
+        request.memory_size,
+        request.cell_type,
+        request.eof,
+        request.overflow,
+    )
+    started = time.monotonic()
+    statuses = batch.run(request.max_steps, started + time_limit)
+    seconds = time.monotonic() - started
+    return [
+        schemas.ExecResultSchema(
+            status=status,
+            executed=executed,
+            code_ptr=code_ptr,
+            steps=executed,
+            seconds=seconds,
+            stdout=stdout.getvalue().decode(bvm.IO_ENCODING),
+        )
+        for status, executed, code_ptr, stdout in zip(
+            statuses,
+            batch.executed.tolist(),
+            batch.code_ptrs.tolist(),
+            batch.stdouts,
+        )
+    ]
+
+
+def observe_batch(future: concurrent.futures.Future) -> None:
+    """
+    Record run metrics of done batch
+    """
+    if future.cancelled() or future.exception() is not None:
+        return
+    results = future.result()
+    metrics.EXECUTED_STEPS.inc(sum(r.steps for r in results), "batch")
+    metrics.RUN_SECONDS.inc(results[0].seconds, "batch")
+
+
+def profile_report(vm: bvm.BrainfuckVM) -> schemas.ProfileReportSchema | None:
+    if vm.profile is None:
+        return None
+    return schemas.ProfileReportSchema.from_profile(
+        vm.profile, settings.profile_report_top
+    )
+
+
+class Job:
+    __slots__ = ("id", "bvm_instance_id", "future")
+
+    def __init__(
+        self, bvm_instance_id: int, future: concurrent.futures.Future
+    ):
+        self.id = str(uuid.uuid4())
+        self.bvm_instance_id = bvm_instance_id
+        self.future = future
+
+    @property
+    def state(self) -> schemas.JobState:
+        if not self.future.done():
+            if self.future.running():
+                return schemas.JobState.RUNNING
+            return schemas.JobState.QUEUED
+        if self.future.cancelled() or self.future.exception() is not None:
+            return schemas.JobState.FAILED
+        return schemas.JobState.DONE
+
+    def as_schema(self) -> schemas.JobSchema:
+        state = self.state
+        result, error = None, None
+        if state is schemas.JobState.DONE:
+            result = self.future.result()
+        elif state is schemas.JobState.FAILED:
+            error = (
+                "Job was cancelled"
+                if self.future.cancelled()
+                else repr(self.future.exception())
+            )
+        return schemas.JobSchema(
+            id=self.id,
+            bvm_instance_id=self.bvm_instance_id,
+            state=state,
+            result=result,
+            error=error,
+        )
+
+
+class JobRegistry:
+    """
+    Jobs by id. Finished jobs are dropped oldest first, when there are
+    more than max_finished jobs
+    """
+
+    def __init__(self, max_finished: int):
+        self.max_finished = max_finished
+        self._jobs: collections.OrderedDict[
+            str, Job
+        ] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, job: Job) -> None:
+        with self._lock:
+            self._jobs[job.id] = job
+            excess = len(self._jobs) - self.max_finished
+            if excess > 0:
+                finished = [
+                    job_id
+                    for job_id, j in self._jobs.items()
+                    if j.future.done()
+                ]
+                for job_id in finished[:excess]:
+                    del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+jobs = JobRegistry(settings.exec_jobs_history)
+
+
+class ExecJob(scheduler.SlicedJob):
+    """
+    Run of Bvm by run_job in slices of settings.exec_slice_time seconds,
+    each resuming Bvm stored by the previous one. Profile of profiled run
+    is kept by job and resumed by its next slice, as it is not stored with
+    Bvm. So is the budget of max_steps spent by slices, which counts
+    loop iterations besides executed ops. BvmInstance is released by
+    release(profile, program_id), before future of job is set
+    """
+
+    def __init__(
+        self,
+        tenant: str,
+        pool: concurrent.futures.Executor,
+        stored_at: str,
+        request: schemas.ExecRequestSchema,
+        time_limit: float,
+        release: Callable[..., None],
+    ):
+        super().__init__(tenant)
+        self.pool = pool
+        self.release = release
+        self.stored_at = stored_at
+        self.request = request
+        self.time_left = time_limit
+        self.slices = 0
+        self.steps = 0
+        self.spent = 0
+        self.seconds = 0.0
+        self.profile: bvm.profiler.Profile | None = None
+
+    def start_slice(self) -> concurrent.futures.Future:
+        request = self.request
+        if self.slices:
+            # code is uploaded and input is fed by the first slice
+            max_steps = None
+            if request.max_steps is not None:
+                max_steps = max(request.max_steps - self.spent, 0)
+            request = request.copy(
+                update={"code": None, "stdin": "", "max_steps": max_steps}
+            )
+        slice_time = min(settings.exec_slice_time, self.time_left)
+        self.slices += 1
+        return self.pool.submit(
+            run_job, self.stored_at, request, slice_time, self.profile
+        )
+
+    def slice_done(
+        self, future: concurrent.futures.Future
+    ) -> tuple[int, float]:
+        result, self.profile, spent = future.result()
+        metrics.EXECUTED_STEPS.inc(result.steps, "job")
+        metrics.RUN_SECONDS.inc(result.seconds, "job")
+        self.steps += result.steps
+        self.spent += spent
+        self.seconds += result.seconds
+        self.time_left -= result.seconds
+        if (
+            result.status is not bvm.RunStatus.DEADLINE_EXCEEDED
+            or self.time_left <= 0
+        ):
+            self.release(result.profile, result.program_id)
+            self.future.set_result(
+                result.copy(
+                    update={"steps": self.steps, "seconds": self.seconds}
+                )
+            )
+        return result.steps, result.seconds
+
+    def fail(self, e: BaseException) -> None:
+        try:
+            self.release()
+        finally:
+            super().fail(e)
+
+
+class BatchJob(scheduler.SlicedJob):
+    """
+    Run of run_batch in one slice, as VMs of batch are not stored
+    """
+
+    def __init__(
+        self,
+        tenant: str,
+        pool: concurrent.futures.Executor,
+        request: schemas.BatchExecRequestSchema,
+    ):
+        super().__init__(tenant)
+        self.pool = pool
+        self.request = request
+
+    def start_slice(self) -> concurrent.futures.Future:
+        return self.pool.submit(
+            run_batch, self.request, exec_time_limit(self.request)
+        )
+
+    def slice_done(
+        self, future: concurrent.futures.Future
+    ) -> tuple[int, float]:
+        results = future.result()
+        self.future.set_result(results)
+        return sum(r.steps for r in results), results[0].seconds
+
+
+def release_bvm_instance(
+    bind: sqlalchemy.engine.Connectable,
+    bvm_instance_id: int,
+    profile: schemas.ProfileReportSchema | None = None,
+    program_id: str | None = None,
+    vm: bvm.BrainfuckVM | None = None,
+) -> None:
+    """
+    Make BvmInstance available after its job is done. Save profile report
+    of the run, if it was profiled, and id of program the Bvm runs.
+    Stored vm is written through VM cache, otherwise the cached Bvm is
+    invalidated, as jobs store new state from worker processes
+
+    Parameters
+    ----------
+    bind : database to update
+    bvm_instance_id : ID of BvmInstance
+    profile : profile report of the run
+    program_id : id of program in bvm.registry the Bvm runs
+    vm : Bvm stored by the caller, if it ran in this process
+    """
+    # job has stored new state of vm
+    alloc.vm_cache.invalidate(bvm_instance_id)
+    if vm is not None:
+        # still computing, so nothing else changes the Bvm before it is put
+        alloc.vm_cache.put(bvm_instance_id, vm)
+    values = {"state": schemas.BvmState.AVAILABLE}
+    if program_id is not None:
+        values["program_id"] = program_id
+    with sqlalchemy.orm.Session(bind) as session:
+        session.query(tables.BvmInstance).filter_by(
+            id=bvm_instance_id, state=schemas.BvmState.COMPUTING
+        ).update(values)
+        if profile is not None:
+            session.merge(
+                tables.BvmProfile(
+                    bvm_instance_id=bvm_instance_id, report=profile.json()
+                )
+            )
+        session.commit()
+
+
+def acquire_bvm_instance(
+    session: sqlalchemy.orm.Session, bvm_instance_id: int
+) -> tables.BvmInstance:
+    """
+    Mark available BvmInstance as computing, so nothing else changes its
+    Bvm. Release it with release_bvm_instance
+
+    Parameters
+    ----------
+    session : database session
+    bvm_instance_id : ID of BvmInstance
+
+    Raises
+    ------
+    cloud.exceptions.NoSuchBvmInstance :
+        if no record with bvm_instance_id found
+    cloud.exceptions.BvmInstanceBusy :
+        if BvmInstance is computing already
+
+    Returns
+    -------
+    Acquired BvmInstance
+    """
+    instance = (
+        session.query(tables.BvmInstance).filter_by(id=bvm_instance_id).first()
+    )
+    if not instance:
+        raise exceptions.NoSuchBvmInstance(
+            f"No BvmInstance with id={bvm_instance_id}"
+        )
+    acquired = (
+        session.query(tables.BvmInstance)
+        .filter_by(id=bvm_instance_id, state=schemas.BvmState.AVAILABLE)
+        .update({"state": schemas.BvmState.COMPUTING})
+    )
+    session.commit()
+    if not acquired:
+        raise exceptions.BvmInstanceBusy(
+            f"BvmInstance with id={bvm_instance_id} is "
+            f"{instance.state.value}"
+        )
+    alloc.vm_cache.invalidate(bvm_instance_id)
+    try:
+        # job loads vm in other process, so background stores must be done
+        storage.flush(instance.stored_at)
+    except Exception:
+        release_bvm_instance(session.get_bind(), bvm_instance_id)
+        raise
+    return instance
+
+
+def exec_time_limit(
+    request: schemas.ExecRequestSchema | schemas.BatchExecRequestSchema,
+) -> float:
+    """
+    Time limit of request, capped by settings.exec_time_limit
+    """
+    if request.time_limit is None:
+        return settings.exec_time_limit
+    return min(request.time_limit, settings.exec_time_limit)
+
+
+class ExecService:
+    def __init__(
+        self,
+        session: sqlalchemy.orm.Session = fastapi.Depends(database.session),
+        pool: concurrent.futures.Executor = fastapi.Depends(worker_pool),
+    ):
+        self.session = session
+        self.pool = pool
+
+    def submit(
+        self, bvm_instance_id: int, request: schemas.ExecRequestSchema
+    ) -> Job:
+        """
+        Queue execution job for BvmInstance and mark it as computing. Job
+        runs in scheduler.scheduler as job of owner of BvmInstance
+
+        Parameters
+        ----------
+        bvm_instance_id : ID of BvmInstance
+        request : code and input to run
+
+        Raises
+        ------
+        cloud.exceptions.NoSuchBvmInstance :
+            if no record with bvm_instance_id found
+        cloud.exceptions.BvmInstanceBusy :
+            if BvmInstance is computing already
+        cloud.exceptions.QuotaExceeded : if owner exceeded its quota
+        cloud.exceptions.ExecQueueFull : if too many jobs are queued
+
+        Returns
+        -------
+        Queued job
+        """
+        instance = acquire_bvm_instance(self.session, bvm_instance_id)
+        release = functools.partial(
+            release_bvm_instance, self.session.get_bind(), bvm_instance_id
+        )
+        exec_job = ExecJob(
+            instance.owner or scheduler.DEFAULT_TENANT,
+            self.pool,
+            instance.stored_at,
+            request,
+            exec_time_limit(request),
+            release,
+        )
+        try:
+            scheduler.scheduler.submit(exec_job)
+        except Exception:
+            release()
+            raise
+        job = Job(bvm_instance_id, exec_job.future)
+        jobs.add(job)
+        return job
+
+    def submit_batch(
+        self,
+        request: schemas.BatchExecRequestSchema,
+        tenant: str = scheduler.DEFAULT_TENANT,
+    ) -> concurrent.futures.Future:
+        """
+        Queue lockstep run of code on each of stdins in new VMs
+
+        Parameters
+        ----------
+        request : code, stdins and settings of VMs to run
+        tenant : tenant, which the run counts to
+
+        Raises
+        ------
+        ValueError : if memory of VMs exceeds
+            settings.exec_batch_max_bytes
+        cloud.exceptions.QuotaExceeded : if tenant exceeded its quota
+        cloud.exceptions.ExecQueueFull : if too many jobs are queued
+
+        Returns
+        -------
+        Future of results of VMs in order of stdins
+        """
+        itemsize = np.dtype(request.cell_type.value).itemsize
+        memory_bytes = len(request.stdins) * request.memory_size * itemsize
+        if memory_bytes > settings.exec_batch_max_bytes:
+            raise ValueError(
+                f"Batch memory of {memory_bytes} bytes exceeds "
+                f"{settings.exec_batch_max_bytes} bytes"
+            )
+        batch_job = BatchJob(tenant, self.pool, request)
+        scheduler.scheduler.submit(batch_job)
+        batch_job.future.add_done_callback(observe_batch)
+        return batch_job.future
+
+    def get_profile_report(
+        self, bvm_instance_id: int
+    ) -> schemas.ProfileReportSchema:
+        """
+        Get profile report of the last profiled run of BvmInstance
+
+        Raises
+        ------
+        cloud.exceptions.NoSuchProfile :
+            if BvmInstance was not profiled
+        """
+        profile = (
+            self.session.query(tables.BvmProfile)
+            .filter_by(bvm_instance_id=bvm_instance_id)
+            .first()
+        )
+        if profile is None:
+            raise exceptions.NoSuchProfile(
+                f"No profile of BvmInstance with id={bvm_instance_id}"
+            )
+        return schemas.ProfileReportSchema.parse_raw(profile.report)
+
+    @staticmethod
+    def get_job(job_id: str) -> Job:
+        """
+        Get execution job by id
+
+        Raises
+        ------
+        cloud.exceptions.NoSuchJob : if no job with job_id found
+        """
+        job = jobs.get(job_id)
+        if job is None:
+            raise exceptions.NoSuchJob(f"No job with id={job_id}")
+        return job
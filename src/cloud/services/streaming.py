@@ -0,0 +1,183 @@
+import asyncio
+import time
+
+import fastapi
+import sqlalchemy.orm
+
+import bvm
+from cloud import database, metrics, scheduler, schemas, storage
+from cloud.settings import settings
+
+from . import execution
+
+
+class ExecStream:
+    """
+    Run of acquired BvmInstance in time slices of
+    settings.exec_stream_slice seconds, so its output can be sent and its
+    input received in between. Output streamed from stdout is not kept in
+    stored Bvm. The run counts to quota of tenant in scheduler.scheduler
+    """
+
+    def __init__(
+        self,
+        bind: sqlalchemy.engine.Connectable,
+        instance_id: int,
+        stored_at: str,
+        vm: bvm.BrainfuckVM,
+        request: schemas.ExecRequestSchema,
+        interactive: bool,
+        tenant: str = scheduler.DEFAULT_TENANT,
+    ):
+        self.bind = bind
+        self.instance_id = instance_id
+        self.tenant = tenant
+        self.stored_at = stored_at
+        self.vm = vm
+        self.max_steps = request.max_steps
+        self.time_left = execution.exec_time_limit(request)
+        self.interactive = interactive
+        self.stdin = bvm.channels.ByteChannel()
+        self.stdout = bvm.channels.ByteChannel()
+        self.status: bvm.RunStatus | None = None
+        self.seconds = 0.0
+        # budget of max_steps spent by slices, see BrainfuckVM.spent
+        self.spent = 0
+        self._executed_before = vm.executed
+
+    def end_of_input(self) -> None:
+        """
+        Stop waiting for input, "," reads 0 from now on
+        """
+        self.interactive = False
+
+    async def step(self) -> bvm.RunStatus | None:
+        """
+        Run vm for one time slice. Input is taken from stdin and output is
+        put to stdout
+
+        Returns
+        -------
+        Why vm stopped, or None if its time slice is over
+        """
+        self.vm.feed(self.stdin.read())
+        max_steps = None
+        if self.max_steps is not None:
+            max_steps = max(self.max_steps - self.spent, 0)
+        started = time.monotonic()
+        slice_time = min(settings.exec_stream_slice, self.time_left)
+        status = await asyncio.to_thread(
+            self.vm.run, max_steps, started + slice_time, self.interactive
+        )
+        elapsed = time.monotonic() - started
+        self.spent += self.vm.spent
+        self.time_left -= elapsed
+        self.seconds += elapsed
+        self.stdout.write(self.vm.drain())
+        if status is bvm.RunStatus.DEADLINE_EXCEEDED and self.time_left > 0:
+            return None
+        self.status = status
+        return status
+
+    def result(self) -> schemas.StreamResultSchema:
+        return schemas.StreamResultSchema(
+            status=self.status,
+            executed=self.vm.executed,
+            code_ptr=self.vm.code_ptr,
+            program_id=self.program_id(),
+            steps=self.vm.executed - self._executed_before,
+            seconds=self.seconds,
+            profile=execution.profile_report(self.vm),
+        )
+
+    def program_id(self) -> str | None:
+        return bvm.registry.program_id(self.vm.code) if self.vm.code else None
+
+    async def close(self) -> None:
+        """
+        Store vm, write it through VM cache and release its BvmInstance
+        """
+        steps = self.vm.executed - self._executed_before
+        metrics.EXECUTED_STEPS.inc(steps, "stream")
+        metrics.RUN_SECONDS.inc(self.seconds, "stream")
+        scheduler.scheduler.charge(self.tenant, steps, self.seconds)
+        stored = None
+        try:
+            await storage.store_async(self.vm, self.stored_at)
+            stored = self.vm
+        finally:
+            await asyncio.to_thread(
+                execution.release_bvm_instance,
+                self.bind,
+                self.instance_id,
+                execution.profile_report(self.vm),
+                self.program_id(),
+                stored,
+            )
+
+
+class StreamService:
+    def __init__(
+        self,
+        session: sqlalchemy.orm.Session = fastapi.Depends(database.session),
+    ):
+        self.session = session
+
+    def open(
+        self,
+        bvm_instance_id: int,
+        request: schemas.ExecRequestSchema,
+        interactive: bool = False,
+    ) -> ExecStream:
+        """
+        Acquire BvmInstance and load its Bvm to stream its run
+
+        Parameters
+        ----------
+        bvm_instance_id : ID of BvmInstance
+        request : code to upload (code of Bvm is resumed, if not set),
+            initial input, max_steps and time_limit in seconds of the run
+        interactive : wait for input at "," with empty stdin
+
+        Raises
+        ------
+        cloud.exceptions.NoSuchBvmInstance :
+            if no record with bvm_instance_id found
+        cloud.exceptions.BvmInstanceBusy :
+            if BvmInstance is computing already
+        cloud.exceptions.QuotaExceeded :
+            if owner of BvmInstance exceeded its quota
+        ValueError : if code is not uploaded to Bvm
+
+        Returns
+        -------
+        Stream of BvmInstance run. It must be closed
+        """
+        instance = execution.acquire_bvm_instance(
+            self.session, bvm_instance_id
+        )
+        bind = self.session.get_bind()
+        tenant = instance.owner or scheduler.DEFAULT_TENANT
+        try:
+            scheduler.scheduler.check_quota(tenant)
+            vm = storage.load(instance.stored_at)
+            if request.code is not None:
+                vm.upload_code(request.code)
+                vm.code_ptr = 0
+            vm.input(request.stdin)
+            if request.profile:
+                vm.profile = bvm.profiler.Profile()
+            if not vm.code:
+                raise ValueError("No code loaded to BrainfuckVM")
+        except Exception:
+            execution.release_bvm_instance(bind, bvm_instance_id)
+            raise
+        return ExecStream(
+            bind,
+            bvm_instance_id,
+            instance.stored_at,
+            vm,
+            request,
+            interactive,
+            tenant,
+        )
@@ -1,10 +1,45 @@
+import enum
+
 import pydantic
 
 
+class StorageBackend(str, enum.Enum):
+    FILESYSTEM = "filesystem"
+    DATABASE = "database"
+    CAS = "cas"
+    DELTA = "delta"
+
+
 class Settings(pydantic.BaseSettings):
     server_host: str = "127.0.0.1"
     server_port: int = 8000
     database_url: str = "sqlite:///./database.sqlite3"
+    database_async_url: str | None = None
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_pool_timeout: float = 30.0
+    database_sqlite_wal: bool = False
+    database_sqlite_busy_timeout: float = 5.0
+    vm_cache_max_bytes: int = 256 * 1024 * 1024
+    storage_backend: StorageBackend = StorageBackend.FILESYSTEM
+    storage_io_workers: int = 8
+    storage_delta_page_size: int = 4096
+    storage_delta_compact_ratio: float = 1.0
+    alloc_batch_max_size: int = 10000
+    exec_workers: int = 4
+    exec_time_limit: float = 10.0
+    exec_jobs_history: int = 10000
+    exec_stream_slice: float = 0.05
+    exec_slice_time: float = 0.1
+    exec_quantum: float = 0.1
+    exec_queue_max_size: int = 1000
+    exec_tenant_queue_max_size: int = 100
+    exec_tenant_max_steps: int | None = None
+    exec_tenant_max_seconds: float | None = None
+    exec_tenant_quota_period: float = 3600.0
+    exec_batch_max_size: int = 10000
+    exec_batch_max_bytes: int = 256 * 1024 * 1024
+    profile_report_top: int = 20
 
 
 settings = Settings(
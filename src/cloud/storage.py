@@ -0,0 +1,890 @@
+"""
+Storage backends of BrainfuckVM state.
+
+State of BvmInstance is stored at location, kept in
+tables.BvmInstance.stored_at. Location of FilesystemStorage is a path to
+snapshot file, locations of other backends are "<backend>:<key>". So
+instances created before switching settings.storage_backend remain
+readable.
+
+Stores go through write_behind: VMs are written by background threads,
+repeated stores to location, which is not written yet, are coalesced,
+and loads from location wait for its pending stores.
+
+Programs of VMs are kept once in bvm.registry.programs under
+constants.BVM_PROGRAM_ROOT, and snapshots of all backends reference them
+by id.
+"""
+import abc
+import asyncio
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import pathlib
+import threading
+import uuid
+from typing import Callable
+
+import sqlalchemy
+
+import bvm
+from cloud import constants, database, metrics, schemas, tables
+from cloud.settings import StorageBackend, settings
+
+bvm.registry.programs.root = constants.BVM_PROGRAM_ROOT
+
+_io_pool: concurrent.futures.ThreadPoolExecutor | None = None
+_io_pool_lock = threading.Lock()
+
+
+def io_pool() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Get thread pool for parallel storage I/O, create it on first call
+    """
+    global _io_pool
+    with _io_pool_lock:
+        if _io_pool is None:
+            _io_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=settings.storage_io_workers,
+                thread_name_prefix="bvm-storage-io",
+            )
+        return _io_pool
+
+
+def _write_atomic(path: pathlib.Path, data: bytes) -> None:
+    """
+    Write data to temporary file next to path and rename it to path, so
+    path has either old or new data. Directory of path is created, if
+    there is none
+    """
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        f = open(tmp, "wb")
+    except FileNotFoundError:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        f = open(tmp, "wb")
+    with f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _read(path: pathlib.Path) -> bytearray:
+    with open(path, "rb") as f:
+        data = bytearray(os.fstat(f.fileno()).st_size)
+        f.readinto(data)
+    return data
+
+
+def _new_storage_path() -> pathlib.Path:
+    """
+    Path for new file of bvm state. Files are spread over subdirectories
+    by the first chars of their names. Neither file nor its directory is
+    created
+    """
+    name = str(uuid.uuid4())
+    filename = f"vm_{name}{constants.BVM_SNAPSHOT_SUFFIX}"
+    return constants.BVM_STORAGE_ROOT / name[:2] / filename
+
+
+def bvm_storage_path() -> pathlib.Path:
+    """
+    Create new file to store bvm state.
+
+    Returns
+    -------
+    Path to file, where vm state stored
+    """
+    storage_path = _new_storage_path()
+    storage_path.parent.mkdir(parents=True, exist_ok=True)
+    storage_path.touch()
+    return storage_path
+
+
+def _encode(vm: bvm.BrainfuckVM, dest: pathlib.Path) -> bytes:
+    if dest.suffix == constants.BVM_JSON_SUFFIX:
+        return schemas.BrainfuckVMSchema.from_vm(vm).json().encode()
+    return bvm.snapshot.dumps(vm)
+
+
+def _decode(data: bytearray) -> bvm.BrainfuckVM:
+    if bvm.snapshot.is_snapshot(data[: len(bvm.snapshot.MAGIC)]):
+        return bvm.snapshot.loads(data)
+    return schemas.BrainfuckVMSchema(**json.loads(data)).as_vm()
+
+
+def store_bvm(vm: bvm.BrainfuckVM, dest: pathlib.Path) -> None:
+    """
+    Store VM to dest file. VM is exported as JSON, if dest has .json
+    suffix, and stored as binary snapshot otherwise
+
+    Parameters
+    ----------
+    vm : BrainfuckVM to store
+    dest : file, where vm will be stored. Must exists
+
+    Raises
+    ------
+    ValueError : if dest file not exists
+    """
+    if not dest.exists():
+        raise FileNotFoundError(f"File {dest} not exists")
+    _store_file(vm, dest)
+
+
+def _store_file(vm: bvm.BrainfuckVM, dest: pathlib.Path) -> None:
+    # dest is replaced rather than rewritten, as it may be a hard link
+    #  shared with forked VMs
+    data = _encode(vm, dest)
+    metrics.SNAPSHOT_BYTES.observe(len(data), StorageBackend.FILESYSTEM.value)
+    _write_atomic(dest, data)
+
+
+def _read_file_fields(
+    path: pathlib.Path,
+    sections: frozenset[str],
+    memory_start: int,
+    memory_stop: int | None,
+) -> dict:
+    """
+    Read fields of VM from snapshot file, or load it from JSON file
+    """
+    with open(path, "rb") as f:
+        if bvm.snapshot.is_snapshot(f.read(len(bvm.snapshot.MAGIC))):
+            f.seek(0)
+            return bvm.snapshot.read_fields(
+                f, sections, memory_start, memory_stop
+            )
+        f.seek(0)
+        vm = _decode(bytearray(f.read()))
+    return bvm.snapshot.vm_fields(vm, sections, memory_start, memory_stop)
+
+
+def load_vm_from_file(vm_file: pathlib.Path) -> bvm.BrainfuckVM:
+    """
+    Load BrainfuckVM from binary snapshot or JSON file
+
+    Parameters
+    ----------
+    vm_file: file, where vm is stored. Must exists
+
+    Raises
+    ------
+    ValueError : if vm_file file not exists
+
+    Returns
+    -------
+    Loaded BrainfuckVM
+    """
+    if not vm_file.exists():
+        raise FileNotFoundError(f"File {vm_file} not exists")
+    return _decode(_read(vm_file))
+
+
+class VmStorage(abc.ABC):
+    """
+    Storage of BrainfuckVM states by location
+    """
+
+    backend: StorageBackend
+
+    @abc.abstractmethod
+    def new_location(self) -> str:
+        """
+        Reserve location for new VM
+        """
+
+    @abc.abstractmethod
+    def store(self, vm: bvm.BrainfuckVM, location: str) -> None:
+        """
+        Store vm at location
+        """
+
+    @abc.abstractmethod
+    def load(self, location: str) -> bvm.BrainfuckVM:
+        """
+        Load VM from location
+
+        Raises
+        ------
+        FileNotFoundError : if nothing is stored at location
+        """
+
+    @abc.abstractmethod
+    def delete(self, location: str) -> None:
+        """
+        Delete VM stored at location, if any
+        """
+
+    def load_fields(
+        self,
+        location: str,
+        sections: frozenset[str],
+        memory_start: int = 0,
+        memory_stop: int | None = None,
+    ) -> dict:
+        """
+        Read fields of VM stored at location, see bvm.snapshot.read_fields.
+        Storages of snapshots read only requested sections of them, others
+        load the VM
+
+        Raises
+        ------
+        FileNotFoundError : if nothing is stored at location
+        """
+        return bvm.snapshot.vm_fields(
+            self.load(location), sections, memory_start, memory_stop
+        )
+
+    def store_many(
+        self, vms: list[bvm.BrainfuckVM], locations: list[str]
+    ) -> None:
+        """
+        Store each of vms at its location in parallel
+        """
+        list(io_pool().map(self.store, vms, locations))
+
+    def fork(self, location: str, count: int) -> list[str]:
+        """
+        Store count copies of VM stored at location
+
+        Returns
+        -------
+        Locations of copies
+        """
+        vm = self.load(location)
+        locations = [self.new_location() for _ in range(count)]
+        self.store_many([vm] * count, locations)
+        return locations
+
+    def _key(self, location: str) -> str:
+        scheme, _, key = location.partition(":")
+        if scheme != self.backend.value:
+            raise ValueError(f"Location {location} is not in {self.backend}")
+        return key
+
+
+class FilesystemStorage(VmStorage):
+    """
+    Snapshot file per VM
+    """
+
+    backend = StorageBackend.FILESYSTEM
+
+    def new_location(self) -> str:
+        """
+        Path of new snapshot file. File is created on first store
+        """
+        return str(_new_storage_path())
+
+    def store(self, vm: bvm.BrainfuckVM, location: str) -> None:
+        _store_file(vm, pathlib.Path(location))
+
+    def load(self, location: str) -> bvm.BrainfuckVM:
+        return _decode(_read(pathlib.Path(location)))
+
+    def load_fields(
+        self,
+        location: str,
+        sections: frozenset[str],
+        memory_start: int = 0,
+        memory_stop: int | None = None,
+    ) -> dict:
+        return _read_file_fields(
+            pathlib.Path(location), sections, memory_start, memory_stop
+        )
+
+    def delete(self, location: str) -> None:
+        pathlib.Path(location).unlink(missing_ok=True)
+
+    def fork(self, location: str, count: int) -> list[str]:
+        """
+        Hard link copies to snapshot file at location. Files are replaced
+        on store, so copies are separated on their first store
+        """
+        parent = pathlib.Path(location)
+        paths = []
+        try:
+            for _ in range(count):
+                path = _new_storage_path()
+                try:
+                    os.link(parent, path)
+                except FileNotFoundError:
+                    # raises again, if it is parent, which is missing
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    os.link(parent, path)
+                paths.append(path)
+        except Exception:
+            for path in paths:
+                path.unlink(missing_ok=True)
+            raise
+        return [str(path) for path in paths]
+
+
+class DatabaseStorage(VmStorage):
+    """
+    Snapshots in BLOB column of bvm_snapshots table
+    """
+
+    backend = StorageBackend.DATABASE
+
+    def __init__(self, engine: sqlalchemy.engine.Engine):
+        self.engine = engine
+        self.table = tables.BvmSnapshot.__table__
+
+    def new_location(self) -> str:
+        return f"{self.backend.value}:{uuid.uuid4().hex}"
+
+    def store(self, vm: bvm.BrainfuckVM, location: str) -> None:
+        self.store_many([vm], [location])
+
+    def store_many(
+        self, vms: list[bvm.BrainfuckVM], locations: list[str]
+    ) -> None:
+        """
+        Store each of vms at its location in one transaction
+        """
+        keys = [self._key(location) for location in locations]
+        rows = [
+            {"key": key, "data": bvm.snapshot.dumps(vm)}
+            for key, vm in zip(keys, vms)
+        ]
+        for row in rows:
+            metrics.SNAPSHOT_BYTES.observe(
+                len(row["data"]), self.backend.value
+            )
+        with self.engine.begin() as connection:
+            connection.execute(
+                self.table.delete().where(self.table.c.key.in_(keys))
+            )
+            connection.execute(self.table.insert(), rows)
+
+    def _data(self, location: str) -> bytes:
+        with self.engine.connect() as connection:
+            data = connection.execute(
+                sqlalchemy.select(self.table.c.data).where(
+                    self.table.c.key == self._key(location)
+                )
+            ).scalar()
+        if data is None:
+            raise FileNotFoundError(f"No snapshot at {location}")
+        return data
+
+    def load(self, location: str) -> bvm.BrainfuckVM:
+        return bvm.snapshot.loads(bytearray(self._data(location)))
+
+    def load_fields(
+        self,
+        location: str,
+        sections: frozenset[str],
+        memory_start: int = 0,
+        memory_stop: int | None = None,
+    ) -> dict:
+        """
+        Snapshot is fetched whole, but only requested sections of it are
+        parsed
+        """
+        return bvm.snapshot.read_fields(
+            io.BytesIO(self._data(location)),
+            sections,
+            memory_start,
+            memory_stop,
+        )
+
+    def delete(self, location: str) -> None:
+        with self.engine.begin() as connection:
+            connection.execute(
+                self.table.delete().where(
+                    self.table.c.key == self._key(location)
+                )
+            )
+
+    def fork(self, location: str, count: int) -> list[str]:
+        """
+        Copy snapshot at location inside database, without loading it
+        """
+        parent_key = self._key(location)
+        locations = [self.new_location() for _ in range(count)]
+        with self.engine.begin() as connection:
+            for child in locations:
+                copied = connection.execute(
+                    self.table.insert().from_select(
+                        ["key", "data"],
+                        sqlalchemy.select(
+                            sqlalchemy.literal(self._key(child)),
+                            self.table.c.data,
+                        ).where(self.table.c.key == parent_key),
+                    )
+                )
+                if not copied.rowcount:
+                    raise FileNotFoundError(f"No snapshot at {location}")
+        return locations
+
+
+class ContentAddressedStorage(VmStorage):
+    """
+    Snapshots without memory (manifests) refer to memory images by their
+    sha256, so identical memory images are stored once. Images are not
+    deleted with VMs, use collect_garbage for that
+    """
+
+    backend = StorageBackend.CAS
+    DIGEST_LENGTH = 64
+
+    def __init__(self, root: pathlib.Path):
+        self.root = root
+
+    def _manifest_path(self, key: str) -> pathlib.Path:
+        return self.root / "manifests" / key[:2] / key
+
+    def _object_path(self, digest: str) -> pathlib.Path:
+        return self.root / "objects" / digest[:2] / digest[2:]
+
+    def new_location(self) -> str:
+        return f"{self.backend.value}:{uuid.uuid4().hex}"
+
+    def store(self, vm: bvm.BrainfuckVM, location: str) -> None:
+        key = self._key(location)
+        memory = bvm.snapshot.memory_buffer(vm)
+        digest = hashlib.sha256(memory).hexdigest()
+        object_path = self._object_path(digest)
+        if not object_path.exists():
+            metrics.SNAPSHOT_BYTES.observe(len(memory), self.backend.value)
+            _write_atomic(object_path, memory)
+        manifest = digest.encode() + bvm.snapshot.dumps(vm, with_memory=False)
+        metrics.SNAPSHOT_BYTES.observe(len(manifest), self.backend.value)
+        _write_atomic(self._manifest_path(key), manifest)
+
+    def load(self, location: str) -> bvm.BrainfuckVM:
+        manifest = _read(self._manifest_path(self._key(location)))
+        digest = manifest[: self.DIGEST_LENGTH].decode()
+        return bvm.snapshot.loads(
+            manifest[self.DIGEST_LENGTH :],
+            memory=_read(self._object_path(digest)),
+        )
+
+    def load_fields(
+        self,
+        location: str,
+        sections: frozenset[str],
+        memory_start: int = 0,
+        memory_stop: int | None = None,
+    ) -> dict:
+        """
+        Memory image is opened only if memory is requested
+        """
+        manifest = io.BytesIO(_read(self._manifest_path(self._key(location))))
+        digest = manifest.read(self.DIGEST_LENGTH).decode()
+        if "memory" not in sections:
+            # snapshot without memory expects it, but does not read it
+            return bvm.snapshot.read_fields(
+                manifest, sections, memory=io.BytesIO()
+            )
+        with open(self._object_path(digest), "rb") as memory:
+            return bvm.snapshot.read_fields(
+                manifest, sections, memory_start, memory_stop, memory
+            )
+
+    def delete(self, location: str) -> None:
+        self._manifest_path(self._key(location)).unlink(missing_ok=True)
+
+    def fork(self, location: str, count: int) -> list[str]:
+        """
+        Copy manifest at location; memory image is shared by copies
+        """
+        manifest = _read(self._manifest_path(self._key(location)))
+        locations = [self.new_location() for _ in range(count)]
+        for child in locations:
+            _write_atomic(self._manifest_path(self._key(child)), manifest)
+        return locations
+
+    def collect_garbage(self) -> int:
+        """
+        Delete memory images, which no manifest refers to. Must not run
+        concurrently with store
+
+        Returns
+        -------
+        Number of deleted memory images
+        """
+        referenced = set()
+        for manifest in self.root.glob("manifests/*/*"):
+            with open(manifest, "rb") as f:
+                referenced.add(f.read(self.DIGEST_LENGTH).decode())
+        deleted = 0
+        for image in self.root.glob("objects/*/*"):
+            if image.parent.name + image.name not in referenced:
+                image.unlink(missing_ok=True)
+                deleted += 1
+        return deleted
+
+
+class DeltaStorage(VmStorage):
+    """
+    Snapshot file per VM, followed by delta records of memory pages
+    changed since the previous store (see bvm.snapshot). Deltas are
+    appended to file of VM loaded from or stored to it, until they make
+    up compact_ratio of the snapshot. Then, or if file is shared with
+    forks, it is replaced with full snapshot.
+
+    Loaded and stored VMs remember their memory, so it is copy-on-write:
+    write to memory of such VM only after vm.own_memory()
+    """
+
+    backend = StorageBackend.DELTA
+
+    def __init__(
+        self, root: pathlib.Path, page_size: int, compact_ratio: float
+    ):
+        self.root = root
+        self.page_size = page_size
+        self.compact_ratio = compact_ratio
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.root / key[:2] / f"{key}{constants.BVM_SNAPSHOT_SUFFIX}"
+
+    def new_location(self) -> str:
+        return f"{self.backend.value}:{uuid.uuid4().hex}"
+
+    def store(self, vm: bvm.BrainfuckVM, location: str) -> None:
+        path = self._path(self._key(location))
+        if vm.base_tag is not None and vm.base_tag[0] == location:
+            _, size, snapshot_size = vm.base_tag
+            record = bvm.snapshot.dumps_delta(vm, self.page_size)
+            if size + len(record) <= snapshot_size * (1 + self.compact_ratio):
+                with open(path, "ab") as f:
+                    stat = os.fstat(f.fileno())
+                    # file is not replaced nor linked since vm remembered it
+                    if stat.st_size == size and stat.st_nlink == 1:
+                        f.write(record)
+                        metrics.SNAPSHOT_BYTES.observe(
+                            len(record), self.backend.value
+                        )
+                        vm.mark_stored(
+                            (location, size + len(record), snapshot_size)
+                        )
+                        return
+        data = bvm.snapshot.dumps(vm)
+        metrics.SNAPSHOT_BYTES.observe(len(data), self.backend.value)
+        _write_atomic(path, data)
+        vm.mark_stored((location, len(data), len(data)))
+
+    def load(self, location: str) -> bvm.BrainfuckVM:
+        data = _read(self._path(self._key(location)))
+        vm = bvm.snapshot.loads(data)
+        vm.mark_stored((location, len(data), bvm.snapshot.size(data)))
+        return vm
+
+    def load_fields(
+        self,
+        location: str,
+        sections: frozenset[str],
+        memory_start: int = 0,
+        memory_stop: int | None = None,
+    ) -> dict:
+        """
+        File with delta records is loaded whole
+        """
+        return _read_file_fields(
+            self._path(self._key(location)),
+            sections,
+            memory_start,
+            memory_stop,
+        )
+
+    def delete(self, location: str) -> None:
+        self._path(self._key(location)).unlink(missing_ok=True)
+
+    def fork(self, location: str, count: int) -> list[str]:
+        """
+        Hard link copies to file at location. Files are replaced on
+        store, when they are linked, so copies are separated on their
+        first store
+        """
+        parent = self._path(self._key(location))
+        locations = []
+        try:
+            for _ in range(count):
+                child = self.new_location()
+                path = self._path(self._key(child))
+                try:
+                    os.link(parent, path)
+                except FileNotFoundError:
+                    # raises again, if it is parent, which is missing
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    os.link(parent, path)
+                locations.append(child)
+        except Exception:
+            for child in locations:
+                self.delete(child)
+            raise
+        return locations
+
+
+_storages: dict[StorageBackend, VmStorage] = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(backend: StorageBackend | None = None) -> VmStorage:
+    """
+    Get storage of backend, settings.storage_backend by default
+    """
+    backend = StorageBackend(backend or settings.storage_backend)
+    with _storages_lock:
+        if backend not in _storages:
+            if backend is StorageBackend.DATABASE:
+                _storages[backend] = DatabaseStorage(database.engine)
+            elif backend is StorageBackend.CAS:
+                _storages[backend] = ContentAddressedStorage(
+                    constants.BVM_CAS_ROOT
+                )
+            elif backend is StorageBackend.DELTA:
+                _storages[backend] = DeltaStorage(
+                    constants.BVM_DELTA_ROOT,
+                    settings.storage_delta_page_size,
+                    settings.storage_delta_compact_ratio,
+                )
+            else:
+                _storages[backend] = FilesystemStorage()
+        return _storages[backend]
+
+
+def storage_of(location: str) -> VmStorage:
+    """
+    Get storage, which location belongs to
+    """
+    scheme, sep, _ = location.partition(":")
+    if sep and scheme in {backend.value for backend in StorageBackend}:
+        return get_storage(StorageBackend(scheme))
+    return get_storage(StorageBackend.FILESYSTEM)
+
+
+def new_location() -> str:
+    """
+    Reserve location for new VM in storage of settings.storage_backend
+    """
+    return get_storage().new_location()
+
+
+class WriteBehind:
+    """
+    Background writes of VMs to their locations. VM put to location is
+    dirty, until it is written. Putting VM to dirty location replaces
+    the dirty VM, so repeated writes are coalesced into one. Dirty VM
+    must not be changed
+    """
+
+    def __init__(
+        self,
+        write: Callable[[bvm.BrainfuckVM, str], None],
+        max_workers: int,
+    ):
+        self.write = write
+        self.max_workers = max_workers
+        self.coalesced = 0
+        # location -> dirty vm and future of its write
+        self._dirty: dict[
+            str, tuple[bvm.BrainfuckVM, concurrent.futures.Future]
+        ] = {}
+        # location -> future of write in progress
+        self._writing: dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self._pool: concurrent.futures.ThreadPoolExecutor | None = None
+
+    def put(
+        self, vm: bvm.BrainfuckVM, location: str
+    ) -> concurrent.futures.Future:
+        """
+        Mark vm dirty at location
+
+        Returns
+        -------
+        Future, done when vm or VM put after it is written
+        """
+        with self._lock:
+            dirty = self._dirty.get(location)
+            if dirty is None:
+                future = concurrent.futures.Future()
+            else:
+                future = dirty[1]
+                self.coalesced += 1
+                metrics.COALESCED_WRITES.inc()
+            self._dirty[location] = (vm, future)
+            if location not in self._writing:
+                self._writing[location] = future
+                if self._pool is None:
+                    self._pool = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="bvm-storage-write",
+                    )
+                self._pool.submit(self._flush, location)
+        return future
+
+    def _flush(self, location: str) -> None:
+        while True:
+            with self._lock:
+                dirty = self._dirty.pop(location, None)
+                if dirty is None:
+                    del self._writing[location]
+                    return
+                vm, future = dirty
+                self._writing[location] = future
+            try:
+                self.write(vm, location)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(None)
+
+    def _pending(
+        self, location: str | None
+    ) -> list[concurrent.futures.Future]:
+        with self._lock:
+            if location is None:
+                futures = [future for _, future in self._dirty.values()]
+                futures += self._writing.values()
+            elif location in self._dirty:
+                # it is written after the write in progress
+                futures = [self._dirty[location][1]]
+            else:
+                futures = [self._writing.get(location)]
+        # future of discarded write is cancelled
+        return [f for f in futures if f is not None and not f.cancelled()]
+
+    def wait(self, location: str | None = None) -> None:
+        """
+        Wait until VMs put to location (all locations by default) before
+        the call are written or failed
+        """
+        concurrent.futures.wait(self._pending(location))
+
+    def flush(self, location: str | None = None) -> None:
+        """
+        Wait until VMs put to location (all locations by default) before
+        the call are written
+
+        Raises
+        ------
+        Exception of failed write
+        """
+        for future in self._pending(location):
+            future.result()
+
+    def discard(self, location: str) -> None:
+        """
+        Drop dirty VM of location and wait for write in progress
+        """
+        with self._lock:
+            dirty = self._dirty.pop(location, None)
+            writing = self._writing.get(location)
+            if dirty is not None:
+                dirty[1].cancel()
+                if writing is dirty[1]:
+                    # write was not started yet
+                    writing = None
+        if writing is not None:
+            concurrent.futures.wait([writing])
+
+
+def _store(vm: bvm.BrainfuckVM, location: str) -> None:
+    vm_storage = storage_of(location)
+    with metrics.STORAGE_SECONDS.time(vm_storage.backend.value, "store"):
+        vm_storage.store(vm, location)
+
+
+write_behind = WriteBehind(_store, settings.storage_io_workers)
+
+
+def store_later(
+    vm: bvm.BrainfuckVM, location: str
+) -> concurrent.futures.Future:
+    """
+    Store vm at location in background. vm must not be changed until it
+    is stored. Loads from location wait for the store
+
+    Returns
+    -------
+    Future, done when vm or VM stored after it is written
+    """
+    return write_behind.put(vm, location)
+
+
+def store(vm: bvm.BrainfuckVM, location: str) -> None:
+    store_later(vm, location).result()
+
+
+async def store_async(vm: bvm.BrainfuckVM, location: str) -> None:
+    """
+    Store vm at location without blocking event loop
+    """
+    await asyncio.wrap_future(store_later(vm, location))
+
+
+def flush(location: str | None = None) -> None:
+    """
+    Wait for background stores to location, to all locations by default
+
+    Raises
+    ------
+    Exception of failed store
+    """
+    write_behind.flush(location)
+
+
+def store_many(vms: list[bvm.BrainfuckVM], locations: list[str]) -> None:
+    """
+    Store each of vms at its new location. Locations must belong to one
+    storage
+    """
+    if not locations:
+        return
+    vm_storage = storage_of(locations[0])
+    with metrics.STORAGE_SECONDS.time(vm_storage.backend.value, "store_many"):
+        vm_storage.store_many(vms, locations)
+
+
+def load(location: str) -> bvm.BrainfuckVM:
+    write_behind.wait(location)
+    vm_storage = storage_of(location)
+    with metrics.STORAGE_SECONDS.time(vm_storage.backend.value, "load"):
+        return vm_storage.load(location)
+
+
+def load_fields(
+    location: str,
+    sections: frozenset[str] = bvm.snapshot.SECTIONS,
+    memory_start: int = 0,
+    memory_stop: int | None = None,
+) -> dict:
+    """
+    Read fields of VM stored at location without loading it, see
+    VmStorage.load_fields
+    """
+    write_behind.wait(location)
+    vm_storage = storage_of(location)
+    with metrics.STORAGE_SECONDS.time(vm_storage.backend.value, "load_fields"):
+        return vm_storage.load_fields(
+            location, sections, memory_start, memory_stop
+        )
+
+
+async def load_async(location: str) -> bvm.BrainfuckVM:
+    """
+    Load VM from location without blocking event loop
+    """
+    return await asyncio.to_thread(load, location)
+
+
+def delete(location: str) -> None:
+    write_behind.discard(location)
+    vm_storage = storage_of(location)
+    with metrics.STORAGE_SECONDS.time(vm_storage.backend.value, "delete"):
+        vm_storage.delete(location)
+
+
+def fork(location: str, count: int) -> list[str]:
+    write_behind.wait(location)
+    vm_storage = storage_of(location)
+    with metrics.STORAGE_SECONDS.time(vm_storage.backend.value, "fork"):
+        return vm_storage.fork(location, count)
@@ -17,3 +17,25 @@ class BvmInstance(Base):
     stored_at = sqlalchemy.Column(
         sqlalchemy.String(cloud.constants.BVM_STORAGE_MAX_PATH_LENGTH)
     )
+    # id of program of Bvm in bvm.registry.programs
+    program_id = sqlalchemy.Column(sqlalchemy.String(64))
+    # tenant, which created BvmInstance, its runs count to its quota
+    owner = sqlalchemy.Column(sqlalchemy.String(64))
+
+
+class BvmSnapshot(Base):
+    __tablename__ = "bvm_snapshots"
+
+    key = sqlalchemy.Column(sqlalchemy.String(32), primary_key=True)
+    data = sqlalchemy.Column(sqlalchemy.LargeBinary, nullable=False)
+
+
+class BvmProfile(Base):
+    __tablename__ = "bvm_profiles"
+
+    bvm_instance_id = sqlalchemy.Column(
+        sqlalchemy.Integer,
+        sqlalchemy.ForeignKey("bvm_instances.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    report = sqlalchemy.Column(sqlalchemy.Text, nullable=False)
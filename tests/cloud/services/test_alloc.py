@@ -1,20 +1,25 @@
 import datetime
 import json
 import pathlib
+import tempfile
 
 import constants
+import numpy as np
 import pytest
+import sqlalchemy
 import utils
 
 import bvm
+from cloud import database, exceptions, schemas, storage
+from cloud.settings import settings
 from cloud.services import alloc
 
 
 def test_bvm_storage_path():
-    file = alloc.bvm_storage_path()
+    file = storage.bvm_storage_path()
     assert file.exists()
     assert utils.is_uuid4(file.stem[3:])
-    assert file.suffix == ".json"
+    assert file.suffix == ".bvm"
     file.unlink()
 
 
@@ -24,7 +29,7 @@ def test_store_bvm_hp(vm_hello_world_simple_executed: bvm.BrainfuckVM):
     )
     storage_file.touch()
 
-    alloc.store_bvm(vm_hello_world_simple_executed, storage_file)
+    storage.store_bvm(vm_hello_world_simple_executed, storage_file)
     with open(storage_file) as f:
         serialized_vm = json.loads(f.read())
         assert serialized_vm.get("memory_size") == 128
@@ -42,7 +47,7 @@ def test_store_bvm_file_not_found(clear_vm):
     )
 
     try:
-        alloc.store_bvm(clear_vm, storage_file)
+        storage.store_bvm(clear_vm, storage_file)
         pytest.fail("No exception raised; expected FileNotFoundError")
     except FileNotFoundError as e:
         assert str(e) == f"File {storage_file} not exists"
@@ -51,13 +56,13 @@ def test_store_bvm_file_not_found(clear_vm):
 def test_load_vm_from_file_hp(
     serialized_vm_hello_world_simple_executed: pathlib.Path,
 ):
-    vm = alloc.load_vm_from_file(serialized_vm_hello_world_simple_executed)
+    vm = storage.load_vm_from_file(serialized_vm_hello_world_simple_executed)
     assert vm.memory_size == 128
     assert vm.memory_ptr == 0
     assert vm.code != ""
     assert vm.code_ptr == 389
     assert vm.executed == 389
-    assert len(vm.stdin.queue) == 0
+    assert len(vm.stdin) == 0
     assert vm.stdout_as_str() == "Hello World!\n"
 
 
@@ -65,10 +70,370 @@ def test_load_vm_from_file_file_not_found():
     stored_vm = constants.TEST_SERIALIZED_VM_PATH / "not_exists.json"
 
     try:
-        alloc.load_vm_from_file(stored_vm)
+        storage.load_vm_from_file(stored_vm)
         pytest.fail("No exception raised; expected FileNotFoundError")
     except FileNotFoundError as e:
         assert str(e) == f"File {stored_vm} not exists"
 
 
-# TODO: tests for alloc.AllocService
+def test_store_and_load_resumes_run():
+    vm = bvm.BrainfuckVM()
+    vm.upload_code(bvm.code_samples.bubble_sort)
+    vm.input("3985")
+    storage_file = (
+        utils.tmp_for_tests() / f"stored_vm_{datetime.datetime.now()}.json"
+    )
+    storage_file.touch()
+    while vm.run(max_steps=50) is not bvm.RunStatus.FINISHED:
+        storage.store_bvm(vm, storage_file)
+        vm = storage.load_vm_from_file(storage_file)
+    assert vm.stdout_as_str() == "3589"
+
+
+def test_store_and_load_binary_snapshot(
+    vm_hello_world_simple_executed: bvm.BrainfuckVM,
+):
+    storage_file = (
+        utils.tmp_for_tests() / f"stored_vm_{datetime.datetime.now()}.bvm"
+    )
+    storage_file.touch()
+
+    storage.store_bvm(vm_hello_world_simple_executed, storage_file)
+    with open(storage_file, "rb") as f:
+        assert bvm.snapshot.is_snapshot(f.read())
+    vm = storage.load_vm_from_file(storage_file)
+    assert vm.memory_size == 128
+    assert vm.memory.tolist() == vm_hello_world_simple_executed.memory.tolist()
+    assert vm.memory.flags.writeable
+    assert vm.code == vm_hello_world_simple_executed.code
+    assert vm.code_ptr == 389
+    assert vm.executed == 389
+    assert len(vm.stdin) == 0
+    assert vm.stdout_as_str() == "Hello World!\n"
+
+
+def test_vm_cache_lru_eviction_by_footprint():
+    cache = alloc.VmCache(max_bytes=300)
+    vms = [bvm.BrainfuckVM(100) for _ in range(4)]
+    for i, vm in enumerate(vms[:3]):
+        cache.put(i, vm)
+    assert cache.get(0) is vms[0]
+    cache.put(3, vms[3])
+
+    assert cache.get(1) is None
+    assert cache.get(2) is vms[2]
+    assert cache.get(3) is vms[3]
+    cache.invalidate(3)
+    assert cache.get(3) is None
+    cache.put(4, bvm.BrainfuckVM(301))
+    assert cache.get(4) is None
+
+    stats = cache.stats()
+    assert stats.vms == 2
+    assert stats.bytes == 200
+    assert stats.hits == 3
+    assert stats.misses == 3
+    assert stats.evictions == 1
+
+
+def test_vm_cache_drops_vm_loaded_before_invalidate():
+    cache = alloc.VmCache(max_bytes=300)
+    generation = cache.generation(1)
+    stale = bvm.BrainfuckVM(16)
+    # job stores new state and releases instance, while stale is loaded
+    cache.invalidate(1)
+    cache.put(1, stale, generation)
+    assert cache.get(1) is None
+
+    fresh = bvm.BrainfuckVM(16)
+    cache.put(1, fresh, cache.generation(1))
+    assert cache.get(1) is fresh
+
+
+def test_alloc_service_does_not_cache_stale_vm(
+    run_with_async_session, monkeypatch
+):
+    async def test(session):
+        alloc_service = alloc.AsyncAllocService(session)
+        instance, _ = await alloc_service.new_bvm_instance(16)
+        alloc.vm_cache.clear()
+        load = storage.load
+
+        def load_while_job_stores(location):
+            stale = load(location)
+            vm = bvm.BrainfuckVM(16)
+            vm.memory[0] = 7
+            storage.store(vm, location)
+            alloc.vm_cache.invalidate(instance.id)
+            return stale
+
+        monkeypatch.setattr(storage, "load", load_while_job_stores)
+        _, vm = await alloc_service.get_instance_and_vm(instance.id)
+        assert vm.memory[0] == 0
+        monkeypatch.setattr(storage, "load", load)
+
+        _, vm = await alloc_service.get_instance_and_vm(instance.id)
+        assert vm.memory[0] == 7
+        await alloc_service.delete_bvm_instance(instance.id)
+
+    run_with_async_session(test)
+
+
+def test_alloc_service_caches_vm(run_with_async_session):
+    async def test(session):
+        alloc_service = alloc.AsyncAllocService(session)
+        instance, vm = await alloc_service.new_bvm_instance(128)
+        hits = alloc.vm_cache.hits
+
+        _, cached_vm = await alloc_service.get_instance_and_vm(instance.id)
+        assert cached_vm is vm
+        assert alloc.vm_cache.hits == hits + 1
+
+        await alloc_service.delete_bvm_instance(instance.id)
+        assert alloc.vm_cache.get(instance.id) is None
+
+    run_with_async_session(test)
+
+
+def test_new_bvm_instances(run_with_async_session):
+    async def test(session):
+        alloc_service = alloc.AsyncAllocService(session)
+        created = await alloc_service.new_bvm_instances([16, 32, 16])
+
+        assert [vm.memory_size for _, vm in created] == [16, 32, 16]
+        assert len({instance.id for instance, _ in created}) == 3
+        alloc.vm_cache.clear()
+        found = await alloc_service.get_instances_and_vms(
+            [created[2][0].id, -1, created[0][0].id, created[2][0].id]
+        )
+        assert [instance.id for instance, _ in found] == [
+            created[2][0].id,
+            created[0][0].id,
+        ]
+        assert [vm.memory_size for _, vm in found] == [16, 16]
+        for instance, _ in created:
+            storage.delete(instance.stored_at)
+
+    run_with_async_session(test)
+
+
+def test_new_sparse_bvm_instance(run_with_async_session):
+    async def test(session):
+        alloc_service = alloc.AsyncAllocService(session)
+        instance, vm = await alloc_service.new_bvm_instance(
+            2**26, sparse=True
+        )
+        vm.memory[-1] = 5
+        assert alloc.vm_footprint(vm) < 2 * bvm.tape.PAGE_SIZE
+        storage.store(vm, instance.stored_at)
+
+        alloc.vm_cache.clear()
+        _, loaded = await alloc_service.get_instance_and_vm(instance.id)
+        assert loaded.sparse and loaded.memory[-1] == 5
+        schema = schemas.BrainfuckVMSchema.from_vm(loaded)
+        assert schema.memory is None
+        assert list(schema.memory_pages) == [2**26 - bvm.tape.PAGE_SIZE]
+        assert schema.as_vm().memory[-1] == 5
+        await alloc_service.delete_bvm_instance(instance.id)
+
+    run_with_async_session(test)
+
+
+def test_new_bvm_instance_cell_type_and_eof(run_with_async_session):
+    async def test(session):
+        alloc_service = alloc.AsyncAllocService(session)
+        instance, _ = await alloc_service.new_bvm_instance(
+            16,
+            cell_type=bvm.CellType.UINT16,
+            eof=bvm.EofBehavior.UNCHANGED,
+            overflow=bvm.OverflowBehavior.SATURATE,
+        )
+        alloc.vm_cache.clear()
+        _, vm = await alloc_service.get_instance_and_vm(instance.id)
+        schema = schemas.BrainfuckVMSchema.from_vm(vm)
+        assert (schema.cell_type, schema.eof, schema.overflow) == (
+            "uint16",
+            "unchanged",
+            "saturate",
+        )
+        assert schema.as_vm().memory.dtype == np.uint16
+        assert schema.as_vm().overflow is bvm.OverflowBehavior.SATURATE
+        await alloc_service.delete_bvm_instance(instance.id)
+
+    run_with_async_session(test)
+
+
+def test_get_instances_fields(run_with_async_session):
+    async def test(session):
+        alloc_service = alloc.AsyncAllocService(session)
+        created = await alloc_service.new_bvm_instances([16, 32])
+        ids = [instance.id for instance, _ in created]
+        alloc.vm_cache.clear()
+
+        found = await alloc_service.get_instances_fields(
+            [ids[1], -1, ids[0]], None
+        )
+        assert [fields for _, fields in found] == [None, None]
+        misses = alloc.vm_cache.misses
+        _, fields = await alloc_service.get_instance_fields(
+            ids[1], frozenset({"memory"}), 30
+        )
+        assert fields["memory"].tolist() == [0, 0]
+        assert alloc.vm_cache.misses == misses + 1
+        assert alloc.vm_cache.get(ids[1]) is None
+        with pytest.raises(exceptions.NoSuchBvmInstance):
+            await alloc_service.get_instance_fields(-1, None)
+        for instance_id in ids:
+            await alloc_service.delete_bvm_instance(instance_id)
+
+    run_with_async_session(test)
+
+
+def test_select_fields():
+    selected = schemas.select_fields("state,memory_ptr,stdout")
+    assert selected == ({"state"}, {"memory_ptr", "stdout"})
+    assert schemas.bvm_sections(selected[1]) == {"stdout"}
+    with pytest.raises(ValueError):
+        schemas.select_fields("state,nope")
+    # fields schema documents every selectable field
+    assert set(schemas.INSTANCE_FIELDS) <= set(
+        schemas.BvmInstanceFieldsSchema.__fields__
+    )
+    assert set(schemas.BVM_FIELDS) <= set(
+        schemas.BrainfuckVMFieldsSchema.__fields__
+    )
+
+
+def test_new_bvm_instances_invalid_memory_size(run_with_async_session):
+    async def test(session):
+        with pytest.raises(ValueError):
+            await alloc.AsyncAllocService(session).new_bvm_instances([16, 0])
+        count = await session.scalar(
+            sqlalchemy.select(sqlalchemy.func.count()).select_from(
+                alloc.tables.BvmInstance
+            )
+        )
+        assert count == 0
+
+    run_with_async_session(test)
+
+
+def test_fork_bvm_instance(run_with_async_session):
+    async def test(session):
+        alloc_service = alloc.AsyncAllocService(session)
+        instance, vm = await alloc_service.new_bvm_instance(16)
+        vm.upload_code("+")
+        storage.store(vm, instance.stored_at)
+        alloc.vm_cache.invalidate(instance.id)
+
+        forked = await alloc_service.fork_bvm_instance(instance.id, 2)
+        assert len(forked) == 2
+        assert forked[0][1].program is forked[1][1].program
+        for forked_instance, forked_vm in forked:
+            assert forked_instance.id != instance.id
+            assert forked_vm.code == "+"
+            alloc.vm_cache.invalidate(forked_instance.id)
+            _, loaded = await alloc_service.get_instance_and_vm(
+                forked_instance.id
+            )
+            assert loaded.code == "+"
+            await alloc_service.delete_bvm_instance(forked_instance.id)
+        await alloc_service.delete_bvm_instance(instance.id)
+
+    run_with_async_session(test)
+
+
+def test_fork_bvm_instance_invalid_count(run_with_async_session):
+    async def test(session):
+        alloc_service = alloc.AsyncAllocService(session)
+        instance, _ = await alloc_service.new_bvm_instance(16)
+        with pytest.raises(ValueError):
+            await alloc_service.fork_bvm_instance(instance.id, 0)
+        await alloc_service.delete_bvm_instance(instance.id)
+
+    run_with_async_session(test)
+
+
+def test_delete_computing_bvm_instance(run_with_async_session):
+    async def test(session):
+        alloc_service = alloc.AsyncAllocService(session)
+        instance, _ = await alloc_service.new_bvm_instance(16)
+        instance_id, stored_at = instance.id, instance.stored_at
+        table = alloc.tables.BvmInstance
+
+        async def set_state(state):
+            await session.execute(
+                sqlalchemy.update(table)
+                .where(table.id == instance_id)
+                .values(state=state)
+            )
+            await session.commit()
+
+        await set_state(schemas.BvmState.COMPUTING)
+        with pytest.raises(exceptions.BvmInstanceBusy):
+            await alloc_service.delete_bvm_instance(instance_id)
+        state = await session.scalar(
+            sqlalchemy.select(table.state).where(table.id == instance_id)
+        )
+        assert state is schemas.BvmState.COMPUTING
+        assert storage.load(stored_at).memory_size == 16
+
+        await set_state(schemas.BvmState.AVAILABLE)
+        await alloc_service.delete_bvm_instance(instance_id)
+        with pytest.raises(exceptions.NoSuchBvmInstance):
+            await alloc_service.get_instance_and_vm(instance_id)
+
+    run_with_async_session(test)
+
+
+def test_async_alloc_service(run_with_async_session):
+    async def test(session):
+        alloc_service = alloc.AsyncAllocService(session)
+        instance, vm = await alloc_service.new_bvm_instance(16)
+        created = await alloc_service.new_bvm_instances([8, 32])
+        alloc.vm_cache.clear()
+
+        _, loaded = await alloc_service.get_instance_and_vm(instance.id)
+        assert loaded.memory_size == 16
+        found = await alloc_service.get_instances_and_vms(
+            [created[1][0].id, -1, instance.id]
+        )
+        assert [vm.memory_size for _, vm in found] == [32, 16]
+
+        forked = await alloc_service.fork_bvm_instance(instance.id, 2)
+        assert [vm.memory_size for _, vm in forked] == [16, 16]
+        for deleted, _ in [(instance, vm), *created, *forked]:
+            await alloc_service.delete_bvm_instance(deleted.id)
+        with pytest.raises(exceptions.NoSuchBvmInstance):
+            await alloc_service.get_instance_and_vm(instance.id)
+        with pytest.raises(ValueError):
+            await alloc_service.new_bvm_instances([16, 0])
+
+    run_with_async_session(test)
+
+
+def test_engine_options_pool_sqlite_files():
+    memory_url = sqlalchemy.engine.make_url("sqlite://")
+    assert "poolclass" not in database.engine_options(memory_url)
+
+    file_url = sqlalchemy.engine.make_url("sqlite:///./db.sqlite3")
+    options = database.engine_options(file_url)
+    assert options["poolclass"] is sqlalchemy.pool.QueuePool
+    assert options["pool_size"] == settings.database_pool_size
+    assert options["connect_args"]["check_same_thread"] is False
+    async_url = database.async_url(str(file_url))
+    assert async_url.drivername == "sqlite+aiosqlite"
+    assert (
+        database.engine_options(async_url, is_async=True)["poolclass"]
+        is sqlalchemy.pool.AsyncAdaptedQueuePool
+    )
+
+
+def test_enable_sqlite_wal():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = sqlalchemy.create_engine(f"sqlite:///{tmp}/db.sqlite3")
+        database.enable_sqlite_wal(engine)
+        with engine.connect() as connection:
+            mode = connection.exec_driver_sql("PRAGMA journal_mode").scalar()
+        engine.dispose()
+    assert mode == "wal"
@@ -0,0 +1,177 @@
+import concurrent.futures
+
+import pytest
+
+import bvm
+from cloud import exceptions, scheduler, schemas, storage
+from cloud.services import execution
+from cloud.settings import settings
+
+
+@pytest.fixture
+def thread_pool():
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    yield pool
+    pool.shutdown()
+
+
+def test_submit_hp(db_session, new_bvm_instance, thread_pool):
+    instance, _ = new_bvm_instance(128)
+    exec_service = execution.ExecService(db_session, thread_pool)
+
+    job = exec_service.submit(
+        instance.id,
+        schemas.ExecRequestSchema(
+            code=bvm.code_samples.bubble_sort, stdin="3985"
+        ),
+    )
+    result = job.future.result(timeout=10)
+    thread_pool.shutdown()
+
+    assert result.status is bvm.RunStatus.FINISHED
+    assert result.stdout == "3589"
+    assert exec_service.get_job(job.id).state is schemas.JobState.DONE
+    db_session.refresh(instance)
+    assert instance.state is schemas.BvmState.AVAILABLE
+    assert instance.program_id == result.program_id
+    vm = storage.load(instance.stored_at)
+    assert vm.stdout_as_str() == "3589"
+    assert result.program_id == bvm.registry.program_id(vm.code)
+
+
+def test_submit_busy(db_session, new_bvm_instance, thread_pool):
+    instance, _ = new_bvm_instance(128)
+    exec_service = execution.ExecService(db_session, thread_pool)
+    blocker = concurrent.futures.Future()
+    thread_pool.submit(blocker.result)
+    thread_pool.submit(blocker.result)
+
+    job = exec_service.submit(instance.id, schemas.ExecRequestSchema(code="+"))
+    db_session.refresh(instance)
+    assert instance.state is schemas.BvmState.COMPUTING
+    with pytest.raises(exceptions.BvmInstanceBusy):
+        exec_service.submit(instance.id, schemas.ExecRequestSchema())
+    blocker.set_result(None)
+    # instance is released by scheduler, before job is done
+    job.future.result(timeout=10)
+
+
+def test_submit_no_such_instance(db_session, thread_pool):
+    with pytest.raises(exceptions.NoSuchBvmInstance):
+        execution.ExecService(db_session, thread_pool).submit(
+            -1, schemas.ExecRequestSchema()
+        )
+
+
+def test_get_job_not_found():
+    with pytest.raises(exceptions.NoSuchJob):
+        execution.ExecService.get_job("not-a-job")
+
+
+def test_submit_profiled(db_session, new_bvm_instance, thread_pool):
+    instance, _ = new_bvm_instance(128)
+    exec_service = execution.ExecService(db_session, thread_pool)
+    with pytest.raises(exceptions.NoSuchProfile):
+        exec_service.get_profile_report(instance.id)
+
+    job = exec_service.submit(
+        instance.id,
+        schemas.ExecRequestSchema(
+            code=bvm.code_samples.hello_world_optimized, profile=True
+        ),
+    )
+    result = job.future.result(timeout=10)
+    thread_pool.shutdown()
+
+    assert result.stdout == "Hello World!\n"
+    assert result.profile.ops["."] == 13
+    report = exec_service.get_profile_report(instance.id)
+    assert report == result.profile
+    assert report.loops[0].begin == 10
+    assert report.loops[0].iterations == 10
+
+
+def test_submit_runs_in_slices(db_session, new_bvm_instance, thread_pool):
+    instance, _ = new_bvm_instance(128, owner="looping")
+    exec_service = execution.ExecService(db_session, thread_pool)
+    used = scheduler.scheduler.usage("looping").seconds
+
+    job = exec_service.submit(
+        instance.id, schemas.ExecRequestSchema(code="+[]", time_limit=0.35)
+    )
+    result = job.future.result(timeout=10)
+
+    assert result.status is bvm.RunStatus.DEADLINE_EXCEEDED
+    assert result.seconds >= 0.35
+    assert scheduler.scheduler.usage("looping").seconds - used >= 0.35
+    db_session.refresh(instance)
+    assert instance.state is schemas.BvmState.AVAILABLE
+    assert instance.owner == "looping"
+
+
+def test_submit_spin_loop_runs_out_of_steps_in_slices(
+    db_session, new_bvm_instance, thread_pool, monkeypatch
+):
+    monkeypatch.setattr(settings, "exec_slice_time", 0.001)
+    slices = []
+
+    def run_job(*args):
+        slices.append(args)
+        return execution_run_job(*args)
+
+    execution_run_job = execution.run_job
+    monkeypatch.setattr(execution, "run_job", run_job)
+    instance, _ = new_bvm_instance(128)
+    exec_service = execution.ExecService(db_session, thread_pool)
+
+    job = exec_service.submit(
+        instance.id, schemas.ExecRequestSchema(code="+[]", max_steps=100000)
+    )
+    result = job.future.result(timeout=10)
+
+    # loop iterations of each slice count to the budget of the next ones
+    assert result.status is bvm.RunStatus.STEPS_EXHAUSTED
+    assert len(slices) > 1
+    assert result.executed == 1
+
+
+def test_submit_profiled_runs_in_slices(
+    db_session, new_bvm_instance, thread_pool
+):
+    instance, _ = new_bvm_instance(128)
+    exec_service = execution.ExecService(db_session, thread_pool)
+
+    job = exec_service.submit(
+        instance.id,
+        schemas.ExecRequestSchema(code="+[]", time_limit=0.35, profile=True),
+    )
+    result = job.future.result(timeout=10)
+
+    assert result.status is bvm.RunStatus.DEADLINE_EXCEEDED
+    # profile of all slices, not of the last one
+    assert result.profile.ops["+"] == 1
+    assert result.profile.loops[0].entries == 1
+    assert result.profile.loops[0].seconds >= 0.3
+    assert exec_service.get_profile_report(instance.id) == result.profile
+
+
+def test_submit_batch(db_session, thread_pool):
+    exec_service = execution.ExecService(db_session, thread_pool)
+    results = exec_service.submit_batch(
+        schemas.BatchExecRequestSchema(
+            code=bvm.code_samples.bubble_sort, stdins=["3985", "21"]
+        )
+    ).result(timeout=10)
+    assert [r.stdout for r in results] == ["3589", "12"]
+    assert all(r.status is bvm.RunStatus.FINISHED for r in results)
+
+    with pytest.raises(ValueError):
+        exec_service.submit_batch(
+            schemas.BatchExecRequestSchema(
+                code="+", stdins=[""], memory_size=2**40
+            )
+        )
+    with pytest.raises(ValueError):
+        exec_service.submit_batch(
+            schemas.BatchExecRequestSchema(code="[", stdins=[""])
+        ).result(timeout=10)
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+import bvm
+from cloud import exceptions, schemas, storage
+from cloud.services import alloc, streaming
+from cloud.settings import settings
+
+
+async def interact(stream: streaming.ExecStream, inputs: list[bytes]):
+    output = []
+    while True:
+        status = await stream.step()
+        output.append(stream.stdout.read())
+        if status is bvm.RunStatus.WAITING_INPUT:
+            if inputs:
+                stream.stdin.write(inputs.pop(0))
+            else:
+                stream.end_of_input()
+        elif status is not None:
+            break
+    await stream.close()
+    return b"".join(output)
+
+
+def test_stream_interactive(db_session, new_bvm_instance):
+    instance, _ = new_bvm_instance(128)
+    stream = streaming.StreamService(db_session).open(
+        instance.id,
+        schemas.ExecRequestSchema(code=",[.,]", stdin="a"),
+        interactive=True,
+    )
+    db_session.refresh(instance)
+    assert instance.state is schemas.BvmState.COMPUTING
+
+    output = asyncio.run(interact(stream, [b"bc", b"d"]))
+    assert output == b"abcd"
+    assert stream.result().status is bvm.RunStatus.FINISHED
+    db_session.refresh(instance)
+    assert instance.state is schemas.BvmState.AVAILABLE
+    assert alloc.vm_cache.get(instance.id) is stream.vm
+    vm = storage.load(instance.stored_at)
+    assert vm.executed == stream.result().executed
+
+
+def test_stream_steps_exhausted(db_session, new_bvm_instance):
+    instance, _ = new_bvm_instance(128)
+    stream = streaming.StreamService(db_session).open(
+        instance.id, schemas.ExecRequestSchema(code="+[.]", max_steps=10)
+    )
+    assert set(asyncio.run(interact(stream, []))) == {1}
+    assert stream.result().status is bvm.RunStatus.STEPS_EXHAUSTED
+
+
+def test_stream_spin_loop_runs_out_of_steps(
+    db_session, new_bvm_instance, monkeypatch
+):
+    monkeypatch.setattr(settings, "exec_stream_slice", 0.001)
+    instance, _ = new_bvm_instance(128)
+    stream = streaming.StreamService(db_session).open(
+        instance.id, schemas.ExecRequestSchema(code="+[]", max_steps=100000)
+    )
+    slices = 0
+
+    async def run():
+        nonlocal slices
+        while await stream.step() is None:
+            slices += 1
+        await stream.close()
+
+    asyncio.run(run())
+    assert stream.result().status is bvm.RunStatus.STEPS_EXHAUSTED
+    assert slices > 0
+
+
+def test_stream_without_code(db_session, new_bvm_instance):
+    instance, _ = new_bvm_instance(128)
+    with pytest.raises(ValueError):
+        streaming.StreamService(db_session).open(
+            instance.id, schemas.ExecRequestSchema()
+        )
+    db_session.refresh(instance)
+    assert instance.state is schemas.BvmState.AVAILABLE
+    with pytest.raises(exceptions.NoSuchBvmInstance):
+        streaming.StreamService(db_session).open(
+            -1, schemas.ExecRequestSchema()
+        )
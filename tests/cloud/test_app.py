@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+ALLOC_AND_EXIT = """
+from fastapi.testclient import TestClient
+
+from cloud.app import app
+
+with TestClient(app) as client:
+    response = client.post("/cloud/alloc/new", params={"memory_size": 16})
+    assert response.status_code == 200, response.text
+    response = client.delete(
+        "/cloud/alloc/delete",
+        params={"bvm_instance_id": response.json()["id"]},
+    )
+    assert response.status_code == 200, response.text
+"""
+
+
+def test_app_process_exits_after_alloc(tmp_path):
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(sys.path),
+        DATABASE_URL=f"sqlite:///{tmp_path / 'database.sqlite3'}",
+    )
+    # pooled connections of database engines, if not disposed on
+    # shutdown, keep the process from exiting
+    result = subprocess.run(
+        [sys.executable, "-c", ALLOC_AND_EXIT],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        timeout=60,
+    )
+    assert result.returncode == 0, result.stderr.decode()
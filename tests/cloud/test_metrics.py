@@ -0,0 +1,83 @@
+import threading
+
+import sqlalchemy
+
+from cloud import metrics
+
+
+def unregister(*registered: metrics.Metric) -> None:
+    for metric in registered:
+        metrics.REGISTRY.remove(metric)
+
+
+def test_counter_aggregates_threads():
+    counter = metrics.Counter("test_total", "Test counter", ("kind",))
+    try:
+
+        def work():
+            for _ in range(1000):
+                counter.inc(1, "a")
+            counter.inc(0.5, "b")
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert counter.values() == {("a",): 4000, ("b",): 2.0}
+        assert counter.render().splitlines() == [
+            "# HELP test_total Test counter",
+            "# TYPE test_total counter",
+            'test_total{kind="a"} 4000',
+            'test_total{kind="b"} 2',
+        ]
+    finally:
+        unregister(counter)
+
+
+def test_histogram_render():
+    histogram = metrics.Histogram(
+        "test_seconds", "Test histogram", ("route",), buckets=(0.1, 1.0)
+    )
+    try:
+        histogram.observe(0.05, '/a"b')
+        histogram.observe(0.5, '/a"b')
+        histogram.observe(2.0, '/a"b')
+        assert histogram.render().splitlines()[2:] == [
+            'test_seconds_bucket{route="/a\\"b",le="0.1"} 1',
+            'test_seconds_bucket{route="/a\\"b",le="1"} 2',
+            'test_seconds_bucket{route="/a\\"b",le="+Inf"} 3',
+            'test_seconds_sum{route="/a\\"b"} 2.55',
+            'test_seconds_count{route="/a\\"b"} 3',
+        ]
+    finally:
+        unregister(histogram)
+
+
+def test_callback_gauge():
+    gauge = metrics.CallbackGauge(
+        "test_gauge", "Test gauge", ("state",), lambda: {("Free",): 3}
+    )
+    try:
+        assert gauge in metrics.REGISTRY
+        assert gauge.render().splitlines()[1:] == [
+            "# TYPE test_gauge gauge",
+            'test_gauge{state="Free"} 3',
+        ]
+    finally:
+        unregister(gauge)
+
+
+def test_instrument_engine():
+    engine = sqlalchemy.create_engine("sqlite://")
+    metrics.instrument_engine(engine)
+
+    def selects() -> int:
+        # bucket counts and sum of observations
+        state = metrics.DB_QUERY_SECONDS.values().get(("SELECT",), [0])
+        return sum(state[:-1])
+
+    before = selects()
+    with engine.connect() as connection:
+        connection.execute(sqlalchemy.text("select 1"))
+    assert selects() == before + 1
@@ -0,0 +1,88 @@
+import base64
+import json
+
+import numpy as np
+import pytest
+
+import bvm
+from cloud import responses, schemas, tables
+
+
+@pytest.fixture
+def instance():
+    return tables.BvmInstance(
+        id=7, state=schemas.BvmState.AVAILABLE, stored_at="a", program_id=None
+    )
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+@pytest.mark.parametrize("cell_type", list(bvm.CellType))
+def test_vm_instance_json_matches_schema(instance, sparse, cell_type):
+    vm = bvm.BrainfuckVM(10000, sparse=sparse, cell_type=cell_type)
+    vm.upload_code(",[.-]")
+    vm.input("\xff")
+    vm.execute()
+    vm.memory[[1, 9999]] = np.iinfo(vm.memory.dtype).max
+
+    expected = schemas.BvmInstanceSchema(
+        id=instance.id,
+        state=instance.state,
+        stored_at=instance.stored_at,
+        bvm=schemas.BrainfuckVMSchema.from_vm(vm),
+    )
+    encoded = responses.vm_instance_json(instance, vm)
+    assert json.loads(encoded) == json.loads(expected.json())
+
+
+def test_instance_json_fields_and_base64(instance):
+    vm = bvm.BrainfuckVM(8, cell_type=bvm.CellType.UINT16)
+    vm.memory[2] = 258
+    fields = bvm.snapshot.vm_fields(vm, frozenset({"memory"}), 2, 4)
+
+    encoded = responses.instance_json(
+        instance,
+        fields,
+        frozenset({"state"}),
+        frozenset({"memory", "memory_ptr"}),
+        memory_offset=2,
+        memory_encoding=schemas.MemoryEncoding.BASE64,
+    )
+    assert json.loads(encoded) == {
+        "id": 7,
+        "state": "Available",
+        "bvm": {
+            "memory_offset": 2,
+            "memory": base64.b64encode(b"\2\1\0\0").decode(),
+            "memory_pages": None,
+            "memory_ptr": 0,
+        },
+    }
+    assert json.loads(
+        responses.instance_json(instance, None, frozenset(), frozenset())
+    ) == {"id": 7}
+
+
+def test_negotiate():
+    assert responses.negotiate(None) == responses.JSON_MEDIA_TYPE
+    assert responses.negotiate("*/*") == responses.JSON_MEDIA_TYPE
+    assert (
+        responses.negotiate("application/octet-stream")
+        == responses.SNAPSHOT_MEDIA_TYPE
+    )
+    assert (
+        responses.negotiate("application/json;q=0.5, application/octet-stream")
+        == responses.SNAPSHOT_MEDIA_TYPE
+    )
+    assert responses.negotiate("text/html") == responses.JSON_MEDIA_TYPE
+
+
+def test_snapshot_response_embeds_code(tmp_path, monkeypatch):
+    monkeypatch.setattr(bvm.registry.programs, "root", tmp_path)
+    vm = bvm.BrainfuckVM(16)
+    vm.upload_code("+.")
+    response = responses.snapshot_response(vm)
+    assert response.media_type == responses.SNAPSHOT_MEDIA_TYPE
+
+    bvm.registry.programs.clear()
+    monkeypatch.setattr(bvm.registry.programs, "root", None)
+    assert bvm.snapshot.loads(response.body).code == "+."
@@ -0,0 +1,134 @@
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+from cloud import exceptions, scheduler
+
+
+class FakeJob(scheduler.SlicedJob):
+    """
+    Job of slices slices, each taking 1 step and seconds seconds. Its
+    slices wait for gate and are logged by tenant
+    """
+
+    def __init__(
+        self,
+        tenant: str,
+        slices: int,
+        log: list[str],
+        gate: threading.Event,
+        seconds: float = 0.1,
+    ):
+        super().__init__(tenant)
+        self.slices = slices
+        self.log = log
+        self.gate = gate
+        self.seconds = seconds
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def start_slice(self) -> concurrent.futures.Future:
+        self.log.append(self.tenant)
+        return self.pool.submit(self.gate.wait, 10)
+
+    def slice_done(self, future):
+        future.result()
+        self.slices -= 1
+        if not self.slices:
+            self.future.set_result(self.tenant)
+        return 1, self.seconds
+
+
+def new_scheduler(**kwargs) -> scheduler.Scheduler:
+    options = dict(
+        max_running=1,
+        quantum=0.1,
+        max_queued=100,
+        max_tenant_queued=10,
+        quota=scheduler.Quota(),
+    )
+    options.update(kwargs)
+    return scheduler.Scheduler(**options)
+
+
+def test_scheduler_shares_slices_between_tenants():
+    s = new_scheduler()
+    log, gate = [], threading.Event()
+    looping = FakeJob("a", 8, log, gate)
+    s.submit(looping)
+    while not log:
+        time.sleep(0.001)
+    others = [FakeJob("b", 2, log, gate), FakeJob("c", 1, log, gate)]
+    for job in others:
+        s.submit(job)
+    gate.set()
+
+    for job in [looping, *others]:
+        job.future.result(timeout=10)
+    # b and c are not delayed until the loop of a is over, and jobs of
+    # idle tenants go first
+    assert log[:5] == ["a", "c", "b", "a", "b"]
+    assert log[5:] == ["a"] * 6
+    assert s.usage("a").steps == 8
+    assert s.usage("a").jobs == 0
+    assert s.counts() == {("running",): 0, ("waiting",): 0}
+
+
+def test_scheduler_shares_by_run_time():
+    s = new_scheduler()
+    log, gate = [], threading.Event()
+    slow = FakeJob("slow", 10, log, gate, seconds=0.2)
+    s.submit(slow)
+    fast = FakeJob("fast", 20, log, gate, seconds=0.1)
+    s.submit(fast)
+    gate.set()
+
+    slow.future.result(timeout=10)
+    fast.future.result(timeout=10)
+    run = {"slow": 0.0, "fast": 0.0}
+    for tenant in log:
+        run[tenant] += 0.2 if tenant == "slow" else 0.1
+        # apart by at most a slice and a quantum
+        assert abs(run["slow"] - run["fast"]) <= 0.3 + 1e-9
+
+
+def test_scheduler_rejects_when_queues_are_full():
+    s = new_scheduler(max_queued=3, max_tenant_queued=2)
+    log, gate = [], threading.Event()
+    s.submit(FakeJob("a", 1, log, gate))
+    s.submit(FakeJob("a", 1, log, gate))
+    with pytest.raises(exceptions.ExecQueueFull):
+        s.submit(FakeJob("a", 1, log, gate))
+    s.submit(FakeJob("b", 1, log, gate))
+    with pytest.raises(exceptions.ExecQueueFull):
+        s.submit(FakeJob("c", 1, log, gate))
+    assert s.usage("a").jobs == 2
+    gate.set()
+
+
+def test_scheduler_stops_jobs_over_quota():
+    s = new_scheduler(quota=scheduler.Quota(max_steps=3))
+    log, gate = [], threading.Event()
+    gate.set()
+    job = FakeJob("a", 10, log, gate)
+    s.submit(job)
+
+    with pytest.raises(exceptions.QuotaExceeded):
+        job.future.result(timeout=10)
+    assert log == ["a"] * 3
+    with pytest.raises(exceptions.QuotaExceeded):
+        s.submit(FakeJob("a", 1, log, gate))
+    s.check_quota("b")
+    usage = s.usage("a")
+    assert (usage.steps, usage.max_steps, usage.jobs) == (3, 3, 0)
+
+
+def test_scheduler_quota_period():
+    s = new_scheduler(quota=scheduler.Quota(max_seconds=1.0, period=0.2))
+    s.charge("a", 10, 1.0)
+    with pytest.raises(exceptions.QuotaExceeded):
+        s.check_quota("a")
+    time.sleep(0.3)
+    s.check_quota("a")
+    assert s.usage("a").seconds == 0
@@ -0,0 +1,233 @@
+import asyncio
+import pathlib
+import threading
+
+import pytest
+import sqlalchemy
+
+import bvm
+from cloud import settings, storage, tables
+
+
+@pytest.fixture
+def fs_storage():
+    return storage.FilesystemStorage()
+
+
+@pytest.fixture
+def cas_storage(tmp_path):
+    return storage.ContentAddressedStorage(tmp_path)
+
+
+@pytest.fixture
+def delta_storage(tmp_path):
+    return storage.DeltaStorage(tmp_path, page_size=64, compact_ratio=0.5)
+
+
+@pytest.fixture
+def db_storage():
+    engine = sqlalchemy.create_engine("sqlite://")
+    tables.Base.metadata.create_all(engine)
+    yield storage.DatabaseStorage(engine)
+    engine.dispose()
+
+
+@pytest.mark.parametrize("vm_storage", ["cas_storage", "db_storage"])
+def test_store_and_load(
+    vm_storage, request, vm_hello_world_simple_executed: bvm.BrainfuckVM
+):
+    vm_storage = request.getfixturevalue(vm_storage)
+    location = vm_storage.new_location()
+    assert location.startswith(f"{vm_storage.backend.value}:")
+
+    vm_storage.store(vm_hello_world_simple_executed, location)
+    vm = vm_storage.load(location)
+    assert vm.memory.tolist() == vm_hello_world_simple_executed.memory.tolist()
+    assert vm.memory.flags.writeable
+    assert vm.code_ptr == 389
+    assert vm.stdout_as_str() == "Hello World!\n"
+
+    vm.memory[0] = 42
+    vm_storage.store(vm, location)
+    assert vm_storage.load(location).memory[0] == 42
+
+    vm_storage.delete(location)
+    with pytest.raises(FileNotFoundError):
+        vm_storage.load(location)
+
+
+@pytest.mark.parametrize(
+    "vm_storage", ["fs_storage", "cas_storage", "db_storage"]
+)
+def test_fork(vm_storage, request):
+    vm_storage = request.getfixturevalue(vm_storage)
+    location = vm_storage.new_location()
+    vm = bvm.BrainfuckVM(16)
+    vm.memory[0] = 7
+    vm_storage.store(vm, location)
+
+    forks = vm_storage.fork(location, 2)
+    forked = vm_storage.load(forks[0])
+    forked.memory[0] = 8
+    vm_storage.store(forked, forks[0])
+    assert vm_storage.load(location).memory[0] == 7
+    assert vm_storage.load(forks[0]).memory[0] == 8
+    assert vm_storage.load(forks[1]).memory[0] == 7
+    for loc in [location, *forks]:
+        vm_storage.delete(loc)
+
+
+def test_cas_deduplicates_memory_images(cas_storage):
+    locations = [cas_storage.new_location() for _ in range(3)]
+    cas_storage.store_many(
+        [bvm.BrainfuckVM(1024) for _ in locations], locations
+    )
+    assert len(list(cas_storage.root.glob("objects/*/*"))) == 1
+
+    vm = cas_storage.load(locations[0])
+    vm.memory[0] = 1
+    cas_storage.store(vm, locations[0])
+    assert len(list(cas_storage.root.glob("objects/*/*"))) == 2
+    assert cas_storage.collect_garbage() == 0
+
+    cas_storage.delete(locations[0])
+    assert cas_storage.collect_garbage() == 1
+    assert cas_storage.load(locations[1]).memory_size == 1024
+
+
+def test_storage_of_location():
+    assert isinstance(
+        storage.storage_of("/data/vm/ab/vm_ab.bvm"), storage.FilesystemStorage
+    )
+    assert isinstance(
+        storage.storage_of("cas:0123"), storage.ContentAddressedStorage
+    )
+    assert storage.get_storage(
+        settings.StorageBackend.DATABASE
+    ) is storage.storage_of("database:0123")
+
+
+def test_filesystem_new_location_is_lazy(fs_storage):
+    location = pathlib.Path(fs_storage.new_location())
+    assert not location.exists()
+
+    fs_storage.store(bvm.BrainfuckVM(16), str(location))
+    assert fs_storage.load(str(location)).memory_size == 16
+    assert [p.name for p in location.parent.iterdir()] == [location.name]
+    fs_storage.delete(str(location))
+
+
+def test_write_behind_coalesces_writes():
+    started, release = threading.Event(), threading.Event()
+    written = []
+
+    def write(vm, location):
+        started.set()
+        release.wait()
+        written.append((vm.memory_size, location))
+
+    write_behind = storage.WriteBehind(write, max_workers=1)
+    first = write_behind.put(bvm.BrainfuckVM(1), "a")
+    started.wait()
+    # first write is in progress, these are coalesced into one
+    futures = [write_behind.put(bvm.BrainfuckVM(i), "a") for i in (2, 3, 4)]
+    write_behind.put(bvm.BrainfuckVM(5), "b")
+    write_behind.discard("b")
+    release.set()
+    write_behind.flush()
+
+    assert first.done() and all(f is futures[0] for f in futures)
+    assert written == [(1, "a"), (4, "a")]
+    assert write_behind.coalesced == 2
+
+
+def test_write_behind_flush_raises_failed_write():
+    def write(vm, location):
+        raise OSError("disk is full")
+
+    write_behind = storage.WriteBehind(write, max_workers=1)
+    write_behind.put(bvm.BrainfuckVM(1), "a")
+    write_behind.wait("a")
+    write_behind.put(bvm.BrainfuckVM(1), "a")
+    with pytest.raises(OSError):
+        write_behind.flush("a")
+
+
+def test_store_async_and_load_async(fs_storage):
+    async def roundtrip():
+        location = fs_storage.new_location()
+        vm = bvm.BrainfuckVM(16)
+        vm.memory[3] = 3
+        await storage.store_async(vm, location)
+        loaded = await storage.load_async(location)
+        storage.delete(location)
+        return loaded
+
+    assert asyncio.run(roundtrip()).memory[3] == 3
+
+
+def test_delta_storage_appends_and_compacts(delta_storage):
+    location = delta_storage.new_location()
+    path = delta_storage._path(delta_storage._key(location))
+    vm = bvm.BrainfuckVM(1024)
+    vm.upload_code("+>" * 100)
+    delta_storage.store(vm, location)
+    snapshot_size = path.stat().st_size
+
+    vm.run(max_steps=10)
+    delta_storage.store(vm, location)
+    assert snapshot_size < path.stat().st_size < snapshot_size + 256
+    loaded = delta_storage.load(location)
+    assert loaded.memory.tolist() == vm.memory.tolist()
+    assert loaded.code_ptr == vm.code_ptr
+
+    # loaded vm appends to file too, until deltas are half of snapshot
+    for _ in range(20):
+        loaded.run(max_steps=10)
+        delta_storage.store(loaded, location)
+        assert path.stat().st_size <= snapshot_size * 1.5
+    assert delta_storage.load(location).memory[:100].tolist() == [1] * 100
+
+
+def test_delta_storage_fork(delta_storage):
+    location = delta_storage.new_location()
+    vm = bvm.BrainfuckVM(16)
+    vm.upload_code("+")
+    delta_storage.store(vm, location)
+    (fork,) = delta_storage.fork(location, 1)
+
+    forked = delta_storage.load(fork)
+    forked.run()
+    delta_storage.store(forked, fork)
+    vm.run()
+    vm.run()
+    delta_storage.store(vm, location)
+    assert delta_storage.load(location).memory[0] == 1
+    assert delta_storage.load(fork).memory[0] == 1
+    forked.code_ptr = 0
+    forked.run()
+    delta_storage.store(forked, fork)
+    assert delta_storage.load(fork).memory[0] == 2
+
+
+@pytest.mark.parametrize(
+    "vm_storage",
+    ["fs_storage", "cas_storage", "delta_storage", "db_storage"],
+)
+def test_load_fields(vm_storage, request):
+    vm_storage = request.getfixturevalue(vm_storage)
+    location = vm_storage.new_location()
+    vm = bvm.BrainfuckVM(64)
+    vm.upload_code("+>++.")
+    vm.run()
+    vm_storage.store(vm, location)
+
+    fields = vm_storage.load_fields(location, frozenset({"stdout"}))
+    assert fields["memory_ptr"] == 1 and fields["stdout"] == b"\2"
+    assert "memory" not in fields and "code" not in fields
+    fields = vm_storage.load_fields(
+        location, bvm.snapshot.SECTIONS, memory_start=1, memory_stop=3
+    )
+    assert fields["memory"].tolist() == [2, 0]
+    assert fields["code"] == "+>++."
+    vm_storage.delete(location)
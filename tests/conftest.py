@@ -1,5 +1,6 @@
 pytest_plugins = [
     "fixtures.conftest",
+    "fixtures.database",
     "fixtures.vm",
     "fixtures.vm_serialized",
 ]
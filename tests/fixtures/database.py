@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+import sqlalchemy
+from sqlalchemy import orm
+from sqlalchemy.ext import asyncio as sqlalchemy_asyncio
+
+from cloud import database, tables
+from cloud.services import alloc
+
+
+@pytest.fixture
+def db_session(tmp_path):
+    # database file is shared with async engines of new_bvm_instance
+    engine = sqlalchemy.create_engine(
+        f"sqlite:///{tmp_path / 'database.sqlite3'}",
+        connect_args={"check_same_thread": False},
+        poolclass=sqlalchemy.pool.StaticPool,
+    )
+    tables.Base.metadata.create_all(engine)
+    # instance ids restart in every database
+    alloc.vm_cache.clear()
+    with orm.Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+@pytest.fixture
+def new_bvm_instance(db_session):
+    """
+    Create BvmInstance with AsyncAllocService in database of db_session.
+    Returns it loaded by db_session with its Bvm
+    """
+
+    def new(*args, **kwargs):
+        async def main():
+            engine = sqlalchemy_asyncio.create_async_engine(
+                database.async_url(str(db_session.get_bind().url))
+            )
+            try:
+                async with sqlalchemy_asyncio.AsyncSession(
+                    engine, expire_on_commit=False
+                ) as session:
+                    service = alloc.AsyncAllocService(session)
+                    instance, vm = await service.new_bvm_instance(
+                        *args, **kwargs
+                    )
+                    return instance.id, vm
+            finally:
+                await engine.dispose()
+
+        instance_id, vm = asyncio.run(main())
+        return db_session.get(tables.BvmInstance, instance_id), vm
+
+    return new
+
+
+@pytest.fixture
+def run_with_async_session():
+    """
+    Run coroutine function with AsyncSession of new in-memory database
+    """
+
+    def run(test):
+        async def main():
+            engine = sqlalchemy_asyncio.create_async_engine(
+                "sqlite+aiosqlite://", poolclass=sqlalchemy.pool.StaticPool
+            )
+            async with engine.begin() as connection:
+                await connection.run_sync(tables.Base.metadata.create_all)
+            alloc.vm_cache.clear()
+            try:
+                async with sqlalchemy_asyncio.AsyncSession(
+                    engine, expire_on_commit=False
+                ) as session:
+                    return await test(session)
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(main())
+
+    return run
@@ -1,3 +1,6 @@
+import io
+
+import numpy as np
 import pytest
 
 import bvm
@@ -45,3 +48,626 @@ def test_squares(clear_vm):
     clear_vm.upload_code(src)
     clear_vm.execute()
     assert clear_vm.stdout_as_str() == expected_out
+
+
+@pytest.mark.parametrize(
+    ["src", "error"],
+    [
+        ["+[-", "Unmatched '[' at position 1"],
+        ["+]", "Unmatched ']' at position 1"],
+        ["[[]", "Unmatched '[' at position 0"],
+    ],
+)
+def test_upload_code_unbalanced_brackets(clear_vm, src: str, error: str):
+    with pytest.raises(ValueError, match=error.replace("[", "\\[")):
+        clear_vm.upload_code(src)
+
+
+def test_jump_table():
+    program = bvm.compiler.compile_code("+[>[-]<-]")
+    assert program.jumps == (-1, 8, -1, 5, -1, 3, -1, -1, 1)
+
+
+def test_execute_resumes_inside_loop(clear_vm):
+    clear_vm.upload_code(bvm.code_samples.hello_world_optimized)
+    clear_vm.code_ptr = clear_vm.code.index("]")
+    clear_vm.memory[0] = 1
+    clear_vm.execute()
+    assert clear_vm.code_ptr == len(clear_vm.code)
+
+
+@pytest.mark.parametrize(
+    "src",
+    ["+++++[>+<-]>[-]", "++>+++[<[->+<]>-]", "+>>+[<]>[[-]>]"],
+)
+def test_ops_match_execution_of_fused_loops(src: str):
+    op_types = {
+        "+": bvm.BrainfuckOpAdd,
+        "-": bvm.BrainfuckOpSub,
+        "<": bvm.BrainfuckOpLeft,
+        ">": bvm.BrainfuckOpRight,
+        "[": bvm.BrainfuckOpLoopBegin,
+        "]": bvm.BrainfuckOpLoopEnd,
+    }
+    executed, stepped = bvm.BrainfuckVM(), bvm.BrainfuckVM()
+    executed.upload_code(src)
+    executed.execute()
+    stepped.upload_code(src)
+    assert len(stepped.compiled()) < len(src)
+    while stepped.code_ptr < len(stepped.code):
+        op_types[stepped.curr_op](stepped).eval()
+        stepped.code_ptr += 1
+    assert stepped.memory_ptr == executed.memory_ptr
+    assert stepped.memory.tolist() == executed.memory.tolist()
+
+
+@pytest.mark.parametrize(
+    ["src", "inp"],
+    [
+        [bvm.code_samples.hello_world_simple, ""],
+        [bvm.code_samples.hello_world_optimized, ""],
+        [bvm.code_samples.bubble_sort, "3985"],
+        [bvm.code_samples.one_to_ten_squares, ""],
+        ["+++[>+++[>+<-]<-]>>[<+>>>+<<-]+[<]", ""],
+    ],
+)
+def test_optimized_execution_matches_unoptimized(src: str, inp: str):
+    vms = [bvm.BrainfuckVM(), bvm.BrainfuckVM()]
+    for vm in vms:
+        vm.upload_code(src)
+        vm.input(inp)
+    vms[1].program = bvm.compiler.compile_code(vms[1].code)
+    for vm in vms:
+        vm.execute()
+    optimized, unoptimized = vms
+    assert len(optimized.program) < len(unoptimized.program)
+    assert optimized.executed == unoptimized.executed
+    assert optimized.memory_ptr == unoptimized.memory_ptr
+    assert optimized.code_ptr == unoptimized.code_ptr
+    assert optimized.memory.tolist() == unoptimized.memory.tolist()
+    assert optimized.stdout_as_str() == unoptimized.stdout_as_str()
+
+
+def test_optimize_idioms():
+    program = bvm.optimizer.optimize(
+        bvm.compiler.compile_code("+++>>--<[-][->+++<<+>][>>]")
+    )
+    assert program.ops == (
+        bvm.compiler.OP_ADD,
+        bvm.compiler.OP_MOVE,
+        bvm.compiler.OP_ADD,
+        bvm.compiler.OP_MOVE,
+        bvm.compiler.OP_SET,
+        bvm.compiler.OP_MULADD,
+        bvm.compiler.OP_MULADD,
+        bvm.compiler.OP_SET,
+        bvm.compiler.OP_SCAN,
+    )
+    assert program.args == (3, 2, -2, -1, -1, (1, 3), (-1, 1), -1, 2)
+    assert program.counts == (3, 2, 2, 1, 1, 0, 0, 9, 2)
+    assert program.positions == (0, 3, 5, 7, 8, 11, 11, 11, 22)
+
+
+@pytest.mark.parametrize(
+    ["src", "memory_size"],
+    [
+        ["-[->>++<<]", 2],
+        [">+>+><[<++[->>++<<],]", 1],
+        ["+++[->+++>++<<]", 2],
+        ["+++[->+++>++<<]", 3],
+    ],
+)
+def test_fused_loops_on_small_tapes(src: str, memory_size: int):
+    # targets of move/add loops wrap onto their counter cells
+    reference = bvm.BrainfuckVM(memory_size)
+    reference.upload_code(src)
+    reference.program = bvm.compiler.compile_code(reference.code)
+    reference.run(max_steps=10000)
+    vms = [
+        bvm.BrainfuckVM(memory_size, backend) for backend in bvm.BackendType
+    ]
+    for vm in vms:
+        vm.upload_code(src)
+        vm.run(max_steps=10000)
+    batch = bvm.BatchVM(src, [b""], memory_size)
+    batch.run(max_steps=10000)
+    for vm in [*vms, batch.vm(0)]:
+        assert vm.executed == reference.executed
+        assert vm.memory.tolist() == reference.memory.tolist()
+
+
+@pytest.mark.parametrize(
+    "src",
+    [
+        ">+++++[->++>---<<]",
+        "-[->+<]",
+        "+>+>+>+>+<<<<[>]",
+        # no zero cell to stop scan at
+        "+>+>+>+>+>+>+>+[>>]",
+    ],
+)
+def test_fused_loops_run_out_of_steps(src: str):
+    for max_steps in range(1, 30):
+        reference = bvm.BrainfuckVM(8)
+        reference.upload_code(src)
+        reference.program = bvm.compiler.compile_code(reference.code)
+        status = reference.run(max_steps=max_steps)
+        vms = [bvm.BrainfuckVM(8, backend) for backend in bvm.BackendType]
+        for vm in vms:
+            vm.upload_code(src)
+            assert vm.run(max_steps=max_steps) is status
+        batch = bvm.BatchVM(src, [b""], 8)
+        assert batch.run(max_steps=max_steps) == [status]
+        vms.append(batch.vm(0))
+        # fused loop stops at its begin, rather than in its body, and
+        # resumes from there
+        for resumed in (False, True):
+            if resumed:
+                for vm in [reference, *vms]:
+                    vm.run(max_steps=1000)
+            for vm in vms:
+                assert vm.executed == reference.executed
+                assert vm.memory.tolist() == reference.memory.tolist()
+                assert vm.memory_ptr == reference.memory_ptr
+
+
+@pytest.mark.parametrize("backend", list(bvm.BackendType))
+def test_fused_loop_runs_out_of_steps_in_one_run(backend: bvm.BackendType):
+    vm = bvm.BrainfuckVM(backend=backend, cell_type=bvm.CellType.UINT32)
+    vm.upload_code("-[-]")
+    assert vm.run(max_steps=1000) is bvm.RunStatus.STEPS_EXHAUSTED
+    assert vm.executed == 501
+    assert vm.memory[0] == 2**32 - 501
+    assert vm.code_ptr == 1
+
+
+@pytest.mark.parametrize(
+    ["src", "inp"],
+    [
+        [bvm.code_samples.hello_world_optimized, ""],
+        [bvm.code_samples.bubble_sort, "3985"],
+        [bvm.code_samples.one_to_ten_squares, ""],
+        ["+++[>+++[>+<-]<-]>>[<+>>>+<<-]+[<]-[>-]", ""],
+    ],
+)
+def test_jit_backend_matches_interpreter(src: str, inp: str):
+    vms = [
+        bvm.BrainfuckVM(backend=bvm.BackendType.INTERPRETER),
+        bvm.BrainfuckVM(backend=bvm.BackendType.JIT),
+    ]
+    for vm in vms:
+        vm.upload_code(src)
+        vm.input(inp)
+        vm.execute()
+    interpreted, jitted = vms
+    assert jitted.executed == interpreted.executed
+    assert jitted.memory_ptr == interpreted.memory_ptr
+    assert jitted.code_ptr == interpreted.code_ptr
+    assert jitted.memory.tolist() == interpreted.memory.tolist()
+    assert jitted.stdout_as_str() == interpreted.stdout_as_str()
+
+
+def test_jit_backend_caches_function_by_code():
+    jit = bvm.backends.JitBackend()
+    program = bvm.compiler.compile_code("+[-]")
+    assert jit.function(program) is jit.function(
+        bvm.compiler.compile_code("+[-]")
+    )
+
+
+@pytest.mark.parametrize("backend", list(bvm.BackendType))
+def test_run_in_slices(backend: bvm.BackendType):
+    expected = bvm.BrainfuckVM()
+    expected.upload_code(bvm.code_samples.one_to_ten_squares)
+    expected.execute()
+
+    vm = bvm.BrainfuckVM(backend=backend)
+    vm.upload_code(bvm.code_samples.one_to_ten_squares)
+    slices = 1
+    while vm.run(max_steps=100) is bvm.RunStatus.STEPS_EXHAUSTED:
+        slices += 1
+    assert slices > 1
+    assert vm.executed == expected.executed
+    assert vm.stdout_as_str() == expected.stdout_as_str()
+    assert vm.memory.tolist() == expected.memory.tolist()
+
+
+@pytest.mark.parametrize(
+    ["src", "inp", "memory_size"],
+    [
+        [bvm.code_samples.bubble_sort, "3985", 128],
+        [bvm.code_samples.one_to_ten_squares, "", 128],
+        ["+++[>+++[>+<-]<-]>>[<+>>>+<<-]+[<]-[>-]", "", 2**17],
+    ],
+)
+def test_jit_backend_resumes_slices(
+    monkeypatch, src: str, inp: str, memory_size: int
+):
+    expected = bvm.BrainfuckVM(memory_size)
+    expected.upload_code(src)
+    expected.input(inp)
+    expected.execute()
+
+    jit = bvm.backends.get_backend(bvm.BackendType.JIT)
+
+    def interpret(*args):
+        raise AssertionError("slice is run by interpreter")
+
+    monkeypatch.setattr(jit._fallback, "run", interpret)
+    vm = bvm.BrainfuckVM(memory_size, bvm.BackendType.JIT)
+    vm.upload_code(src)
+    vm.input(inp)
+    slices = 1
+    while vm.run(max_steps=7) is bvm.RunStatus.STEPS_EXHAUSTED:
+        slices += 1
+    assert slices > 10
+    assert vm.executed == expected.executed
+    assert vm.memory_ptr == expected.memory_ptr
+    assert vm.memory.tolist() == expected.memory.tolist()
+    assert vm.stdout_as_str() == expected.stdout_as_str()
+
+
+@pytest.mark.parametrize("backend", list(bvm.BackendType))
+def test_run_infinite_loop(backend: bvm.BackendType):
+    vm = bvm.BrainfuckVM(backend=backend)
+    vm.upload_code("+[]")
+    assert vm.run(max_steps=1000) is bvm.RunStatus.STEPS_EXHAUSTED
+    assert vm.spent == 1000
+    assert vm.run(deadline=0) is bvm.RunStatus.DEADLINE_EXCEEDED
+    assert vm.executed == 1
+    assert vm.spent >= bvm.backends.CLOCK_TICKS
+
+
+@pytest.mark.parametrize("backend", list(bvm.BackendType))
+def test_run_breakpoint_and_input(backend: bvm.BackendType):
+    vm = bvm.BrainfuckVM(backend=backend)
+    vm.upload_code(",.#,.")
+    assert vm.run(wait_for_input=True) is bvm.RunStatus.WAITING_INPUT
+    assert vm.code_ptr == 0
+    vm.input("a")
+    assert vm.run(wait_for_input=True) is bvm.RunStatus.BREAKPOINT
+    assert vm.code_ptr == 3
+    assert vm.run(wait_for_input=True) is bvm.RunStatus.WAITING_INPUT
+    vm.input("b")
+    assert vm.run(wait_for_input=True) is bvm.RunStatus.FINISHED
+    assert vm.stdout_as_str() == "ab"
+
+
+@pytest.mark.parametrize("cell_type", list(bvm.CellType))
+@pytest.mark.parametrize("backend", list(bvm.BackendType))
+def test_cell_type_and_eof(cell_type: bvm.CellType, backend: bvm.BackendType):
+    mask = np.iinfo(cell_type.value).max
+    for eof, value in [
+        (bvm.EofBehavior.ZERO, 0),
+        (bvm.EofBehavior.MINUS_ONE, mask),
+        (bvm.EofBehavior.UNCHANGED, 5),
+    ]:
+        vm = bvm.BrainfuckVM(backend=backend, cell_type=cell_type, eof=eof)
+        # fused ops run in one step for any cell width
+        vm.upload_code("-[->+<]>.>+++++,")
+        vm.execute()
+        assert vm.memory.dtype == cell_type.value
+        assert vm.memory[:3].tolist() == [0, mask, value]
+        # output is the low byte of cell
+        assert vm.stdout.getvalue() == b"\xff"
+
+        loaded = bvm.snapshot.loads(bvm.snapshot.dumps(vm))
+        assert (loaded.cell_type, loaded.eof) == (cell_type, eof)
+        assert loaded.memory.tolist() == vm.memory.tolist()
+
+
+@pytest.mark.parametrize("backend", list(bvm.BackendType))
+def test_overflow(backend: bvm.BackendType):
+    src = ">+++++[>" + "+" * 100 + "<-]>."
+    stops = {
+        bvm.OverflowBehavior.WRAP: (bvm.RunStatus.FINISHED, [0, 0, 244]),
+        bvm.OverflowBehavior.SATURATE: (bvm.RunStatus.FINISHED, [0, 0, 255]),
+        bvm.OverflowBehavior.ERROR: (bvm.RunStatus.OVERFLOW, [0, 3, 255]),
+    }
+    for overflow, (status, memory) in stops.items():
+        vm = bvm.BrainfuckVM(4, backend, overflow=overflow)
+        vm.upload_code(src)
+        assert vm.run() is status
+        assert vm.memory[:3].tolist() == memory
+        batch = bvm.BatchVM(src, [b""], 4, overflow=overflow)
+        assert batch.run() == [status]
+        profiled = bvm.BrainfuckVM(4, overflow=overflow)
+        profiled.upload_code(src)
+        profiled.profile = bvm.profiler.Profile()
+        assert profiled.run() is status
+        for other in (batch.vm(0), profiled):
+            assert other.memory.tolist() == vm.memory.tolist()
+            assert other.code_ptr == vm.code_ptr
+            assert other.executed == vm.executed
+        loaded = bvm.snapshot.loads(bvm.snapshot.dumps(vm))
+        assert loaded.overflow is overflow
+        assert vm.fork().overflow is overflow
+
+    # the 256th "+" of cell 2 stops vm, and stops it again on resume
+    assert vm.code_ptr == 63
+    assert vm.run() is bvm.RunStatus.OVERFLOW and vm.code_ptr == 63
+    with pytest.raises(OverflowError):
+        vm.execute()
+    vm = bvm.BrainfuckVM(backend=backend, overflow="saturate")
+    vm.upload_code("--+")
+    vm.execute()
+    assert vm.memory[0] == 1
+
+
+def test_fork_shares_memory_until_write():
+    vm = bvm.BrainfuckVM()
+    vm.upload_code(",[.,]")
+    vm.input("a")
+    vm.run(wait_for_input=True)
+    forked = vm.fork()
+    assert forked.program is vm.program
+    assert np.shares_memory(forked.memory, vm.memory)
+
+    forked.input("bc")
+    forked.run()
+    assert forked.stdout_as_str() == "abc"
+    assert not np.shares_memory(forked.memory, vm.memory)
+    vm.input("d")
+    vm.run()
+    assert vm.stdout_as_str() == "ad"
+
+
+def test_byte_channel():
+    channel = bvm.channels.ByteChannel(b"abc")
+    channel.write(b"def")
+    assert channel.read(2) == b"ab"
+    assert len(channel) == 4
+    assert channel.read() == b"cdef"
+    assert not channel
+    assert channel.read(1) == b""
+
+
+def test_feed_and_drain():
+    vm = bvm.BrainfuckVM()
+    vm.upload_code(",[.,]")
+    vm.feed(b"ab\xff")
+    vm.execute()
+    assert vm.stdout_as_str() == "ab\xff"
+    assert vm.drain() == b"ab\xff"
+    assert vm.drain() == b""
+    assert vm.stdout_as_str() == ""
+
+
+def test_profiler():
+    expected = bvm.BrainfuckVM()
+    expected.upload_code(bvm.code_samples.bubble_sort)
+    expected.input("3985")
+    expected.execute()
+
+    vm = bvm.BrainfuckVM()
+    vm.upload_code(bvm.code_samples.bubble_sort)
+    vm.input("3985")
+    vm.profile = bvm.profiler.Profile()
+    while vm.run(max_steps=500) is bvm.RunStatus.STEPS_EXHAUSTED:
+        pass
+    assert vm.stdout_as_str() == "3589"
+    assert vm.executed == expected.executed
+
+    ops = vm.profile.op_counts()
+    assert ops[","] == 5
+    assert ops["."] == 4
+    assert sum(c for op, c in ops.items() if op not in "[]#") == vm.executed
+    assert sum(vm.profile.positions) == sum(ops.values())
+    loops = vm.profile.loops()
+    assert all(vm.code[begin] == "[" for begin, *_ in loops)
+    assert all(vm.code[end] == "]" for _, end, *_ in loops)
+    # every iteration of loop body ends at its "]"
+    assert ops["]"] == sum(iterations for *_, iterations, _ in loops)
+
+
+def test_delta_snapshots():
+    vm = bvm.BrainfuckVM(10000)
+    vm.upload_code("+.")
+    base = bvm.snapshot.dumps(vm)
+    data = bytearray(base)
+    assert bvm.snapshot.dumps_delta(vm, 4096) is None
+
+    vm.mark_stored()
+    assert not vm.memory.flags.writeable
+    assert vm.dirty_pages(4096).tolist() == []
+    vm.run()
+    assert vm.dirty_pages(4096).tolist() == [0]
+    data += bvm.snapshot.dumps_delta(vm, 4096)
+
+    vm.mark_stored()
+    vm.own_memory()
+    vm.memory[9999] = 7
+    vm.upload_code(">+.")
+    vm.code_ptr = 0
+    vm.run()
+    delta = bvm.snapshot.dumps_delta(vm, 4096)
+    # stdout appended since the previous record and two pages are stored
+    flags, _, _, page_count, _ = bvm.snapshot.DELTA_HEADER.unpack_from(delta)[
+        1:
+    ]
+    assert flags == bvm.snapshot.DELTA_STDOUT_APPENDED
+    assert page_count == 2
+    assert len(delta) < 10000
+    data += delta
+    size = len(data)
+    # truncated record is ignored
+    data += delta[:-1]
+
+    loaded = bvm.snapshot.loads(data)
+    assert bvm.snapshot.size(data) == len(base)
+    assert loaded.memory[:3].tolist() == [1, 1, 0]
+    assert loaded.memory[9999] == 7
+    assert loaded.code == ">+."
+    assert loaded.code_ptr == vm.code_ptr
+    assert loaded.stdout.getvalue() == b"\x01\x01"
+    assert (
+        bvm.snapshot.loads(data[:size]).memory.tolist()
+        == loaded.memory.tolist()
+    )
+
+
+def test_sparse_tape():
+    memory_size = 64 * 1024 * 1024 + 3
+    vm = bvm.BrainfuckVM(memory_size, sparse=True)
+    vm.upload_code("<<+>+>>+.")
+    vm.execute()
+    assert vm.memory[-2:].tolist() == [1, 1]
+    assert vm.memory[1] == 1
+    # the last page is 3 cells long
+    assert bvm.tape.touched_pages(vm.memory).tolist() == [0, 16384]
+
+    data = bvm.snapshot.dumps(vm)
+    assert len(data) < 3 * bvm.tape.PAGE_SIZE
+    assert bvm.snapshot.size(data) == len(data)
+    vm.mark_stored()
+    vm.memory_ptr = vm.code_ptr = 0
+    vm.run()
+    assert vm.dirty_pages(4096).tolist() == [0, 16384]
+    data += bvm.snapshot.dumps_delta(vm, 4096)
+
+    loaded = bvm.snapshot.loads(data)
+    assert loaded.sparse and loaded.memory.flags.writeable
+    assert loaded.memory[-2:].tolist() == [2, 2]
+    assert loaded.memory[:3].tolist() == [0, 2, 0]
+    assert loaded.stdout.getvalue() == b"\x01\x02"
+    assert bvm.tape.resident_bytes(loaded.memory, True) == 2 * 4096
+
+
+@pytest.mark.parametrize("max_steps", [None, 300])
+def test_batch_vm_matches_separate_vms(max_steps: int | None):
+    stdins = [b"3985", b"", b"1", b"9876543210", b"55"]
+    batch = bvm.BatchVM(bvm.code_samples.bubble_sort, stdins)
+    statuses = batch.run(max_steps=max_steps)
+    assert len(batch) == len(statuses) == len(stdins)
+
+    for i, stdin in enumerate(stdins):
+        vm = bvm.BrainfuckVM()
+        vm.upload_code(bvm.code_samples.bubble_sort)
+        vm.feed(stdin)
+        assert statuses[i] is vm.run(max_steps=max_steps)
+        batched = batch.vm(i)
+        assert batched.stdout.getvalue() == vm.stdout.getvalue()
+        assert batched.memory.tolist() == vm.memory.tolist()
+        assert (batched.memory_ptr, batched.code_ptr, batched.executed) == (
+            vm.memory_ptr,
+            vm.code_ptr,
+            vm.executed,
+        )
+        # stopped VM resumes on its own
+        batched.execute()
+        assert batched.stdout.getvalue() == bytes(sorted(stdin))
+    with pytest.raises(ValueError):
+        batch.run()
+
+
+def test_batch_vm_scan_and_deadline():
+    # the second VM has no zero cells to find
+    batch = bvm.BatchVM(",>+>+>+<<<[>]", [b"\0", b"\1"], memory_size=4)
+    assert batch.run(max_steps=100) == [
+        bvm.RunStatus.FINISHED,
+        bvm.RunStatus.STEPS_EXHAUSTED,
+    ]
+    assert batch.code_ptrs.tolist() == [13, 10]
+
+    batch = bvm.BatchVM(",[>,]<[.<]+[]", [b"ab", b"xyz"], memory_size=8)
+    statuses = batch.run(deadline=0)
+    assert statuses == [bvm.RunStatus.DEADLINE_EXCEEDED] * 2
+    assert [s.getvalue() for s in batch.stdouts] == [b"ba", b"zyx"]
+    assert batch.code_ptrs.tolist() == [12, 12]
+
+
+def test_program_registry(tmp_path):
+    registry = bvm.registry.ProgramRegistry(tmp_path)
+    program = registry.register("+[-> comment\n.]")
+    assert program.code == "+[->.]"
+    assert registry.register("+ [ - > . ]") is program
+    key = bvm.registry.program_id(program.code)
+    assert registry.get(key) is program
+    with pytest.raises(ValueError):
+        registry.register("[")
+
+    # other process finds program by id in root, once it is stored
+    other = bvm.registry.ProgramRegistry(tmp_path)
+    assert not list(tmp_path.iterdir())
+    with pytest.raises(KeyError):
+        other.get(key)
+    assert registry.store(program.code) == key
+    assert other.get(key).code == program.code
+    with pytest.raises(KeyError):
+        other.get(bvm.registry.program_id("+"))
+    with pytest.raises(KeyError):
+        bvm.registry.ProgramRegistry().get(key)
+
+    vms = [bvm.BrainfuckVM(16) for _ in range(2)]
+    for vm in vms:
+        vm.upload_code(bvm.code_samples.hello_world_simple)
+    assert vms[0].compiled() is vms[1].compiled()
+
+
+def test_snapshot_references_program(tmp_path, monkeypatch):
+    vm = bvm.BrainfuckVM(16)
+    vm.upload_code(bvm.code_samples.hello_world_simple)
+    vm.run(max_steps=50)
+    monkeypatch.setattr(bvm.registry.programs, "root", None)
+    embedded = bvm.snapshot.dumps(vm)
+
+    monkeypatch.setattr(bvm.registry.programs, "root", tmp_path)
+    data = bvm.snapshot.dumps(vm)
+    assert len(data) < len(embedded)
+    loaded = bvm.snapshot.loads(data)
+    assert loaded.code == vm.code
+    assert loaded.code_ptr == vm.code_ptr
+
+    bvm.registry.programs.clear()
+    monkeypatch.setattr(bvm.registry.programs, "root", tmp_path / "empty")
+    with pytest.raises(ValueError):
+        bvm.snapshot.loads(data)
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_read_fields(sparse: bool):
+    vm = bvm.BrainfuckVM(10000, sparse=sparse, cell_type=bvm.CellType.UINT16)
+    vm.upload_code(",>,.")
+    vm.input("ab")
+    vm.execute()
+    vm.memory[9000] = 7
+    data = bvm.snapshot.dumps(vm)
+
+    fields = bvm.snapshot.read_fields(io.BytesIO(data), frozenset())
+    assert fields == {
+        "memory_size": 10000,
+        "memory_ptr": 1,
+        "code_ptr": 4,
+        "executed": 4,
+        "backend": bvm.BackendType.INTERPRETER,
+        "sparse": sparse,
+        "cell_type": bvm.CellType.UINT16,
+        "eof": bvm.EofBehavior.ZERO,
+        "overflow": bvm.OverflowBehavior.WRAP,
+    }
+    fields = bvm.snapshot.read_fields(
+        io.BytesIO(data), frozenset({"stdout", "memory"}), 1, 9001
+    )
+    assert fields["stdout"] == b"b" and "code" not in fields
+    if sparse:
+        pages = {
+            i: cells.tolist() for i, cells in fields["memory_pages"].items()
+        }
+        assert list(pages) == [1, 8192]
+        assert pages[1][0] == ord("b") and pages[8192][-1] == 7
+    else:
+        assert len(fields["memory"]) == 9000
+        assert fields["memory"][[0, -1]].tolist() == [ord("b"), 7]
+
+    # state of snapshot with delta records is in the records
+    vm.mark_stored()
+    vm.own_memory()
+    vm.memory[0] = 1
+    data += bvm.snapshot.dumps_delta(vm, 64)
+    fields = bvm.snapshot.read_fields(io.BytesIO(data), frozenset({"memory"}))
+    expected = bvm.snapshot.vm_fields(vm, frozenset({"memory"}))
+    if sparse:
+        assert fields["memory_pages"][0][0] == 1
+        assert fields["memory_pages"].keys() == expected["memory_pages"].keys()
+    else:
+        assert fields["memory"].tolist() == expected["memory"].tolist()